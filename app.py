@@ -45,11 +45,27 @@ def check_and_install_dependencies():
 check_and_install_dependencies()
 
 import requests
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 from werkzeug.utils import secure_filename
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import threading
+import re
 import mcserverhelper as mc
+from instances import DEFAULT_INSTANCE, InstanceException, InstanceRegistry
+import jvm_profiles
+from jvm_profiles import JvmProfileException
+from startup_telemetry import REGRESSION_THRESHOLD
+from operations import OperationException, OperationManager
+from restart_scheduler import RestartScheduler, get_schedule, validate_schedule
+import resource_limits
+from resource_limits import ResourceLimitException
+import server_ping
+from hibernation import HibernationManager, get_hibernation
+import backup_store
+from backup_store import BackupStoreException
+import archive_writer
+import compression_policy
+from world_restore import RestoreException
 
 # --- Globals ---
 # 静的ファイルとテンプレートフォルダのパスを正しく設定
@@ -82,7 +98,7 @@ class FakeSocketIO:
     def __init__(self, app):
         self.app = app
 
-    def emit(self, event, data=None, broadcast=False):
+    def emit(self, event, data=None, broadcast=False, **kwargs):
         # 出力を抑制（ログは必要なら logging.debug に切り替え）
         # logging.debug(f"[FakeSocketIO.emit] {event}: {data}")
         return None
@@ -135,21 +151,21 @@ socketio = init_socketio(app)
 
 # --- グローバル変数 ---
 # mcserverhelper.py内のグローバル変数を直接参照・更新する
-# server_process -> mc.server_proc
+# server_process -> mc.server_procs (インスタンスIDごと)
 # ownserver_mc_process -> mc.ownserver_proc
 # ownserver_web_process -> 新しく追加
 ownserver_web_process = None
-log_thread = None
 config = mc.load_config()
 MODRINTH_INSTALLED_FILE = 'modrinth_installed.json'
 
 # --- Helper Functions ---
 def load_installed_projects():
     """Reads the list of installed Modrinth projects from the JSON file."""
-    if not os.path.exists(MODRINTH_INSTALLED_FILE):
+    path = current_instance().path(MODRINTH_INSTALLED_FILE)
+    if not os.path.exists(path):
         return {}
     try:
-        with open(MODRINTH_INSTALLED_FILE, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except (json.JSONDecodeError, IOError):
         return {}
@@ -157,32 +173,59 @@ def load_installed_projects():
 def save_installed_projects(data):
     """Saves the list of installed Modrinth projects to the JSON file."""
     try:
-        with open(MODRINTH_INSTALLED_FILE, 'w', encoding='utf-8') as f:
+        with open(current_instance().path(MODRINTH_INSTALLED_FILE), 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
     except IOError as e:
         print(f"Error saving installed projects file: {e}")
 
-def log_streamer(process):
-    """サーバープロセスの出力を読み取り、WebSocket経由で送信する"""
-    try:
-        # stdoutとstderrはマージされているため、stdoutのみ読み取る
-        for line in iter(process.stdout.readline, ''):
-            socketio.emit('console_output', {'log': line})
-    except Exception as e:
-        logging.error(f"Log streaming error: {e}")
-
-def get_server_status():
-    """サーバーの現在の状態を返す"""
-    if mc.server_proc and mc.server_proc.poll() is None:
-        return "Running"
-    return "Stopped"
+# サーバーインスタンスの一覧 (各インスタンスがコンソール配信・ログ解析・プレイヤー追跡・TPS計測を持つ)
+instances = InstanceRegistry(config, emit=socketio.emit,
+                             is_busy=lambda instance_id: operations.active(instance_id) is not None)
+# 停止・再起動などの時間のかかる操作はバックグラウンドで実行し、進行状況をインスタンスのルームに送る
+operations = OperationManager(
+    on_update=lambda op: instances.get(op.instance_id).emit('operation_update', op.to_dict())
+)
+# Socket.IOのクライアント (sid) -> 表示しているインスタンス
+client_instances = {}
+
+# /api/instances/<インスタンスID>/... へのリクエストを /api/... のルートで処理する
+INSTANCE_PATH_RE = re.compile(r'^/api/instances/([^/]+)/(.+)$')
+
+class InstancePathMiddleware:
+    """URLからインスタンスIDを取り出し、既定のインスタンスと同じルートに渡すWSGIミドルウェア"""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        match = INSTANCE_PATH_RE.match(environ.get('PATH_INFO', ''))
+        if match:
+            environ['mcserverhelper.instance'] = match.group(1)
+            environ['PATH_INFO'] = '/api/' + match.group(2)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = InstancePathMiddleware(app.wsgi_app)
+
+def current_instance():
+    """リクエストの対象のインスタンスを返す (/api/... の場合は既定のインスタンス)"""
+    return instances.get(request.environ.get('mcserverhelper.instance', DEFAULT_INSTANCE))
+
+@app.errorhandler(InstanceException)
+def handle_instance_exception(e):
+    return jsonify(status="Error", message=str(e)), 404
+
+@app.errorhandler(OperationException)
+def handle_operation_exception(e):
+    # 同じインスタンスで実行中の操作のIDを返し、クライアントがその進行状況を追えるようにする
+    return jsonify(status="Busy", message=str(e),
+                   operation_id=e.operation.id if e.operation else None), 409
 
 # --- Web Pages ---
 @app.route('/')
 def index():
-    """メインページを表示します。"""
-    mods_folder_exists = os.path.isdir('mods')
-    plugins_folder_exists = os.path.isdir('plugins')
+    """メインページを表示します。?instance=<インスタンスID> で表示するインスタンスを選ぶ"""
+    inst = instances.get(request.args.get('instance', DEFAULT_INSTANCE))
+    mods_folder_exists = os.path.isdir(inst.path('mods'))
+    plugins_folder_exists = os.path.isdir(inst.path('plugins'))
     return render_template('index.html', 
         mods_folder_exists=mods_folder_exists, 
         plugins_folder_exists=plugins_folder_exists)
@@ -190,28 +233,94 @@ def index():
 @app.route('/api/status')
 def status():
     """Minecraftサーバーの状態をJSONで返す"""
-    return jsonify(status=get_server_status())
+    inst = current_instance()
+    return jsonify(status=inst.status(), sleeping=inst.sleep_listener is not None)
+
+# --- Instances API ---
+@app.route('/api/instances', methods=['GET', 'POST'])
+def instances_route():
+    """インスタンスの一覧を返す / インスタンスを追加する"""
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            inst = instances.create(data.get('id', ''), data.get('settings'))
+        except InstanceException as e:
+            return jsonify(status="Error", message=str(e)), 400
+        return jsonify(status="Success", instance=inst.summary())
+    return jsonify(instances=[inst.summary() for inst in instances.list()])
+
+@app.route('/api/instances/<instance_id>', methods=['DELETE'])
+def delete_instance_route(instance_id):
+    """インスタンスを登録から外す (データフォルダは残す)"""
+    try:
+        instances.remove(instance_id)
+        pinger.forget(instance_id)
+    except InstanceException as e:
+        return jsonify(status="Error", message=str(e)), 400
+    return jsonify(status="Success")
+
+@app.route('/api/console/stats')
+def console_stats_route():
+    """コンソール送信の統計情報 (lines/s, frames/s) を返す"""
+    return jsonify(current_instance().console_stats())
+
+@app.route('/api/players/online')
+def players_online_route():
+    """オンラインのプレイヤー一覧を返す"""
+    return jsonify(current_instance().player_tracker.snapshot())
+
+@app.route('/api/players/history')
+def players_history_route():
+    """プレイヤーのセッション履歴を新しい順に返す"""
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify(status="Error", message="limit must be an integer"), 400
+    return jsonify(sessions=current_instance().player_tracker.history(limit))
+
+@app.route('/api/metrics/tps')
+def metrics_tps_route():
+    """TPS/MSPTの時系列データを返す (tier: 1s, 1m, 1h)"""
+    tier = request.args.get('tier', '1m')
+    since = request.args.get('since', type=float)
+    tps_sampler = current_instance().tps_sampler
+    try:
+        series = tps_sampler.query(tier, since)
+    except ValueError as e:
+        return jsonify(status="Error", message=str(e)), 400
+    return jsonify(tier=tier, software=tps_sampler.software, disabled=tps_sampler.disabled, series=series)
 
 # --- Minecraft Server API ---
 @app.route('/api/start', methods=['POST'])
 def start_server_route():
     """Minecraftサーバーを起動する"""
-    global log_thread
-    if get_server_status() == "Running":
+    inst = current_instance()
+    if inst.status() == "Running":
         return jsonify(status="Already running"), 400
-
-    # WebUIからの設定値を取得
-    xmx = request.json.get('xmx', '2G')
-    xms = request.json.get('xms', '1G')
+    # 復元などの操作の実行中は起動しない (409 と実行中の操作のIDを返す)
+    active = operations.active(inst.id)
+    if active is not None:
+        raise OperationException(f"インスタンス '{inst.id}' では別の操作 ({active.kind}) が実行中です。", active)
+
+    # WebUIからの設定値を取得 (指定がなければインスタンスの設定値を使う)
+    xmx = request.json.get('xmx')
+    xms = request.json.get('xms')
     world_type = request.json.get('world_type', 'default')
+
+    # JVMのプロファイルが指定された場合は、インスタンスの設定として保存する
+    jvm_profile = request.json.get('jvm_profile')
+    if jvm_profile and jvm_profile != inst.cfg.get('jvm_profile'):
+        if jvm_profile not in jvm_profiles.PROFILES:
+            return jsonify(status="Error", message=f"Unknown JVM profile: {jvm_profile}"), 400
+        inst.update_config({'jvm_profile': jvm_profile})
     
     # JARファイルの存在チェック
     # JARファイルの存在チェック
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    jar_path = config.get('jar_path', '').strip()
+    jar_path = inst.cfg.get('jar_path', '').strip()
     
     if not jar_path:
-        socketio.emit('console_output', {'log': "ERROR: server.jarのパスが設定されていません。"})
+        inst.emit('console_output', {'log': "ERROR: server.jarのパスが設定されていません。"})
         return jsonify(status="Error", message="JAR file not configured."), 400
 
     # 1. 絶対パスとしてチェック
@@ -222,51 +331,305 @@ def start_server_route():
         jar_abs_path = os.path.join(script_dir, jar_path)
     
     # デバッグログ
-    socketio.emit('console_output', {'log': f"Checking JAR path: {jar_abs_path}"})
+    inst.emit('console_output', {'log': f"Checking JAR path: {jar_abs_path}"})
 
     if not os.path.exists(jar_abs_path):
         # 3. カレントディレクトリからの相対パスも試す (念のため)
         cwd_abs_path = os.path.abspath(jar_path)
+        # 4. インスタンスのデータフォルダからの相対パスも試す
+        data_abs_path = os.path.abspath(inst.path(jar_path))
         if os.path.exists(cwd_abs_path):
             jar_abs_path = cwd_abs_path
-            socketio.emit('console_output', {'log': f"Found JAR in CWD: {jar_abs_path}"})
+            inst.emit('console_output', {'log': f"Found JAR in CWD: {jar_abs_path}"})
+        elif os.path.exists(data_abs_path):
+            jar_abs_path = data_abs_path
+            inst.emit('console_output', {'log': f"Found JAR in server folder: {jar_abs_path}"})
         else:
-            socketio.emit('console_output', {'log': f"ERROR: server.jarが見つかりません: {jar_abs_path}"})
+            inst.emit('console_output', {'log': f"ERROR: server.jarが見つかりません: {jar_abs_path}"})
             return jsonify(status="Error", message=f"JAR file not found at {jar_abs_path}"), 400
 
-    # 解決した絶対パスを使ってサーバーを起動するための設定コピーを作成
-    run_config = config.copy()
-    run_config['jar_path'] = jar_abs_path
-
-    proc = mc.start_server(run_config, xmx=xmx, xms=xms, world_type=world_type)
+    # 解決した絶対パスを使ってサーバーを起動し、ログのWebUIへのストリーミングを開始する
+    try:
+        proc = inst.start(jar_abs_path, xmx=xmx, xms=xms, world_type=world_type)
+    except (JvmProfileException, InstanceException) as e:
+        inst.emit('console_output', {'log': f"ERROR: {e}"})
+        return jsonify(status="Error", message=str(e)), 400
     if proc:
-        # ログをWebUIにストリーミングするスレッドを開始
-        log_thread = socketio.start_background_task(target=log_streamer, process=mc.server_proc)
-        socketio.emit('status_update', {'status': 'Running'})
+        inst.emit('console_output', {'log': f"JVM: {inst.launch.profile} (-Xmx{inst.launch.xmx} -Xms{inst.launch.xms})"})
+        inst.emit('status_update', {'status': 'Running'})
         return jsonify(status="Started")
     else:
-        socketio.emit('console_output', {'log': "ERROR: サーバーの起動に失敗しました。コンソールログを確認してください。"})
+        inst.emit('console_output', {'log': "ERROR: サーバーの起動に失敗しました。コンソールログを確認してください。"})
         return jsonify(status="Error"), 500
 
+def get_kill_schedule(data, inst):
+    """
+    リクエストの kill_schedule ([terminate するまでの秒数, kill するまでの秒数]) を返す
+    指定がなければインスタンスの設定値を使う
+    """
+    schedule = (data or {}).get('kill_schedule')
+    if schedule is None:
+        return inst.cfg.get('stop_kill_schedule', mc.DEFAULT_CONFIG['stop_kill_schedule'])
+    if (not isinstance(schedule, list) or len(schedule) != 2
+            or not all(isinstance(v, (int, float)) and v >= 0 for v in schedule)):
+        raise ValueError("kill_schedule must be a list of two non-negative numbers.")
+    return schedule
+
 @app.route('/api/stop', methods=['POST'])
 def stop_server_route():
-    """Minecraftサーバーを停止する"""
-    if get_server_status() == "Stopped":
-        return jsonify(status="Already stopped"), 400
-    
-    if mc.stop_server():
-        # mc.stop_server()内で mc.server_proc は None に設定される
-        socketio.emit('status_update', {'status': 'Stopped'})
-        socketio.emit('console_output', {'log': "--- Server stopped ---"})
+    """
+    Minecraftサーバーを停止する
+    停止はバックグラウンドで行い、すぐに操作IDを返す (進行状況は 'operation_update' イベントで通知する)
+    """
+    inst = current_instance()
+    # 休止中の場合はリスナーを終了する (ログインの要求で起動しないようにする)
+    if hibernation.release(inst):
+        inst.emit('status_update', {'status': 'Stopped'})
         return jsonify(status="Stopped")
-    else:
-        return jsonify(status="Error"), 500
+    if inst.status() == "Stopped":
+        return jsonify(status="Already stopped"), 400
+    try:
+        kill_schedule = get_kill_schedule(request.get_json(silent=True), inst)
+    except ValueError as e:
+        return jsonify(status="Error", message=str(e)), 400
+
+    def run(op):
+        stopped = inst.stop(kill_schedule, on_phase=op.set_phase)
+        # mc.stop_server()内で mc.server_procs からプロセスが削除される
+        inst.emit('status_update', {'status': 'Stopped'})
+        inst.emit('console_output', {'log': f"--- Server stopped ({op.phase}) ---"})
+        return {'stopped': stopped}
+
+    op = operations.submit('stop', inst.id, run)
+    return jsonify(status="Stopping", operation_id=op.id), 202
+
+@app.route('/api/restart', methods=['POST'])
+def restart_server_route():
+    """Minecraftサーバーを停止し、前回と同じ設定で起動する (バックグラウンドで行い、すぐに操作IDを返す)"""
+    inst = current_instance()
+    if inst.status() == "Stopped":
+        return jsonify(status="Error", message="Server is not running."), 400
+    try:
+        kill_schedule = get_kill_schedule(request.get_json(silent=True), inst)
+    except ValueError as e:
+        return jsonify(status="Error", message=str(e)), 400
+
+    op = operations.submit('restart', inst.id, lambda op: run_restart(inst, op, kill_schedule))
+    return jsonify(status="Restarting", operation_id=op.id), 202
+
+def run_restart(inst, op, kill_schedule=None):
+    """操作 op としてサーバーを再起動し、状態の変化をWebUIに通知する"""
+    def on_phase(phase):
+        op.set_phase(phase)
+        if phase in ("stopped", "killed"):
+            inst.emit('status_update', {'status': 'Stopped'})
+    try:
+        inst.restart(kill_schedule, on_phase=on_phase)
+    except (InstanceException, JvmProfileException) as e:
+        inst.emit('console_output', {'log': f"ERROR: {e}"})
+        raise
+    inst.emit('console_output', {'log': f"JVM: {inst.launch.profile} (-Xmx{inst.launch.xmx} -Xms{inst.launch.xms})"})
+    inst.emit('status_update', {'status': 'Running'})
+
+# 定期再起動 (予告・save-all・バックアップの後に run_restart で再起動する)
+restart_scheduler = RestartScheduler(instances.list, submit=operations.submit, restart=run_restart)
+restart_scheduler.start()
+
+# アイドル時の休止 (プレイヤーがいないサーバーを停止し、ログインの要求で run_restart により起動する)
+hibernation = HibernationManager(instances.list, submit=operations.submit, restart=run_restart)
+hibernation.start()
+
+@app.route('/api/hibernation', methods=['GET', 'POST'])
+def hibernation_route():
+    """アイドル時の休止の設定と状態 (休止中か・プレイヤーがいない時間) を返す (POSTの場合は設定を更新する)"""
+    inst = current_instance()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        settings = {**get_hibernation(inst.cfg), **data}
+        if not isinstance(settings['idle_minutes'], (int, float)) or settings['idle_minutes'] <= 0:
+            return jsonify(status="Error", message="idle_minutes must be a positive number."), 400
+        inst.update_config({'hibernation': settings})
+    return jsonify(hibernation.state(inst))
+
+@app.route('/api/hibernation/sleep', methods=['POST'])
+def hibernate_now_route():
+    """プレイヤーの有無に関係なく、すぐに休止させる"""
+    inst = current_instance()
+    if inst.status() == "Stopped":
+        return jsonify(status="Error", message="Server is not running."), 400
+    op = operations.submit('hibernate', inst.id, lambda op: hibernation.hibernate(inst, op))
+    return jsonify(status="Hibernating", operation_id=op.id), 202
+
+@app.route('/api/hibernation/wake', methods=['POST'])
+def wake_route():
+    """休止中のサーバーを起動する"""
+    inst = current_instance()
+    if inst.sleep_listener is None:
+        return jsonify(status="Error", message="Server is not hibernating."), 400
+    op = hibernation.wake(inst)
+    return jsonify(status="Starting", operation_id=op.id), 202
+
+@app.route('/api/restart/schedule', methods=['GET', 'POST'])
+def restart_schedule_route():
+    """定期再起動の設定・次の実行時刻・履歴を返す (POSTの場合は設定を更新する)"""
+    inst = current_instance()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify(status="Error", message="The schedule must be an object."), 400
+        try:
+            schedule = validate_schedule({**get_schedule(inst.cfg), **data})
+        except ValueError as e:
+            return jsonify(status="Error", message=str(e)), 400
+        inst.update_config({'restart_schedule': schedule})
+        restart_scheduler.reschedule(inst)
+    next_run = restart_scheduler.next_run(inst)
+    return jsonify(schedule=get_schedule(inst.cfg),
+                   next_run=next_run.isoformat() if next_run else None,
+                   history=restart_scheduler.history(inst))
+
+@app.route('/api/restart/schedule/run', methods=['POST'])
+def run_scheduled_restart_route():
+    """定期再起動の手順 (予告・save-all・バックアップ・再起動) をすぐに開始する"""
+    inst = current_instance()
+    if inst.status() == "Stopped":
+        return jsonify(status="Error", message="Server is not running."), 400
+    op = restart_scheduler.run_now(inst)
+    return jsonify(status="Restarting", operation_id=op.id), 202
+
+@app.route('/api/restart/schedule/cancel', methods=['POST'])
+def cancel_scheduled_restart_route():
+    """予告中の定期再起動を取り消す"""
+    if restart_scheduler.cancel(current_instance().id):
+        return jsonify(status="Cancelled")
+    return jsonify(status="Error", message="No scheduled restart in progress."), 400
+
+@app.route('/api/crashes')
+def crashes_route():
+    """クラッシュの履歴と自動再起動の状態を返す"""
+    inst = current_instance()
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(supervisor=inst.supervisor.state(), crashes=inst.supervisor.history(limit))
+
+@app.route('/api/crashes/reset', methods=['POST'])
+def reset_crashes_route():
+    """自動再起動の待機や、クラッシュの繰り返しによる停止を解除する"""
+    inst = current_instance()
+    inst.supervisor.reset()
+    return jsonify(status="Success", supervisor=inst.supervisor.state())
+
+@app.route('/api/resources', methods=['GET', 'POST'])
+def resources_route():
+    """
+    リソース制御 (CPUアフィニティ・nice/ionice・cgroup) の設定と、実際に適用されている値・使用量を返す
+    POSTの場合は設定を保存し、起動中ならアフィニティと優先度をすぐに適用する
+    """
+    inst = current_instance()
+    errors = []
+    if request.method == 'POST':
+        try:
+            errors = inst.set_resources(request.get_json(silent=True) or {})
+        except ResourceLimitException as e:
+            return jsonify(status="Error", message=str(e)), 400
+    return jsonify(**inst.resource_usage(), supported=resource_limits.supported(), errors=errors)
+
+@app.route('/api/resources/all')
+def all_resources_route():
+    """すべてのインスタンスのリソースの使用量を返す (負荷の高いインスタンスを見つけるため)"""
+    return jsonify(instances=[inst.resource_usage() for inst in instances.list()],
+                   supported=resource_limits.supported())
+
+# ゲームポートと ownserver の公開アドレスに定期的にステータスを問い合わせる
+ownserver_mc_endpoint = None # ownserver (MC) の公開アドレス (host, port)
+pinger = server_ping.ServerPinger(
+    instances.list,
+    interval=config.get('ping_interval', 5),
+    public_endpoints=lambda: {DEFAULT_INSTANCE: ownserver_mc_endpoint} if ownserver_mc_endpoint else {}
+)
+pinger.start()
+
+@app.route('/api/ping')
+def ping_route():
+    """
+    サーバーの状態 (起動中・受け入れ可能・応答なし)・MOTD・オンライン人数・応答時間を返す
+    refresh=1 の場合はすぐに問い合わせる
+    """
+    inst = current_instance()
+    result = pinger.result(inst.id)
+    if result is None or request.args.get('refresh') == '1':
+        result = pinger.probe(inst)
+    return jsonify(result)
+
+@app.route('/api/ping/probe')
+def ping_probe_route():
+    """任意のアドレスにステータスを問い合わせる (ヘルパーが管理していないサーバーの確認用)"""
+    host = request.args.get('host', '').strip()
+    port = request.args.get('port', server_ping.DEFAULT_PORT, type=int)
+    if not host or not 0 < port < 65536:
+        return jsonify(status="Error", message="host and port are required."), 400
+    return jsonify(server_ping.try_ping(host, port, config.get('ping_timeout', server_ping.DEFAULT_TIMEOUT)))
+
+@app.route('/api/operations')
+def list_operations():
+    """このインスタンスの操作 (実行中・完了済み) を新しい順に返す"""
+    inst = current_instance()
+    return jsonify([op.to_dict() for op in operations.list(inst.id)])
+
+@app.route('/api/operations/<op_id>')
+def get_operation(op_id):
+    op = operations.get(op_id)
+    if op is None:
+        return jsonify(status="Error", message="Operation not found."), 404
+    return jsonify(op.to_dict())
+
+@app.route('/api/jvm/profiles')
+def jvm_profiles_route():
+    """JVMのプロファイルの一覧と、ホストのメモリ量から決めたヒープサイズを返す"""
+    inst = current_instance()
+    profiles = []
+    for profile in jvm_profiles.list_profiles():
+        try:
+            launch = inst.plan_jvm() if profile['id'] == inst.cfg.get('jvm_profile') else None
+            heap = jvm_profiles.recommend_heap(profile['id'], instance_count=inst.jvm_instance_count())
+            profile['recommended_xmx'] = jvm_profiles.format_size(heap)
+            profile['planned'] = launch._asdict() if launch else None
+        except JvmProfileException as e:
+            profile['error'] = str(e)
+        profiles.append(profile)
+    total = jvm_profiles.total_memory()
+    return jsonify(
+        profiles=profiles,
+        current=inst.cfg.get('jvm_profile', jvm_profiles.DEFAULT_PROFILE),
+        host_memory_mb=total // jvm_profiles.MB if total else None,
+        running=inst.launch._asdict() if inst.launch and inst.is_running() else None
+    )
+
+@app.route('/api/jvm/launches')
+def jvm_launches_route():
+    """このインスタンスの起動に使ったJVMの設定の履歴を新しい順に返す"""
+    return jsonify(launches=current_instance().jvm_launches())
+
+@app.route('/api/startup/history')
+def startup_history_route():
+    """起動時間の履歴を新しい順に返す"""
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify(status="Error", message="limit must be an integer"), 400
+    return jsonify(history=current_instance().startup.history(limit))
+
+@app.route('/api/startup/regressions')
+def startup_regressions_route():
+    """JAR・Mod/プラグイン・JVMの設定を変えた前後の起動時間を比べる"""
+    threshold = request.args.get('threshold', REGRESSION_THRESHOLD, type=float)
+    changes = current_instance().startup.regressions(threshold)
+    return jsonify(changes=changes, regressions=[c for c in changes if c['regression']])
 
 @app.route('/api/open_folder', methods=['POST'])
 def open_folder_route():
     """サーバーフォルダを開く"""
     try:
-        path = os.getcwd()
+        path = os.path.abspath(current_instance().data_dir)
         if os.name == 'nt':
             os.startfile(path)
         elif os.name == 'posix':
@@ -280,15 +643,35 @@ def open_folder_route():
 @app.route('/api/command', methods=['POST'])
 def command_route():
     """サーバーにコマンドを送信する"""
-    if get_server_status() == "Stopped":
+    inst = current_instance()
+    if inst.status() == "Stopped":
         return jsonify(status="Server is not running"), 400
     
     command = request.json.get('command')
     if not command:
         return jsonify(error="Command is empty"), 400
+
+    wait = request.json.get('wait')
+    if wait:
+        try:
+            timeout = float(request.json.get('timeout', 3.0))
+        except (TypeError, ValueError):
+            return jsonify(status="Error", message="timeout must be a number"), 400
+        if not timeout > 0:
+            return jsonify(status="Error", message="timeout must be a positive number"), 400
+        # 待ち時間は 0.1 秒から 30 秒の範囲に収める
+        timeout = min(max(timeout, 0.1), 30.0)
         
-    socketio.emit('console_output', {'log': f"> {command}"}) # コマンドをエコーバック
-    if mc.send_command(command):
+    inst.emit('console_output', {'log': f"> {command}"}) # コマンドをエコーバック
+
+    # wait が指定された場合は、コマンドの出力を待って返す
+    if wait:
+        lines = inst.send_command_and_wait(command, timeout=timeout)
+        if lines is None:
+            return jsonify(status="Error sending command"), 500
+        return jsonify(status="Command sent", output=[record.line for record in lines])
+
+    if inst.send_command(command):
         return jsonify(status="Command sent")
     else:
         return jsonify(status="Error sending command"), 500
@@ -296,7 +679,8 @@ def command_route():
 @app.route('/api/quick_command', methods=['POST'])
 def quick_command_route():
     """一般的な管理コマンドを簡単に実行する"""
-    if get_server_status() == "Stopped":
+    inst = current_instance()
+    if inst.status() == "Stopped":
         return jsonify(status="Server is not running"), 400
 
     data = request.json
@@ -321,8 +705,8 @@ def quick_command_route():
     # 他のコマンドもここに追加可能
 
     if command:
-        socketio.emit('console_output', {'log': f"> {command}"})
-        if mc.send_command(command):
+        inst.emit('console_output', {'log': f"> {command}"})
+        if inst.send_command(command):
             return jsonify(status="Command sent")
         else:
             return jsonify(status="Error sending command"), 500
@@ -340,9 +724,10 @@ def upload_mod_route():
     if file:
         filename = secure_filename(file.filename)
         # フォルダが存在することを確認
-        if not os.path.isdir('mods'):
-             os.makedirs('mods')
-        file.save(os.path.join('mods', filename))
+        target_dir = current_instance().path('mods')
+        if not os.path.isdir(target_dir):
+             os.makedirs(target_dir)
+        file.save(os.path.join(target_dir, filename))
         socketio.emit('console_output', {'log': f"Mod '{filename}' がアップロードされました。"})
         return jsonify(status="Success", filename=filename)
     return jsonify(status="Error", message="不明なエラー"), 500
@@ -358,9 +743,10 @@ def upload_plugin_route():
     if file:
         filename = secure_filename(file.filename)
         # フォルダが存在することを確認
-        if not os.path.isdir('plugins'):
-            os.makedirs('plugins')
-        file.save(os.path.join('plugins', filename))
+        target_dir = current_instance().path('plugins')
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        file.save(os.path.join(target_dir, filename))
         socketio.emit('console_output', {'log': f"Plugin '{filename}' がアップロードされました。"})
         return jsonify(status="Success", filename=filename)
     return jsonify(status="Error", message="不明なエラー"), 500
@@ -379,12 +765,12 @@ def list_files_in_dir(directory):
 @app.route('/api/mods', methods=['GET'])
 def list_mods_route():
     """modsフォルダ内のファイル一覧を返す"""
-    return jsonify(files=list_files_in_dir('mods'))
+    return jsonify(files=list_files_in_dir(current_instance().path('mods')))
 
 @app.route('/api/plugins', methods=['GET'])
 def list_plugins_route():
     """pluginsフォルダ内のファイル一覧を返す"""
-    return jsonify(files=list_files_in_dir('plugins'))
+    return jsonify(files=list_files_in_dir(current_instance().path('plugins')))
 
 @app.route('/api/installed_projects', methods=['GET'])
 def list_installed_projects_route():
@@ -398,7 +784,7 @@ def delete_mod_route(filename):
     if safe_filename != filename:
         return jsonify(status="Error", message="無効なファイル名です。"), 400
     
-    file_path = os.path.join('mods', safe_filename)
+    file_path = current_instance().path('mods', safe_filename)
     
     try:
         if os.path.isfile(file_path):
@@ -424,7 +810,7 @@ def delete_plugin_route(filename):
     if safe_filename != filename:
         return jsonify(status="Error", message="無効なファイル名です。"), 400
         
-    file_path = os.path.join('plugins', safe_filename)
+    file_path = current_instance().path('plugins', safe_filename)
     
     try:
         if os.path.isfile(file_path):
@@ -613,6 +999,7 @@ def modrinth_install_route():
         target_dir = 'mods'
     
     socketio.emit('console_output', {'log': f"配置先ディレクトリ: {target_dir}"})
+    target_dir = current_instance().path(target_dir)
 
     # Get version details to find the file URL
     version_info = modrinth_client.get_version(version_id)
@@ -826,18 +1213,18 @@ def install_server_software_route():
         
         # ダウンロード実行
         socketio.emit('console_output', {'log': f"サーバーソフトウェア '{filename}' をダウンロード中..."})
-        downloaded_path = sw_download_file(download_url, '.', filename)
+        inst = current_instance()
+        downloaded_path = sw_download_file(download_url, inst.data_dir, filename)
 
         if downloaded_path:
             socketio.emit('console_output', {'log': f"'{filename}' のダウンロードが完了しました。"})
             
             # 設定を更新
-            global config
-            config['jar_path'] = os.path.basename(downloaded_path)
-            mc.save_config(config)
-            socketio.emit('console_output', {'log': f"サーバーJARパスを '{config['jar_path']}' に設定しました。"})
+            jar_path = os.path.basename(downloaded_path)
+            inst.update_config({'jar_path': jar_path})
+            socketio.emit('console_output', {'log': f"サーバーJARパスを '{jar_path}' に設定しました。"})
 
-            return jsonify(status="Success", message=f"{filename} をダウンロードしました", jar_path=config['jar_path'])
+            return jsonify(status="Success", message=f"{filename} をダウンロードしました", jar_path=jar_path)
         else:
             socketio.emit('console_output', {'log': f"ERROR: '{filename}' のダウンロードに失敗しました。"})
             return jsonify(status="Error", message="ダウンロードに失敗しました。"), 500
@@ -885,14 +1272,21 @@ def stop_all_services_logic():
     print("すべてのサービスを停止しています...")
     socketio.emit('console_output', {'log': "--- すべてのサービスを停止しています ---"})
 
-    # 1. Minecraftサーバーを停止
-    if get_server_status() == "Running":
-        print("Minecraftサーバーを停止しています...")
-        if mc.stop_server():
-            socketio.emit('status_update', {'status': 'Stopped'})
-            socketio.emit('console_output', {'log': "Minecraftサーバーを停止しました。"})
+    # 1. Minecraftサーバーを停止 (起動中のインスタンスを並行して停止する)
+    def stop_instance(inst):
+        print(f"Minecraftサーバー ({inst.id}) を停止しています...")
+        if inst.stop():
+            inst.emit('status_update', {'status': 'Stopped'})
+            inst.emit('console_output', {'log': "Minecraftサーバーを停止しました。"})
         else:
-            socketio.emit('console_output', {'log': "Minecraftサーバーは既に停止していました。"})
+            inst.emit('console_output', {'log': "Minecraftサーバーは既に停止していました。"})
+
+    stop_threads = [threading.Thread(target=stop_instance, args=(inst,))
+                    for inst in instances.list() if inst.is_running()]
+    for t in stop_threads:
+        t.start()
+    for t in stop_threads:
+        t.join()
 
     # 2. ownserver (MC) を停止
     if mc.ownserver_proc and mc.ownserver_proc.poll() is None:
@@ -910,7 +1304,12 @@ def stop_all_services_logic():
 
 # --- Ownserver API ---
 def ownserver_log_callback(log_type, line):
+    global ownserver_mc_endpoint
     socketio.emit('ownserver_log', {'type': log_type, 'log': line})
+    # 公開アドレスをステータスの問い合わせ先に加える
+    match = re.search(r'tcp://([^:\s/]+):(\d+)', line)
+    if log_type == 'mc' and match:
+        ownserver_mc_endpoint = (match.group(1), int(match.group(2)))
     # URLが含まれる行のみコンソールに表示
     if "tcp://" in line:
         print(f"\n[公開URL] {line}")
@@ -934,6 +1333,8 @@ def start_ownserver_mc():
 
 @app.route('/api/ownserver/mc/stop', methods=['POST'])
 def stop_ownserver_mc():
+    global ownserver_mc_endpoint
+    ownserver_mc_endpoint = None
     if mc.stop_ownserver():
         socketio.emit('ownserver_status_update', {'type': 'mc', 'status': 'Stopped'})
         return jsonify(status="Stopped")
@@ -958,63 +1359,174 @@ def stop_ownserver_web():
 # --- Backup API ---
 @app.route('/api/backups')
 def list_backups_route():
-    return jsonify(backups=mc.list_backups(config))
+    return jsonify(backups=mc.list_backups(current_instance().cfg), formats=archive_writer.available_formats())
 
 @app.route('/api/backups/create', methods=['POST'])
 def create_backup_route():
-    if get_server_status() == "Running":
-        mc.send_command("say バックアップを開始します。サーバーが一時的に停止する可能性があります。")
-        mc.send_command("save-all")
-        socketio.sleep(5) # save-allが完了するのを少し待つ
+    inst = current_instance()
+    if inst.status() == "Running":
+        inst.send_command("say バックアップを開始します。サーバーが一時的に停止する可能性があります。")
 
-    result = mc.backup_world(config)
+    # 起動中の場合は自動保存を止め、save-all flush の完了を待ってから読み込む
+    result = inst.backup_world()
     if result:
-        if get_server_status() == "Running":
-            mc.send_command("say バックアップが完了しました。")
+        if inst.status() == "Running":
+            inst.send_command("say バックアップが完了しました。")
         return jsonify(status="Success", filename=os.path.basename(result))
     return jsonify(status="Error"), 500
 
 @app.route('/api/backups/restore', methods=['POST'])
 def restore_backup_route():
-    if get_server_status() == "Running":
+    """
+    バックアップを復元する (バックグラウンドで行い、すぐに操作IDを返す)
+    展開の進行状況は 'restore_progress' で、完了・失敗は 'operation_update' で通知する
+    """
+    inst = current_instance()
+    if inst.status() == "Running":
         return jsonify(status="Error", message="サーバーを停止してから復元してください。"), 400
     
     filename = request.json.get('filename')
     if not filename:
         return jsonify(status="Error", message="ファイル名が指定されていません。"), 400
 
-    success, message = mc.restore_backup(config, filename)
+    def run(op):
+        def on_progress(progress):
+            if progress['phase'] != op.phase:
+                op.set_phase(progress['phase'])
+            inst.emit('restore_progress', {'filename': filename, **progress})
+        success, message = mc.restore_backup(inst.cfg, filename, instance_id=inst.id, on_progress=on_progress)
+        inst.emit('console_output', {'log': f"--- {message} ---"})
+        if not success:
+            raise RestoreException(message)
+        return {'message': message}
+
+    op = operations.submit('restore', inst.id, run)
+    return jsonify(status="Restoring", operation_id=op.id), 202
+
+@app.route('/api/backups/delete', methods=['POST'])
+def delete_backup_route():
+    """バックアップを削除する (スナップショットの場合は不要になったチャンクも削除する)"""
+    filename = (request.get_json(silent=True) or {}).get('filename')
+    if not filename:
+        return jsonify(status="Error", message="ファイル名が指定されていません。"), 400
+    success, message = mc.delete_backup(current_instance().cfg, filename)
     if success:
         return jsonify(status="Success", message=message)
-    return jsonify(status="Error", message=message), 500
+    return jsonify(status="Error", message=message), 400
+
+@app.route('/api/backups/snapshots')
+def list_snapshots_route():
+    """スナップショットの一覧 (ファイル数・変更のなかったファイル数・新規データ量) とチャンクストアの使用量を返す"""
+    inst = current_instance()
+    bakdir = inst.path(inst.cfg['backup_dir'])
+    snapshots = []
+    for name in backup_store.list_snapshots(bakdir):
+        try:
+            snapshots.append(backup_store.describe(backup_store.load_manifest(bakdir, name)))
+        except BackupStoreException as e:
+            snapshots.append({'name': name, 'error': str(e)})
+    return jsonify(snapshots=snapshots, store=backup_store.store_usage(bakdir))
+
+@app.route('/api/backups/policy', methods=['GET', 'POST'])
+def backup_policy_route():
+    """バックアップの圧縮ポリシー (除外・無圧縮にするファイルのパターン) を返す (POSTの場合は更新する)"""
+    inst = current_instance()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        policy = {**compression_policy.get_policy(inst.cfg), **data}
+        for key in ('exclude', 'store'):
+            if not isinstance(policy[key], list) or not all(isinstance(p, str) and p for p in policy[key]):
+                return jsonify(status="Error", message=f"{key} must be a list of patterns."), 400
+        inst.update_config({'backup_policy': {key: policy[key] for key in ('exclude', 'store')}})
+    return jsonify(compression_policy.get_policy(inst.cfg))
+
+@app.route('/api/backups/files')
+def snapshot_files_route():
+    """スナップショット内のファイルの一覧を返す (prefix で絞り込める)"""
+    inst = current_instance()
+    prefix = request.args.get('prefix', '')
+    try:
+        manifest = backup_store.load_manifest(inst.path(inst.cfg['backup_dir']), request.args.get('name', ''))
+    except BackupStoreException as e:
+        return jsonify(status="Error", message=str(e)), 404
+    files = [{'path': rel, 'size': entry['size'], 'mtime': entry['mtime_ns'] / 1e9}
+             for rel, entry in sorted(manifest['files'].items()) if rel.startswith(prefix)]
+    return jsonify(name=manifest['name'], files=files)
+
+@app.route('/api/backups/download')
+def snapshot_download_route():
+    """スナップショット内の1つのファイルをダウンロードする"""
+    inst = current_instance()
+    bakdir = inst.path(inst.cfg['backup_dir'])
+    rel = request.args.get('path', '')
+    try:
+        manifest = backup_store.load_manifest(bakdir, request.args.get('name', ''))
+    except BackupStoreException as e:
+        return jsonify(status="Error", message=str(e)), 404
+    if rel not in manifest['files']:
+        return jsonify(status="Error", message=f"スナップショットに '{rel}' はありません。"), 404
+    return Response(backup_store.read_file(bakdir, manifest, rel), mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename="{secure_filename(os.path.basename(rel))}"',
+                             'Content-Length': str(backup_store.restored_size(backup_store.chunk_store(bakdir),
+                                                                              manifest['files'][rel]))})
+
+# --- Log Search API ---
+from log_index import LogIndexException
+
+@app.route('/api/logs/search')
+def logs_search_route():
+    """latest.log とローテートされたログを検索する"""
+    query = request.args.get('q', '')
+    start = request.args.get('from')
+    end = request.args.get('to')
+    levels_str = request.args.get('level', '')
+    levels = [l.strip() for l in levels_str.split(',') if l.strip()] or None
+    order = request.args.get('order', 'desc')
+    try:
+        limit = min(int(request.args.get('limit', 200)), 5000)
+    except ValueError:
+        return jsonify(status="Error", message="limit must be an integer"), 400
+
+    try:
+        index = current_instance().get_log_index()
+        # 検索のたびに増えた分だけ取り込む (gzアーカイブは初回のみ)
+        index.update()
+        started = time.perf_counter()
+        results = index.search(query, start=start, end=end, levels=levels, limit=limit, order=order)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except LogIndexException as e:
+        return jsonify(status="Error", message=str(e)), 400
+    return jsonify(results=results, count=len(results), elapsed_ms=round(elapsed_ms, 2))
 
 # --- Config API ---
 @app.route('/api/config', methods=['GET', 'POST'])
 def config_route():
-    global config
+    inst = current_instance()
     if request.method == 'POST':
         new_config_data = request.json
         # jar_pathのみ更新を許可
         if 'jar_path' in new_config_data:
-            config['jar_path'] = new_config_data['jar_path'].strip()
-            mc.save_config(config)
+            inst.update_config({'jar_path': new_config_data['jar_path'].strip()})
             return jsonify(status="Success", message="設定を保存しました。")
         return jsonify(status="Error", message="無効な設定です。"), 400
     else: # GET
         # 現在の設定を返す
-        return jsonify(jar_path=config.get('jar_path', ''))
+        return jsonify(jar_path=inst.cfg.get('jar_path', ''))
 
 # --- Server Properties API ---
 @app.route('/api/properties', methods=['GET', 'POST'])
 def properties_route():
     if request.method == 'POST':
         props_data = request.json
-        success, message = mc.save_properties(config, props_data)
+        inst = current_instance()
+        success, message = mc.save_properties(inst.cfg, props_data)
         if success:
+            # RCONの設定が変わった場合に備えて接続を作り直す
+            inst.configure_rcon()
             return jsonify(status="Success", message=message)
         return jsonify(status="Error", message=message), 500
     else: # GET
-        props = mc.get_properties(config)
+        props = mc.get_properties(current_instance().cfg)
         return jsonify(props)
 
 # --- Shutdown API ---
@@ -1037,16 +1549,32 @@ def stop_all_services():
 
 # --- SocketIO Events ---
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     """クライアント接続時のイベントハンドラ。"""
     # print('Client connected')
+    # auth.instance で表示するインスタンスを選ぶ (存在しない場合は既定のインスタンス)
+    auth = auth if isinstance(auth, dict) else {}
+    try:
+        inst = instances.get(auth.get('instance') or DEFAULT_INSTANCE)
+    except InstanceException:
+        inst = instances.get(DEFAULT_INSTANCE)
+    client_instances[request.sid] = inst
+    join_room(inst.room)
+
     # 接続時に現在の状態を送信
-    emit('status_update', {'status': get_server_status()})
+    emit('status_update', {'status': 'Sleeping' if inst.sleep_listener else inst.status(), 'instance': inst.id})
+    emit('players_update', {**inst.player_tracker.snapshot(), 'instance': inst.id})
+
+    # コンソール出力の配信先に登録し、取りこぼした行を再送する
+    inst.subscribe_console(request.sid, auth)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """クライアント切断時のイベントハンドラ。"""
     # print('Client disconnected')
+    inst = client_instances.pop(request.sid, None)
+    if inst is not None:
+        inst.unsubscribe_console(request.sid)
 
 # --- Main ---
 def run_app():
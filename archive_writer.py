@@ -0,0 +1,466 @@
+"""
+バックアップのアーカイブ (zip / tar.zst / tar.lz4) をマルチコアで書き込む
+ファイルを一定サイズのブロックに分けてスレッドプールで圧縮し、元の順番どおりにアーカイブに書き込む
+(zlib・zstd・lz4 の圧縮は GIL を解放するため、スレッドでも複数のコアを使える)
+
+- zip: 各ブロックを raw deflate で圧縮して連結する (pigz と同じく、前のブロックの末尾 32KiB を辞書にする)
+  圧縮済みのファイル (.mca など) は圧縮ポリシーに従って無圧縮で格納する
+- tar.zst / tar.lz4: tar のストリームをブロックに分け、それぞれを独立したフレームとして圧縮して連結する
+  (zstandard / lz4 パッケージがインストールされている場合のみ)
+"""
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from compression_policy import ACTION_COMPRESS, ACTION_EXCLUDE, ACTION_STORE, CompressionPolicy
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+FORMAT_ZIP = "zip"
+FORMAT_TAR_ZSTD = "tar.zst"
+FORMAT_TAR_LZ4 = "tar.lz4"
+SUFFIXES = {FORMAT_ZIP: ".zip", FORMAT_TAR_ZSTD: ".tar.zst", FORMAT_TAR_LZ4: ".tar.lz4"}
+
+# 1つのタスクで圧縮するサイズ
+BLOCK_SIZE = 1024 * 1024
+TAR_BLOCK_SIZE = 4 * 1024 * 1024
+# tar に書き込む前にファイルを読み込んでおくバッファのうち、メモリに置くサイズ (超えた分は一時ファイルに書く)
+TAR_SPOOL_SIZE = 16 * 1024 * 1024
+# deflate の辞書の最大サイズ
+DICT_SIZE = 32 * 1024
+ZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_ZIP64_LIMIT = (1 << 31) - 1
+_FLAG_UTF8 = 0x800
+_METHOD_STORED = 0
+_METHOD_DEFLATED = 8
+
+
+class ArchiveException(Exception):
+    """対応していない形式が指定された場合や、アーカイブを書き込めない場合の例外"""
+    pass
+
+
+def available_formats() -> List[str]:
+    """この環境で使えるアーカイブの形式"""
+    formats = [FORMAT_ZIP]
+    if zstandard is not None:
+        formats.append(FORMAT_TAR_ZSTD)
+    if lz4 is not None:
+        formats.append(FORMAT_TAR_LZ4)
+    return formats
+
+
+def archive_format(name: str) -> Optional[str]:
+    """ファイル名からアーカイブの形式を返す (アーカイブでなければ None)"""
+    for fmt, suffix in SUFFIXES.items():
+        if name.endswith(suffix):
+            return fmt
+    return None
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+class _OrderedPipeline:
+    """
+    スレッドプールで処理した結果を、投入した順番どおりに受け取る
+    メモリを使い過ぎないよう、処理中のタスクは limit 個までにする
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, limit: int):
+        self._executor = executor
+        self._limit = limit
+        self._pending = deque()
+
+    def submit(self, fn: Optional[Callable], args: Tuple, then: Callable):
+        """fn(*args) をプールで実行し、結果を then に渡す (fn が None の場合は順番が来たら then() を呼ぶ)"""
+        future = self._executor.submit(fn, *args) if fn is not None else None
+        self._pending.append((future, then))
+        while len(self._pending) > self._limit:
+            self._pop()
+
+    def _pop(self):
+        future, then = self._pending.popleft()
+        if future is None:
+            then()
+        else:
+            then(future.result())
+
+    def drain(self):
+        while self._pending:
+            self._pop()
+
+
+def _walk(world: str) -> Iterator[Tuple[str, str, bool]]:
+    """(アーカイブ内のパス ('/' 区切り), 絶対パス, 空のディレクトリか) を返す"""
+    for root, dirs, files in os.walk(world):
+        dirs.sort()
+        if not files and not dirs and root != world:
+            yield os.path.relpath(root, world).replace(os.sep, '/'), root, True
+        for file in sorted(files):
+            full = os.path.join(root, file)
+            yield os.path.relpath(full, world).replace(os.sep, '/'), full, False
+
+
+# --- zip ---
+def _deflate(data: bytes, zdict: bytes, final: bool) -> Tuple[bytes, float]:
+    started = time.thread_time()
+    compressor = zlib.compressobj(ZIP_LEVEL, zlib.DEFLATED, -15, zdict=zdict) if zdict \
+        else zlib.compressobj(ZIP_LEVEL, zlib.DEFLATED, -15)
+    # 最後以外のブロックは Z_SYNC_FLUSH でバイト境界に揃え、そのまま連結できるようにする
+    out = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    return out, time.thread_time() - started
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800))
+    return (t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+            (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday)
+
+
+class _ZipStream:
+    """
+    圧縮済みのデータを受け取って zip を書き込む
+    CRC とサイズはデータを書き終えてからローカルヘッダーに書き戻す (書き込み先はシーク可能なファイル)
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._offset = 0
+        self._entries = []
+
+    def _write(self, data: bytes):
+        self._f.write(data)
+        self._offset += len(data)
+
+    def begin(self, name: str, mtime: float, size: int, method: int) -> Dict:
+        encoded = name.encode('utf-8')
+        zip64 = size > _ZIP64_LIMIT or self._offset > _ZIP64_LIMIT
+        entry = {'name': encoded, 'offset': self._offset, 'time': _dos_time(mtime), 'zip64': zip64,
+                 'method': method, 'compressed': 0, 'size': 0, 'crc': 0}
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if zip64 else b''
+        self._write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, _FLAG_UTF8, method,
+                                entry['time'][0], entry['time'][1], 0, 0, 0,
+                                len(encoded), len(extra)) + encoded + extra)
+        self._entries.append(entry)
+        return entry
+
+    def data(self, entry: Dict, data: bytes):
+        entry['compressed'] += len(data)
+        self._write(data)
+
+    def end(self, entry: Dict, crc: int, size: int):
+        entry['crc'] = crc
+        entry['size'] = size
+        offset = entry['offset']
+        if entry['zip64']:
+            self._f.seek(offset + 14)
+            self._f.write(struct.pack('<III', crc, 0xFFFFFFFF, 0xFFFFFFFF))
+            self._f.seek(offset + 30 + len(entry['name']) + 4)
+            self._f.write(struct.pack('<QQ', size, entry['compressed']))
+        else:
+            if entry['compressed'] > 0xFFFFFFFF or size > 0xFFFFFFFF:
+                raise ArchiveException(f"ファイル '{entry['name'].decode()}' が書き込み中に大きくなりました。")
+            self._f.seek(offset + 14)
+            self._f.write(struct.pack('<III', crc, entry['compressed'], size))
+        self._f.seek(self._offset)
+
+    def close(self):
+        start = self._offset
+        for entry in self._entries:
+            fields = []
+            size, compressed, offset = entry['size'], entry['compressed'], entry['offset']
+            if size > 0xFFFFFFFF or entry['zip64']:
+                fields.append(size)
+                size = 0xFFFFFFFF
+            if compressed > 0xFFFFFFFF or entry['zip64']:
+                fields.append(compressed)
+                compressed = 0xFFFFFFFF
+            if offset > 0xFFFFFFFF:
+                fields.append(offset)
+                offset = 0xFFFFFFFF
+            extra = struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields) if fields else b''
+            version = 45 if fields else 20
+            self._write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, _FLAG_UTF8,
+                                    entry['method'], entry['time'][0], entry['time'][1], entry['crc'],
+                                    compressed, size, len(entry['name']), len(extra), 0, 0, 0, 0, offset)
+                        + entry['name'] + extra)
+        end = self._offset
+        count, cd_size = len(self._entries), end - start
+        if count > 0xFFFF or start > 0xFFFFFFFF or cd_size > 0xFFFFFFFF:
+            self._write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, start))
+            self._write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                    min(cd_size, 0xFFFFFFFF), min(start, 0xFFFFFFFF), 0))
+        else:
+            self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, start, 0))
+
+
+def _write_zip(world: str, f, pipeline: _OrderedPipeline, policy: CompressionPolicy, stats: Dict):
+    stream = _ZipStream(f)
+    for rel, full, is_dir in _walk(world):
+        if is_dir:
+            # 空のディレクトリも復元できるよう、'/' で終わる空のエントリを書く
+            try:
+                mtime = os.stat(full).st_mtime
+            except OSError:
+                continue
+            pipeline.submit(None, (), lambda rel=rel, mtime=mtime:
+                            stream.end(stream.begin(rel + '/', mtime, 0, _METHOD_STORED), 0, 0))
+            continue
+        action = policy.action(rel)
+        try:
+            st = os.stat(full)
+            if action == ACTION_EXCLUDE:
+                policy.record(action, st.st_size)
+                continue
+            src = open(full, 'rb')
+        except OSError as e:
+            print(f"ファイル '{rel}' を読み込めないため、スキップします: {e}")
+            continue
+        method = _METHOD_STORED if action == ACTION_STORE else _METHOD_DEFLATED
+        with src:
+            holder = {}
+            pipeline.submit(None, (), lambda rel=rel, st=st, holder=holder, method=method:
+                            holder.update(entry=stream.begin(rel, st.st_mtime, st.st_size, method)))
+            crc = size = 0
+            zdict = b''
+            data = src.read(BLOCK_SIZE)
+            while True:
+                following = src.read(BLOCK_SIZE) if data else b''
+                final = not following
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                if method == _METHOD_STORED:
+                    if size == len(data):
+                        policy.sample(data)
+                    pipeline.submit(None, (), lambda data=data, holder=holder: stream.data(holder['entry'], data))
+                else:
+                    pipeline.submit(_deflate, (data, zdict, final),
+                                    lambda result, holder=holder: _write_compressed(stream, holder, policy, result))
+                if final:
+                    break
+                zdict = data[-DICT_SIZE:]
+                data = following
+            pipeline.submit(None, (), lambda holder=holder, crc=crc, size=size:
+                            stream.end(holder['entry'], crc, size))
+            policy.record(action, size)
+            stats['files'] += 1
+            stats['bytes'] += size
+    pipeline.submit(None, (), stream.close)
+
+
+def _write_compressed(stream: _ZipStream, holder: Dict, policy: CompressionPolicy, result: Tuple[bytes, float]):
+    out, seconds = result
+    policy.add_compress_time(seconds)
+    stream.data(holder['entry'], out)
+
+
+# --- tar.zst / tar.lz4 ---
+_zstd_local = threading.local()
+
+
+def _zstd_compress(data: bytes) -> Tuple[bytes, float]:
+    started = time.thread_time()
+    # ZstdCompressor はスレッドセーフではないため、スレッドごとに作る
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        # 復元時に壊れたデータを検出できるよう、フレームごとにチェックサムを付ける
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, write_checksum=True)
+    return compressor.compress(data), time.thread_time() - started
+
+
+def _lz4_compress(data: bytes) -> Tuple[bytes, float]:
+    started = time.thread_time()
+    return lz4.frame.compress(data, content_checksum=True), time.thread_time() - started
+
+
+class _BlockSink:
+    """tarfile の出力をブロックに分け、それぞれを圧縮してから書き込む"""
+
+    def __init__(self, f, pipeline: _OrderedPipeline, compress: Callable[[bytes], Tuple[bytes, float]],
+                 policy: CompressionPolicy):
+        self._f = f
+        self._pipeline = pipeline
+        self._compress = compress
+        self._policy = policy
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer.extend(data)
+        while len(self._buffer) >= TAR_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:TAR_BLOCK_SIZE]))
+            del self._buffer[:TAR_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self._pipeline.submit(self._compress, (block,), self._write)
+
+    def _write(self, result: Tuple[bytes, float]):
+        out, seconds = result
+        self._policy.add_compress_time(seconds)
+        self._f.write(out)
+
+    def flush(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def _write_tar(world: str, f, pipeline: _OrderedPipeline, compress: Callable[[bytes], Tuple[bytes, float]],
+               policy: CompressionPolicy, stats: Dict):
+    # zstd / lz4 は圧縮できないデータを速く読み飛ばすため、tar では除外のパターンだけを使う
+    sink = _BlockSink(f, pipeline, compress, policy)
+    with tarfile.open(fileobj=sink, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        for rel, full, is_dir in _walk(world):
+            if is_dir:
+                try:
+                    tar.add(full, arcname=rel, recursive=False)
+                except OSError as e:
+                    print(f"ディレクトリ '{rel}' を読み込めないため、スキップします: {e}")
+                continue
+            # 書き込み中に大きさが変わるファイル (稼働中のサーバーの level.dat など) があると、
+            # ヘッダーに書いたサイズとデータが合わずにアーカイブ全体が壊れるため、先にすべて読み込んでから書き込む
+            with tempfile.SpooledTemporaryFile(max_size=TAR_SPOOL_SIZE) as buffer:
+                try:
+                    info = tar.gettarinfo(full, arcname=rel)
+                    if info is None:
+                        continue
+                    if policy.action(rel) == ACTION_EXCLUDE:
+                        policy.record(ACTION_EXCLUDE, info.size)
+                        continue
+                    if info.isreg():
+                        with open(full, 'rb') as src:
+                            shutil.copyfileobj(src, buffer, BLOCK_SIZE)
+                except OSError as e:
+                    print(f"ファイル '{rel}' を読み込めないため、スキップします: {e}")
+                    continue
+                if info.isreg():
+                    info.size = buffer.tell()
+                    buffer.seek(0)
+                size = info.size
+                tar.addfile(info, buffer if info.isreg() else None)
+            policy.record(ACTION_COMPRESS, size)
+            stats['files'] += 1
+            stats['bytes'] += size
+    sink.flush()
+
+
+class _CountingReader:
+    """読み込んだバイト数を on_read に通知するファイルのラッパー"""
+
+    def __init__(self, f, on_read: Callable[[int], None]):
+        self._f = f
+        self._on_read = on_read
+        self.closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._on_read(len(data))
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self._f.readinto(buffer)
+        self._on_read(count or 0)
+        return count
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self.closed = True
+        self._f.close()
+
+
+def open_tar(path: str, on_read: Optional[Callable[[int], None]] = None) -> tarfile.TarFile:
+    """
+    tar.zst / tar.lz4 をストリームとして読み込む tarfile を返す
+
+    Args:
+        on_read: アーカイブ (圧縮されたデータ) を読み込むたびに、読み込んだバイト数を受け取る関数
+
+    Raises:
+        ArchiveException: 形式に対応するパッケージがインストールされていない場合
+    """
+    fmt = archive_format(path)
+    if fmt not in (FORMAT_TAR_ZSTD, FORMAT_TAR_LZ4):
+        raise ArchiveException(f"tar の形式ではありません: {path}")
+    if fmt not in available_formats():
+        raise ArchiveException(f"{fmt} を読み込むには {'zstandard' if fmt == FORMAT_TAR_ZSTD else 'lz4'} "
+                               f"パッケージが必要です。")
+    f = open(path, 'rb')
+    if on_read is not None:
+        f = _CountingReader(f, on_read)
+    if fmt == FORMAT_TAR_ZSTD:
+        # 独立した複数のフレームを連結しているため、フレームをまたいで読み込む
+        stream = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+    else:
+        stream = lz4.frame.open(f, 'rb')
+    return tarfile.open(fileobj=stream, mode='r|')
+
+
+def write_archive(world: str, dest: str, fmt: str = FORMAT_ZIP, workers: Optional[int] = None,
+                  policy: Optional[CompressionPolicy] = None) -> Dict:
+    """
+    ワールドフォルダをアーカイブに書き込む (書き込み中のファイルは .tmp とし、完了後に名前を変える)
+
+    Args:
+        world: ワールドフォルダ
+        dest: 書き込むアーカイブのパス
+        fmt: FORMAT_ZIP / FORMAT_TAR_ZSTD / FORMAT_TAR_LZ4
+        workers: 圧縮に使うスレッドの数 (省略時は CPU のコア数)
+        policy: 除外・無圧縮にするファイルを決める圧縮ポリシー (省略時は既定のポリシー)
+
+    Returns:
+        format, files, bytes (元のサイズ), compressed_bytes, duration (秒), mb_per_s, workers,
+        policy (圧縮ポリシーの集計結果) を含む辞書
+
+    Raises:
+        ArchiveException: 対応していない形式の場合
+    """
+    if fmt not in available_formats():
+        raise ArchiveException(f"アーカイブの形式 '{fmt}' は使用できません (使用可能: {', '.join(available_formats())})。")
+    workers = workers or default_workers()
+    policy = policy or CompressionPolicy(level=ZIP_LEVEL)
+    stats = {'format': fmt, 'files': 0, 'bytes': 0, 'workers': workers}
+    started = time.perf_counter()
+    tmp = dest + '.tmp'
+    try:
+        with open(tmp, 'wb') as f, ThreadPoolExecutor(max_workers=workers) as executor:
+            pipeline = _OrderedPipeline(executor, limit=workers * 4)
+            if fmt == FORMAT_ZIP:
+                _write_zip(world, f, pipeline, policy, stats)
+            else:
+                _write_tar(world, f, pipeline,
+                           _zstd_compress if fmt == FORMAT_TAR_ZSTD else _lz4_compress, policy, stats)
+            pipeline.drain()
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    duration = time.perf_counter() - started
+    stats['compressed_bytes'] = os.path.getsize(dest)
+    stats['duration'] = round(duration, 3)
+    stats['mb_per_s'] = round(stats['bytes'] / 1024 / 1024 / duration, 1) if duration > 0 else None
+    stats['policy'] = policy.report()
+    return stats
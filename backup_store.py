@@ -0,0 +1,537 @@
+"""
+重複排除バックアップ (コンテンツアドレス方式のチャンクストア)
+ファイルの内容を一定サイズのチャンクに分け、SHA-256 をキーとしてバックアップフォルダの objects/ に保存する
+スナップショットごとにファイルの一覧とチャンクのハッシュを記録したマニフェスト (JSON) だけを書くため、
+前回から変更のないファイルは容量を使わない (サイズと更新時刻が同じファイルは読み込みもしない)
+リージョンファイル (.mca) はゲームのチャンクごとに保存し、ヘッダーの更新時刻とデータの長さが前回と同じチャンクは読み込まない
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import region_file
+from compression_policy import ACTION_EXCLUDE, ACTION_STORE, CompressionPolicy
+from region_file import RegionFileException
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".json"
+OBJECTS_DIR = "objects"
+# ファイルを分割するサイズ (region ファイルのセクタ 4KiB の倍数にする)
+CHUNK_SIZE = 1024 * 1024
+# チャンクの保存形式 (先頭1バイト)
+CODEC_STORED = b'S'
+CODEC_ZLIB = b'Z'
+ZLIB_LEVEL = 6
+_STAT_KEYS = ('files', 'unchanged_files', 'bytes', 'read_bytes', 'new_chunks', 'reused_chunks', 'stored_bytes',
+              'region_files', 'region_chunks', 'region_chunks_unchanged')
+
+# 同じバックアップフォルダに対するスナップショットの作成・削除は同時に行わない
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+class BackupStoreException(Exception):
+    """スナップショットが見つからない場合や、チャンクが壊れている場合の例外"""
+    pass
+
+
+def _store_lock(backup_dir: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(backup_dir), threading.Lock())
+
+
+class ChunkStore:
+    """ハッシュをキーとしてチャンクを保存するフォルダ (objects/ab/abcdef...)"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, data: bytes, compress: bool = True,
+            policy: Optional[CompressionPolicy] = None) -> Tuple[str, int]:
+        """
+        チャンクを保存する
+
+        Args:
+            compress: False の場合は圧縮せずに保存する (圧縮済みのデータ用)
+            policy: 圧縮に使ったCPU時間を記録する圧縮ポリシー
+
+        Returns:
+            (ハッシュ, 新たに書き込んだバイト数 (既に保存済みの場合は 0))
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        blob = CODEC_STORED + data
+        if compress:
+            started = time.thread_time()
+            compressed = zlib.compress(data, ZLIB_LEVEL)
+            if policy is not None:
+                policy.add_compress_time(time.thread_time() - started)
+            # 圧縮しても小さくならないデータはそのまま保存する
+            if len(compressed) < len(data):
+                blob = CODEC_ZLIB + compressed
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルが残らないよう、一時ファイルに書いてから置き換える
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        return digest, len(blob)
+
+    def get(self, digest: str) -> bytes:
+        """
+        チャンクを読み込む
+
+        Raises:
+            BackupStoreException: チャンクがない場合や、内容がハッシュと一致しない場合
+        """
+        try:
+            with open(self.path(digest), 'rb') as f:
+                blob = f.read()
+        except OSError as e:
+            raise BackupStoreException(f"チャンク {digest[:12]} を読み込めません: {e}")
+        try:
+            data = zlib.decompress(blob[1:]) if blob[:1] == CODEC_ZLIB else blob[1:]
+        except zlib.error as e:
+            raise BackupStoreException(f"チャンク {digest[:12]} が壊れています: {e}")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise BackupStoreException(f"チャンク {digest[:12]} の内容がハッシュと一致しません。")
+        return data
+
+    def digests(self) -> Iterator[str]:
+        """保存されているすべてのチャンクのハッシュ"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if not name.endswith('.tmp'):
+                    yield name
+
+    def sweep(self, referenced: Set[str]) -> Tuple[int, int]:
+        """
+        どのスナップショットからも参照されていないチャンクを削除する
+
+        Returns:
+            (削除したチャンクの数, 解放したバイト数)
+        """
+        removed = freed = 0
+        for digest in list(self.digests()):
+            if digest in referenced:
+                continue
+            path = self.path(digest)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+
+# --- マニフェスト ---
+def chunk_store(backup_dir: str) -> ChunkStore:
+    return ChunkStore(os.path.join(backup_dir, OBJECTS_DIR))
+
+
+def is_snapshot_name(name: str) -> bool:
+    return name.endswith(MANIFEST_SUFFIX)
+
+
+def list_snapshots(backup_dir: str) -> List[str]:
+    """スナップショットのマニフェストのファイル名を新しい順に返す"""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted((name for name in os.listdir(backup_dir)
+                   if is_snapshot_name(name) and os.path.isfile(os.path.join(backup_dir, name))),
+                  reverse=True)
+
+
+def load_manifest(backup_dir: str, name: str) -> Dict:
+    """
+    マニフェストを読み込む
+
+    Raises:
+        BackupStoreException: スナップショットが見つからない場合や、読み込めない場合
+    """
+    # バックアップフォルダの外を参照できないようにする
+    if os.path.basename(name) != name or not is_snapshot_name(name):
+        raise BackupStoreException(f"スナップショット名が正しくありません: {name}")
+    path = os.path.join(backup_dir, name)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise BackupStoreException(f"スナップショット '{name}' が見つかりません。")
+    except (OSError, ValueError) as e:
+        raise BackupStoreException(f"スナップショット '{name}' を読み込めません: {e}")
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise BackupStoreException(f"対応していないマニフェストの形式です: {manifest.get('version')}")
+    return manifest
+
+
+def _write_manifest(backup_dir: str, manifest: Dict) -> str:
+    path = os.path.join(backup_dir, manifest['name'])
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+    return path
+
+
+def _new_name(backup_dir: str) -> str:
+    name = f"world_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    candidate, n = name + MANIFEST_SUFFIX, 1
+    while os.path.exists(os.path.join(backup_dir, candidate)):
+        n += 1
+        candidate = f"{name}_{n}{MANIFEST_SUFFIX}"
+    return candidate
+
+
+def _walk(world: str) -> Iterator[Tuple[str, str, bool]]:
+    """(相対パス ('/' 区切り), 絶対パス, ディレクトリか) を返す"""
+    for root, dirs, files in os.walk(world):
+        rel_root = os.path.relpath(root, world)
+        prefix = '' if rel_root == '.' else rel_root.replace(os.sep, '/') + '/'
+        if not files and not dirs and prefix:
+            yield prefix.rstrip('/'), root, True
+        for file in files:
+            yield prefix + file, os.path.join(root, file), False
+
+
+# --- リージョンファイル ---
+# チャンクの一覧 (スロット番号ごとに 最終更新時刻, データの長さ, ハッシュ) もチャンクストアに保存する
+# (変更のないリージョンファイルの一覧は同じ内容になるため、マニフェストにはそのハッシュだけを書く)
+_SLOT = struct.Struct('>II32s')
+
+
+def _encode_table(slots: Dict[int, Tuple[int, int, str]]) -> bytes:
+    out = bytearray()
+    for index in range(region_file.CHUNK_COUNT):
+        timestamp, length, digest = slots.get(index, (0, 0, None))
+        out += _SLOT.pack(timestamp, length, bytes.fromhex(digest) if digest else bytes(32))
+    return bytes(out)
+
+
+def _load_table(store: ChunkStore, digest: str) -> Dict[int, Tuple[int, int, str]]:
+    data = store.get(digest)
+    if len(data) != _SLOT.size * region_file.CHUNK_COUNT:
+        raise BackupStoreException(f"リージョンのチャンクの一覧 {digest[:12]} が壊れています。")
+    slots = {}
+    for index, (timestamp, length, raw) in enumerate(_SLOT.iter_unpack(data)):
+        if length:
+            slots[index] = (timestamp, length, raw.hex())
+    return slots
+
+
+def _snapshot_region(store: ChunkStore, full: str, size: int, old: Optional[Dict], stats: Dict,
+                     policy: CompressionPolicy) -> str:
+    """
+    リージョンファイルをゲームのチャンクごとに保存し、チャンクの一覧のハッシュを返す
+    前回のスナップショットと最終更新時刻・データの長さが同じチャンクは、読み込まずに前回のハッシュを使う
+    (最終更新時刻は秒単位のため、前回ファイルが更新された秒以降に書き込まれたチャンクは、
+     前回読み込んだ後に同じ秒のうちに書き直された可能性があるので読み込み直す)
+
+    Raises:
+        RegionFileException: リージョンファイルの形式が正しくない場合
+        OSError: ファイルを読み込めない場合
+    """
+    previous = {}
+    # この時刻より前に書き込まれたチャンクだけ、最終更新時刻で変更の有無を判断できる
+    trusted_before = old['mtime_ns'] // 1_000_000_000 if old else 0
+    if old and old.get('region'):
+        try:
+            previous = _load_table(store, old['region'])
+        except BackupStoreException:
+            previous = {}
+    slots = {}
+    with open(full, 'rb') as f:
+        for index, (offset, length, timestamp) in region_file.read_header(f, size).items():
+            stats['region_chunks'] += 1
+            last = previous.get(index)
+            if (last and last[0] == timestamp and 0 < timestamp < trusted_before
+                    and region_file.read_chunk_length(f, offset) == last[1] and store.has(last[2])):
+                slots[index] = last
+                stats['region_chunks_unchanged'] += 1
+                continue
+            data = region_file.read_chunk(f, offset, length)
+            stats['read_bytes'] += len(data)
+            policy.sample(data)
+            # チャンクのデータは zlib/LZ4 で圧縮済みのため、そのまま保存する
+            digest, written = store.put(data, compress=False)
+            if written:
+                stats['new_chunks'] += 1
+                stats['stored_bytes'] += written
+            else:
+                stats['reused_chunks'] += 1
+            slots[index] = (timestamp, len(data), digest)
+    digest, written = store.put(_encode_table(slots))
+    stats['stored_bytes'] += written
+    return digest
+
+
+def entry_digests(store: ChunkStore, entry: Dict) -> List[str]:
+    """ファイルの復元に必要なチャンクのハッシュ (リージョンファイルの場合はチャンクの一覧を含む)"""
+    digests = list(entry['chunks'])
+    if entry.get('region'):
+        digests.append(entry['region'])
+        digests.extend(slot[2] for slot in _load_table(store, entry['region']).values())
+    return digests
+
+
+def _entry_contents(store: ChunkStore, entry: Dict) -> Iterator[bytes]:
+    if entry.get('region'):
+        slots = sorted(_load_table(store, entry['region']).items())
+        yield from region_file.build((index, timestamp, store.get(digest))
+                                     for index, (timestamp, _, digest) in slots)
+        return
+    for digest in entry['chunks']:
+        yield store.get(digest)
+
+
+def restored_size(store: ChunkStore, entry: Dict) -> int:
+    """
+    復元したときのファイルのサイズ
+    (リージョンファイルは空きセクタを詰めて組み立て直すため、元のファイルより小さくなることがある)
+    """
+    if entry.get('region'):
+        return region_file.built_size(slot[1] for slot in _load_table(store, entry['region']).values())
+    return entry['size']
+
+
+# --- スナップショットの作成・復元 ---
+def _snapshot_file(store: ChunkStore, rel: str, full: str, old: Optional[Dict],
+                   region_chunks: bool, policy: CompressionPolicy) -> Tuple[Optional[Dict], Dict]:
+    """
+    1つのファイルを保存する (スレッドプールから呼ばれる)
+
+    Returns:
+        (マニフェストのエントリ (除外した場合や読み込めなかった場合は None), このファイルの統計情報)
+    """
+    stats = dict.fromkeys(_STAT_KEYS, 0)
+    try:
+        st = os.stat(full)
+    except OSError:
+        return None, stats
+    action = policy.action(rel)
+    if action == ACTION_EXCLUDE:
+        policy.record(action, st.st_size)
+        return None, stats
+    # サイズと更新時刻が同じファイルは、前回のチャンクをそのまま使う
+    if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+        try:
+            if all(store.has(d) for d in entry_digests(store, old)):
+                stats.update(files=1, bytes=st.st_size, unchanged_files=1, reused_chunks=len(old['chunks']))
+                return old, stats
+        except BackupStoreException:
+            pass
+    if region_chunks and region_file.is_region_file(rel) and st.st_size:
+        region_stats = dict.fromkeys(_STAT_KEYS, 0)
+        try:
+            table = _snapshot_region(store, full, st.st_size, old, region_stats, policy)
+            region_stats.update(files=1, bytes=st.st_size, region_files=1)
+            # チャンクのデータは圧縮済みのため、圧縮せずに保存している
+            policy.record(ACTION_STORE, st.st_size)
+            return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'chunks': [], 'region': table}, region_stats
+        except (OSError, RegionFileException) as e:
+            # 形式が正しくないリージョンファイルは、通常のファイルとして保存する
+            print(f"リージョンファイル '{rel}' をチャンクごとに読み込めないため、ファイル全体を保存します: {e}")
+    chunks = []
+    size = 0
+    try:
+        with open(full, 'rb') as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                if action == ACTION_STORE and not size:
+                    policy.sample(data)
+                digest, written = store.put(data, compress=action != ACTION_STORE, policy=policy)
+                chunks.append(digest)
+                size += len(data)
+                if written:
+                    stats['new_chunks'] += 1
+                    stats['stored_bytes'] += written
+                else:
+                    stats['reused_chunks'] += 1
+    except OSError as e:
+        # サーバーが書き込み中のファイルなどは飛ばす
+        print(f"ファイル '{rel}' を読み込めないため、スキップします: {e}")
+        return None, dict.fromkeys(_STAT_KEYS, 0)
+    policy.record(action, size)
+    stats.update(files=1, bytes=size, read_bytes=size)
+    return {'size': size, 'mtime_ns': st.st_mtime_ns, 'chunks': chunks}, stats
+
+
+def create_snapshot(world: str, backup_dir: str, parent: Optional[str] = None,
+                    region_chunks: bool = True, workers: int = 1,
+                    policy: Optional[CompressionPolicy] = None) -> Dict:
+    """
+    ワールドのスナップショットを作成する
+
+    Args:
+        world: ワールドフォルダ
+        backup_dir: バックアップフォルダ (マニフェストと objects/ を置く)
+        parent: 変更の有無を比べるスナップショット (省略時は最新のスナップショット)
+        region_chunks: リージョンファイルをゲームのチャンクごとに保存するか
+        workers: ファイルの読み込み・ハッシュの計算・圧縮を並行して行うスレッドの数
+        policy: 除外・無圧縮にするファイルを決める圧縮ポリシー (省略時は既定のポリシー)
+
+    Returns:
+        書き込んだマニフェスト (stats に統計情報を含む)
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    store = chunk_store(backup_dir)
+    policy = policy or CompressionPolicy(level=ZLIB_LEVEL)
+    with _store_lock(backup_dir):
+        started = time.perf_counter()
+        if parent is None:
+            snapshots = list_snapshots(backup_dir)
+            parent = snapshots[0] if snapshots else None
+        previous = {}
+        if parent:
+            try:
+                previous = load_manifest(backup_dir, parent)['files']
+            except BackupStoreException as e:
+                print(f"前回のスナップショットを読み込めないため、すべてのファイルを読み込みます: {e}")
+                parent = None
+
+        dirs, targets = [], []
+        for rel, full, is_dir in _walk(world):
+            if is_dir:
+                dirs.append(rel)
+            else:
+                targets.append((rel, full))
+        files = {}
+        stats = dict.fromkeys(_STAT_KEYS, 0)
+        # sha256 と zlib は GIL を解放するため、スレッドでも複数のコアを使える
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            results = executor.map(lambda target: _snapshot_file(store, target[0], target[1],
+                                                                 previous.get(target[0]), region_chunks, policy),
+                                   targets)
+            for (rel, _), (entry, file_stats) in zip(targets, results):
+                if entry is None:
+                    continue
+                files[rel] = entry
+                for key, value in file_stats.items():
+                    stats[key] += value
+
+        duration = time.perf_counter() - started
+        stats['duration'] = round(duration, 3)
+        stats['workers'] = workers
+        stats['mb_per_s'] = round(stats['bytes'] / 1024 / 1024 / duration, 1) if duration > 0 else None
+        stats['policy'] = policy.report()
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'name': _new_name(backup_dir),
+            'created': time.time(),
+            'parent': parent,
+            'chunk_size': CHUNK_SIZE,
+            'files': files,
+            'dirs': dirs,
+            'stats': stats,
+        }
+        manifest['path'] = _write_manifest(backup_dir, manifest)
+        return manifest
+
+
+def read_file(backup_dir: str, manifest: Dict, rel: str) -> Iterator[bytes]:
+    """
+    スナップショット内のファイルの内容を先頭から順に返す
+
+    Raises:
+        BackupStoreException: ファイルがない場合や、チャンクが壊れている場合
+    """
+    entry = manifest['files'].get(rel)
+    if entry is None:
+        raise BackupStoreException(f"スナップショットに '{rel}' はありません。")
+    return _entry_contents(chunk_store(backup_dir), entry)
+
+
+def check_snapshot(backup_dir: str, manifest: Dict):
+    """
+    スナップショットの復元に必要なチャンクがすべてあることを確認する (内容のハッシュは読み込むときに確認する)
+
+    Raises:
+        BackupStoreException: 見つからないチャンクがある場合
+    """
+    store = chunk_store(backup_dir)
+    missing = {d for entry in manifest['files'].values() for d in entry_digests(store, entry) if not store.has(d)}
+    if missing:
+        raise BackupStoreException(f"スナップショット '{manifest['name']}' のチャンクが {len(missing)} 個見つかりません。")
+
+
+def delete_snapshot(backup_dir: str, name: str) -> Dict:
+    """
+    スナップショットを削除し、どのスナップショットからも参照されなくなったチャンクを削除する
+
+    Returns:
+        removed_chunks, freed_bytes を含む辞書
+
+    Raises:
+        BackupStoreException: スナップショットが見つからない場合
+    """
+    load_manifest(backup_dir, name)
+    with _store_lock(backup_dir):
+        os.remove(os.path.join(backup_dir, name))
+        return collect_garbage(backup_dir)
+
+
+def collect_garbage(backup_dir: str) -> Dict:
+    """残っているスナップショットから参照されていないチャンクを削除する"""
+    store = chunk_store(backup_dir)
+    referenced = set()
+    for snapshot in list_snapshots(backup_dir):
+        try:
+            manifest = load_manifest(backup_dir, snapshot)
+            for entry in manifest['files'].values():
+                # 変更のないリージョンファイルは同じチャンクの一覧を共有するため、一度だけ読み込む
+                if entry.get('region') in referenced:
+                    continue
+                referenced.update(entry_digests(store, entry))
+        except BackupStoreException as e:
+            # 読み込めないマニフェストがある場合は、必要なチャンクを消さないよう何も削除しない
+            print(f"スナップショットを読み込めないため、チャンクの削除を中止します: {e}")
+            return {'removed_chunks': 0, 'freed_bytes': 0}
+    removed, freed = store.sweep(referenced)
+    return {'removed_chunks': removed, 'freed_bytes': freed}
+
+
+def describe(manifest: Dict) -> Dict:
+    """一覧表示用のスナップショットの情報"""
+    return {
+        'name': manifest['name'],
+        'created': manifest['created'],
+        'parent': manifest.get('parent'),
+        **manifest.get('stats', {}),
+    }
+
+
+def store_usage(backup_dir: str) -> Dict:
+    """チャンクストアが使っている容量"""
+    store = chunk_store(backup_dir)
+    count = size = 0
+    for digest in store.digests():
+        try:
+            size += os.path.getsize(store.path(digest))
+        except OSError:
+            continue
+        count += 1
+    return {'chunks': count, 'bytes': size}
@@ -0,0 +1,111 @@
+"""
+Webコンソールの送信形式のベンチマーク
+JSON形式 ({'lines': [...]}) とバイナリ形式 (encode_lines) のフレームを比較し、
+Socket.IOのパケットとして送信されるバイト数と、エンコード・デコードにかかるCPU時間を表示する
+
+クライアント側のCPU時間は、ブラウザの JSON.parse / DecompressionStream の代わりに
+Pythonの json.loads / decode_lines で計測した参考値
+"""
+import json
+import random
+import time
+
+from socketio import packet
+
+from console_stream import decode_lines, frame_payload
+
+FRAME_SIZES = (1, 20, 200)
+TOTAL_LINES = 20000
+
+_TEMPLATES = (
+    "[{t}] [Server thread/INFO]: Preparing spawn area: {n}%",
+    "[{t}] [Worker-Main-{w}/WARN]: Ignoring unknown attribute 'forge:step_height_addition'",
+    "[{t}] [Server thread/INFO]: Player{n} joined the game",
+    "[{t}] [Async Chat Thread - #{w}/INFO]: <Player{n}> こんにちは、今日はどこを探索する？",
+    "[{t}] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running {n}ms or {w} ticks behind",
+    "[{t}] [Netty Epoll Server IO #{w}/INFO]: com.example.mod.network.PacketHandler: received packet id={n}",
+)
+
+
+def make_lines(count, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        t = f"{12 + i // 3600 % 12:02d}:{i // 60 % 60:02d}:{i % 60:02d}"
+        template = rng.choice(_TEMPLATES)
+        lines.append(template.format(t=t, n=rng.randint(0, 9999), w=rng.randint(0, 7)))
+    return lines
+
+
+def encode_packet(payload):
+    """Socket.IOのパケットにエンコードし、送信されるバイト数を返す"""
+    encoded = packet.Packet(packet.EVENT, data=['console_batch', payload]).encode()
+    if isinstance(encoded, list):
+        # バイナリを含む場合は、テキストのパケットと添付データが別々のフレームで送られる
+        return sum(len(p.encode('utf-8')) if isinstance(p, str) else len(p) for p in encoded)
+    return len(encoded.encode('utf-8'))
+
+
+def bench(frame_size, lines):
+    frames = [lines[i:i + frame_size] for i in range(0, len(lines), frame_size)]
+    base = {'epoch': '0123abcd', 'seq': 0, 'skipped': 0}
+
+    # JSON形式
+    started = time.perf_counter()
+    json_frames = [json.dumps({**base, 'lines': frame}, separators=(',', ':')) for frame in frames]
+    json_encode = time.perf_counter() - started
+    started = time.perf_counter()
+    for text in json_frames:
+        json.loads(text)
+    json_decode = time.perf_counter() - started
+    json_bytes = sum(encode_packet({**base, 'lines': frame}) for frame in frames)
+
+    # バイナリ形式 (圧縮が効かない小さなフレームはJSON形式のまま送られる)
+    started = time.perf_counter()
+    binary_frames = []
+    for frame in frames:
+        payload = frame_payload(frame, binary=True)
+        if 'lines' in payload:
+            payload['text'] = json.dumps(payload['lines'], separators=(',', ':'))
+        binary_frames.append(payload)
+    binary_encode = time.perf_counter() - started
+    started = time.perf_counter()
+    for payload in binary_frames:
+        if 'data' in payload:
+            decode_lines(payload['data'])
+        else:
+            json.loads(payload['text'])
+    binary_decode = time.perf_counter() - started
+    binary_bytes = sum(
+        encode_packet({**base, 'data': p['data']} if 'data' in p else {**base, 'lines': p['lines']})
+        for p in binary_frames
+    )
+
+    return {
+        'frame_size': frame_size,
+        'frames': len(frames),
+        'json_bytes': json_bytes,
+        'binary_bytes': binary_bytes,
+        'ratio': binary_bytes / json_bytes,
+        'json_encode_ms': json_encode * 1000,
+        'binary_encode_ms': binary_encode * 1000,
+        'json_decode_ms': json_decode * 1000,
+        'binary_decode_ms': binary_decode * 1000,
+    }
+
+
+def main():
+    lines = make_lines(TOTAL_LINES)
+    raw = sum(len(line.encode('utf-8')) for line in lines)
+    print(f"{TOTAL_LINES} 行 (UTF-8 で {raw:,} バイト)")
+    print(f"{'行/フレーム':>10} {'JSON bytes':>12} {'Binary bytes':>13} {'比率':>6} "
+          f"{'JSON enc':>9} {'Bin enc':>9} {'JSON dec':>9} {'Bin dec':>9}  (ms)")
+    for size in FRAME_SIZES:
+        r = bench(size, lines)
+        print(f"{r['frame_size']:>10} {r['json_bytes']:>12,} {r['binary_bytes']:>13,} {r['ratio']:>6.2f} "
+              f"{r['json_encode_ms']:>9.1f} {r['binary_encode_ms']:>9.1f} "
+              f"{r['json_decode_ms']:>9.1f} {r['binary_decode_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
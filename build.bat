@@ -1,2 +1,2 @@
 pip install -r requirements.txt
-pyinstaller --onefile --name "MCServerHelper" --add-data "static;static" --add-data "templates;templates" --add-data "requirements.txt;." --add-data "server_software_api.py;." --add-data "modrinth_api.py;." --hidden-import="requests" --hidden-import="simple_websocket" --hidden-import="engineio.async_drivers.threading" --hidden-import="flask_socketio" --hidden-import="charset_normalizer" --hidden-import="certifi" --hidden-import="xml.etree.ElementTree" --hidden-import="server_software_api" --hidden-import="modrinth_api" --collect-all="flask_socketio" --collect-all="simple_websocket" app.py
\ No newline at end of file
+pyinstaller --onefile --name "MCServerHelper" --add-data "static;static" --add-data "templates;templates" --add-data "requirements.txt;." --add-data "server_software_api.py;." --add-data "modrinth_api.py;." --add-data "console_stream.py;." --add-data "log_index.py;." --add-data "log_parser.py;." --add-data "player_tracker.py;." --add-data "metrics.py;." --add-data "command_channel.py;." --add-data "process_io.py;." --add-data "instances.py;." --add-data "jvm_profiles.py;." --add-data "startup_telemetry.py;." --add-data "operations.py;." --add-data "supervisor.py;." --add-data "restart_scheduler.py;." --add-data "resource_limits.py;." --add-data "rcon.py;." --add-data "server_ping.py;." --add-data "hibernation.py;." --add-data "backup_store.py;." --add-data "region_file.py;." --add-data "archive_writer.py;." --add-data "compression_policy.py;." --add-data "world_restore.py;." --hidden-import="requests" --hidden-import="simple_websocket" --hidden-import="engineio.async_drivers.threading" --hidden-import="flask_socketio" --hidden-import="charset_normalizer" --hidden-import="certifi" --hidden-import="xml.etree.ElementTree" --hidden-import="server_software_api" --hidden-import="modrinth_api" --hidden-import="console_stream" --hidden-import="log_index" --hidden-import="log_parser" --hidden-import="player_tracker" --hidden-import="metrics" --hidden-import="command_channel" --hidden-import="process_io" --hidden-import="instances" --hidden-import="jvm_profiles" --hidden-import="startup_telemetry" --hidden-import="operations" --hidden-import="supervisor" --hidden-import="restart_scheduler" --hidden-import="resource_limits" --hidden-import="rcon" --hidden-import="server_ping" --hidden-import="hibernation" --hidden-import="backup_store" --hidden-import="region_file" --hidden-import="archive_writer" --hidden-import="compression_policy" --hidden-import="world_restore" --hidden-import="zstandard" --hidden-import="lz4.frame" --collect-all="flask_socketio" --collect-all="simple_websocket" app.py
\ No newline at end of file
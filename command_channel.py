@@ -0,0 +1,143 @@
+"""
+サーバーコマンドの送信と、その出力の対応付け
+標準入力に送ったコマンドの応答はコンソール出力に混ざって届くため、
+送信直後の一定時間に届いた行をそのコマンドの出力とみなして呼び出し元に返す
+RCONなどで応答を直接受け取れる場合は、その応答をそのまま返す
+RCONで送信した後に応答を受け取れなかった場合は、送り直さずにコンソール出力で完了を待つ
+"""
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from log_parser import LogEventBus, LogRecord, parse_line
+from rcon import RconReplyLostException
+
+
+class CommandResult(NamedTuple):
+    """send_and_wait の結果"""
+    sent: bool                 # コマンドを送信できたか
+    lines: List[LogRecord]     # コマンドの出力とみなした行
+    complete: bool             # until 条件に一致して終了したか (Falseの場合はタイムアウトか無出力期間で終了)
+
+
+class _Waiter:
+    def __init__(self, until: Optional[Callable[[LogRecord], bool]]):
+        self.until = until
+        self.lines: List[LogRecord] = []
+        self.complete = False
+        self.last_line_at: Optional[float] = None
+
+
+class CommandCorrelator:
+    """
+    コマンドを送信し、その出力の行を集めて返す
+    同時に複数の呼び出し元がいる場合は1つずつ順番に送信し、出力が混ざらないようにする
+    """
+
+    def __init__(self, events: LogEventBus, send_command: Callable[[str], bool],
+                 execute: Optional[Callable[[str, float], Optional[str]]] = None):
+        """
+        Args:
+            events: 購読するサーバーログのイベントバス
+            send_command: サーバーにコマンドを送信する関数
+            execute: コマンドを実行して応答を直接返す関数 (RCONなど。引数はコマンドと応答の待ち時間)。
+                     応答を返せない場合は None を返し、その場合は send_command で送信して出力を待つ。
+                     送信した後に応答を受け取れなかった場合は RconReplyLostException を投げる
+        """
+        self._send_command = send_command
+        self._execute = execute
+        self._serial = threading.Lock()
+        self._cond = threading.Condition()
+        self._waiter: Optional[_Waiter] = None
+        events.subscribe(self._handle)
+
+    def _handle(self, record: LogRecord):
+        with self._cond:
+            waiter = self._waiter
+            if waiter is None or waiter.complete:
+                return
+            waiter.lines.append(record)
+            waiter.last_line_at = time.monotonic()
+            if waiter.until is not None:
+                try:
+                    waiter.complete = bool(waiter.until(record))
+                except Exception as e:
+                    print(f"コマンド応答の判定中にエラーが発生しました: {e}")
+            self._cond.notify_all()
+
+    def send_and_wait(self, command: str, timeout: float = 3.0,
+                      until: Optional[Callable[[LogRecord], bool]] = None,
+                      idle: float = 0.3) -> CommandResult:
+        """
+        コマンドを送信し、出力を待つ
+
+        Args:
+            command: 送信するコマンド
+            timeout: 最大待ち時間 (秒)
+            until: この関数が True を返す行を受け取った時点で終了する (その行も結果に含む)
+            idle: until を指定しない場合、最初の行の後にこの秒数だけ出力が途切れたら終了する
+
+        Returns:
+            CommandResult
+        """
+        with self._serial:
+            deadline = time.monotonic() + timeout
+            # RCONの応答を待つ間に届いたコンソール出力も、応答を受け取れなかった場合に使うため集めておく
+            waiter = _Waiter(until)
+            with self._cond:
+                self._waiter = waiter
+            try:
+                response = None
+                if self._execute is not None:
+                    try:
+                        response = self._execute(command, timeout)
+                    except RconReplyLostException as e:
+                        # サーバーでは実行された可能性があるため送り直さない
+                        print(e)
+                        if until is None:
+                            return CommandResult(True, [], False)
+                        return self._wait(waiter, deadline, until, idle)
+                if response is not None:
+                    return self._result_from_response(response, until)
+                if not self._send_command(command):
+                    return CommandResult(False, [], False)
+                return self._wait(waiter, deadline, until, idle)
+            finally:
+                with self._cond:
+                    self._waiter = None
+
+    def _wait(self, waiter: _Waiter, deadline: float, until: Optional[Callable[[LogRecord], bool]],
+              idle: float) -> CommandResult:
+        """until に一致する行を受け取るか、deadline になるまでコンソール出力を集める"""
+        with self._cond:
+            while not waiter.complete:
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    break
+                if until is None and waiter.last_line_at is not None:
+                    quiet_left = waiter.last_line_at + idle - now
+                    if quiet_left <= 0:
+                        break
+                    remaining = min(remaining, quiet_left)
+                self._cond.wait(remaining)
+            return CommandResult(True, list(waiter.lines), waiter.complete)
+
+    @staticmethod
+    def _result_from_response(response: str, until: Optional[Callable[[LogRecord], bool]]) -> CommandResult:
+        """直接受け取った応答を、コンソール出力の行と同じ形 (LogRecord) にして返す"""
+        lines = []
+        complete = False
+        for line in response.splitlines():
+            if not line.strip():
+                continue
+            record = parse_line(line)
+            lines.append(record)
+            if until is not None:
+                try:
+                    if until(record):
+                        complete = True
+                        break
+                except Exception as e:
+                    print(f"コマンド応答の判定中にエラーが発生しました: {e}")
+        return CommandResult(True, lines, complete or until is None)
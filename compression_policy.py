@@ -0,0 +1,128 @@
+"""
+バックアップの圧縮ポリシー (ファイルの種類ごとに 保存しない / 圧縮せずに保存 / 圧縮 を決める)
+リージョンファイル (.mca) やNBT (.dat)、PNG などは既に圧縮されているため、deflate しても CPU を使うだけで小さくならない
+session.lock のような不要なファイルはバックアップに含めない
+"""
+import fnmatch
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+ACTION_EXCLUDE = "exclude"
+ACTION_STORE = "store"
+ACTION_COMPRESS = "compress"
+
+DEFAULT_POLICY = {
+    # バックアップに含めないファイル (ファイル名またはワールドフォルダからの相対パスに対するパターン)
+    "exclude": ["session.lock", "*.tmp"],
+    # 圧縮済みのため、圧縮せずに保存するファイル
+    "store": ["*.mca", "*.mcc", "*.dat", "*.dat_old", "*.nbt", "*.png", "*.gz", "*.zip", "*.jar"],
+}
+# 圧縮しなかったファイルを圧縮した場合の見積もりに使うデータの量 (1回のバックアップあたり)
+SAMPLE_BUDGET = 4 * 1024 * 1024
+SAMPLE_SIZE = 256 * 1024
+
+
+def get_policy(cfg: Dict) -> Dict:
+    """インスタンスの設定から圧縮ポリシーを返す (足りない項目は既定値で補う)"""
+    return {**DEFAULT_POLICY, **(cfg.get('backup_policy') or {})}
+
+
+def _matches(rel: str, patterns: List[str]) -> bool:
+    name = rel.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel, pattern) for pattern in patterns)
+
+
+class CompressionPolicy:
+    """ファイルのパスから扱い方を決め、決めた結果と節約できた量を集計する"""
+
+    def __init__(self, policy: Optional[Dict] = None, level: int = 6):
+        """
+        Args:
+            policy: get_policy() の戻り値 (省略時は既定値)
+            level: 見積もりに使う deflate の圧縮レベル (実際のバックアップと同じにする)
+        """
+        policy = policy or DEFAULT_POLICY
+        self._exclude = list(policy.get('exclude', []))
+        self._store = list(policy.get('store', []))
+        self._level = level
+        self._lock = threading.Lock()
+        self._counts = {action: {'files': 0, 'bytes': 0}
+                        for action in (ACTION_EXCLUDE, ACTION_STORE, ACTION_COMPRESS)}
+        self._compress_seconds = 0.0
+        self._sample_in = self._sample_out = 0
+        self._sample_seconds = 0.0
+
+    def action(self, rel: str) -> str:
+        """ワールドフォルダからの相対パス ('/' 区切り) に対する扱い方"""
+        if _matches(rel, self._exclude):
+            return ACTION_EXCLUDE
+        if _matches(rel, self._store):
+            return ACTION_STORE
+        return ACTION_COMPRESS
+
+    def record(self, action: str, size: int):
+        """ファイルを扱った結果を記録する"""
+        with self._lock:
+            counts = self._counts[action]
+            counts['files'] += 1
+            counts['bytes'] += size
+
+    def add_compress_time(self, seconds: float):
+        """実際に圧縮に使ったCPU時間を記録する"""
+        with self._lock:
+            self._compress_seconds += seconds
+
+    def wants_sample(self) -> bool:
+        with self._lock:
+            return self._sample_in < SAMPLE_BUDGET
+
+    def sample(self, data: bytes):
+        """
+        圧縮しなかったデータの一部を実際に圧縮し、すべて圧縮した場合の時間とサイズの見積もりに使う
+        (見積もりに使うデータの量は SAMPLE_BUDGET までに抑える)
+        """
+        if not self.wants_sample():
+            return
+        data = data[:SAMPLE_SIZE]
+        started = time.thread_time()
+        compressed = len(zlib.compress(data, self._level))
+        elapsed = time.thread_time() - started
+        with self._lock:
+            self._sample_in += len(data)
+            self._sample_out += compressed
+            self._sample_seconds += elapsed
+
+    def report(self) -> Dict:
+        """
+        集計結果を返す
+
+        estimated_saved_seconds: 圧縮しなかったファイルも圧縮した場合に、余分にかかったCPU時間の見積もり
+        estimated_size_difference: 圧縮しなかったことで増えたサイズの見積もり (負の場合は小さくなった)
+        excluded_bytes: 含めなかったファイルのサイズ
+        """
+        with self._lock:
+            stored = self._counts[ACTION_STORE]['bytes']
+            report = {action: dict(counts) for action, counts in self._counts.items()}
+            report['compress_seconds'] = round(self._compress_seconds, 3)
+            report['excluded_bytes'] = self._counts[ACTION_EXCLUDE]['bytes']
+            if self._sample_in:
+                report['estimated_saved_seconds'] = round(self._sample_seconds / self._sample_in * stored, 3)
+                report['estimated_size_difference'] = round(stored * (1 - self._sample_out / self._sample_in))
+                report['sampled_bytes'] = self._sample_in
+            else:
+                report['estimated_saved_seconds'] = 0.0
+                report['estimated_size_difference'] = 0
+                report['sampled_bytes'] = 0
+        return report
+
+
+def describe_report(report: Dict) -> str:
+    """集計結果を1行で表す (ログ出力用)"""
+    mb = 1024 * 1024
+    return (f"圧縮 {report[ACTION_COMPRESS]['files']} 個 / 無圧縮 {report[ACTION_STORE]['files']} 個 / "
+            f"除外 {report[ACTION_EXCLUDE]['files']} 個, 圧縮のCPU時間 {report['compress_seconds']} 秒, "
+            f"節約したCPU時間 (見積もり) {report['estimated_saved_seconds']} 秒, "
+            f"サイズの差 (見積もり) {report['estimated_size_difference'] / mb:+.1f} MB, "
+            f"除外したサイズ {report['excluded_bytes'] / mb:.1f} MB")
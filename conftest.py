@@ -0,0 +1,65 @@
+"""
+テストで共通に使うフィクスチャ
+小さなワールドフォルダ (通常のファイル・2つのチャンクを持つリージョンファイル・空のフォルダ) を作る
+"""
+import os
+import struct
+import zlib
+
+import pytest
+
+import region_file
+
+# ファイルとリージョンのチャンクの最終更新時刻 (秒)
+CHUNK_TIME = 1_700_000_000
+FILE_TIME = CHUNK_TIME + 100
+
+
+def region_chunk(payload: bytes) -> bytes:
+    """リージョンファイルに保存する形 (長さ, 圧縮形式, zlib で圧縮したデータ) のチャンク"""
+    compressed = zlib.compress(payload)
+    return struct.pack('>I', len(compressed) + 1) + b'\x02' + compressed
+
+
+def write_region(path: str, chunks, mtime: int = FILE_TIME):
+    """(チャンクの番号, 最終更新時刻, region_chunk() のデータ) からリージョンファイルを書く"""
+    with open(path, 'wb') as f:
+        for data in region_file.build(chunks):
+            f.write(data)
+    os.utime(path, ns=(mtime * 10 ** 9, mtime * 10 ** 9))
+
+
+def write_file(path: str, data: bytes, mtime: int = FILE_TIME):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, ns=(mtime * 10 ** 9, mtime * 10 ** 9))
+
+
+def read_world(world: str):
+    """ワールドフォルダの内容 ({相対パス: (内容, 更新時刻 (ns))}, 空のフォルダの一覧)"""
+    files, empty_dirs = {}, []
+    for root, dirs, names in os.walk(world):
+        rel_root = os.path.relpath(root, world).replace(os.sep, '/')
+        if not dirs and not names and rel_root != '.':
+            empty_dirs.append(rel_root)
+        for name in names:
+            full = os.path.join(root, name)
+            with open(full, 'rb') as f:
+                data = f.read()
+            rel = name if rel_root == '.' else f"{rel_root}/{name}"
+            files[rel] = (data, os.stat(full).st_mtime_ns)
+    return files, sorted(empty_dirs)
+
+
+@pytest.fixture
+def world(tmp_path):
+    """テスト用のワールドフォルダのパス"""
+    path = str(tmp_path / "world")
+    write_file(os.path.join(path, "level.dat"), b"level" * 100)
+    write_file(os.path.join(path, "data", "raids.dat"), os.urandom(3000))
+    os.makedirs(os.path.join(path, "region"))
+    write_region(os.path.join(path, "region", "r.0.0.mca"),
+                 [(0, CHUNK_TIME, region_chunk(b"a" * 5000)), (1, CHUNK_TIME, region_chunk(b"b" * 5000))])
+    os.makedirs(os.path.join(path, "poi"))
+    return path
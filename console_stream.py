@@ -0,0 +1,438 @@
+"""
+Webコンソール向けのログ配信パイプライン
+サーバー出力の行をまとめ、Socket.IOのフレーム数を抑えて送信する
+"""
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# バイナリ形式のフレームの先頭1バイト
+FRAME_FLAG_DEFLATE = 0x01
+# これより小さいフレームは圧縮しない (圧縮のヘッダー分だけ大きくなるため)
+COMPRESS_MIN_BYTES = 128
+
+
+def encode_lines(lines: List[str], level: int = 6) -> bytes:
+    """
+    行のリストをバイナリ形式のフレームにする
+
+    形式: [フラグ 1バイト][本文]
+    本文は「可変長整数 (LEB128) の長さ + UTF-8 の行」の繰り返しで、
+    フラグに FRAME_FLAG_DEFLATE が立っている場合は zlib (deflate) で圧縮されている
+    """
+    body = bytearray()
+    for line in lines:
+        data = line.encode('utf-8')
+        length = len(data)
+        while length >= 0x80:
+            body.append((length & 0x7f) | 0x80)
+            length >>= 7
+        body.append(length)
+        body += data
+    if len(body) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(bytes(body), level)
+        if len(compressed) < len(body):
+            return bytes([FRAME_FLAG_DEFLATE]) + compressed
+    return bytes([0]) + bytes(body)
+
+
+def decode_lines(frame: bytes) -> List[str]:
+    """encode_lines で作ったフレームを行のリストに戻す"""
+    body = frame[1:]
+    if frame[0] & FRAME_FLAG_DEFLATE:
+        body = zlib.decompress(body)
+    lines = []
+    pos = 0
+    while pos < len(body):
+        length = 0
+        shift = 0
+        while True:
+            b = body[pos]
+            pos += 1
+            length |= (b & 0x7f) << shift
+            shift += 7
+            if not b & 0x80:
+                break
+        lines.append(body[pos:pos + length].decode('utf-8', errors='replace'))
+        pos += length
+    return lines
+
+
+def frame_payload(lines: List[str], binary: bool) -> Dict:
+    """
+    フレームの本文を作る
+    バイナリ形式でも、圧縮が効かない小さなフレームはパケットのオーバーヘッドが小さいJSON形式で送る
+    """
+    if binary:
+        data = encode_lines(lines)
+        if data[0] & FRAME_FLAG_DEFLATE:
+            return {'data': data}
+    return {'lines': lines}
+
+
+class ConsoleBuffer:
+    """
+    直近のコンソール出力を保持するリングバッファ
+    各行には連番 (seq) を付与し、再接続したクライアントに取りこぼした行だけを返せるようにする
+    """
+
+    def __init__(self, max_lines: int = 5000, max_chars: int = 2 * 1024 * 1024):
+        """
+        Args:
+            max_lines: 保持する最大行数
+            max_chars: 保持する文字数の合計の上限
+        """
+        self.max_lines = max(max_lines, 1)
+        self.max_chars = max(max_chars, 1)
+        # ヘルパー再起動で連番がリセットされたことをクライアントが判別するための識別子
+        self.epoch = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._lines = deque()
+        self._chars = 0
+        self._next_seq = 0
+
+    def append(self, line: str) -> int:
+        """行を追加し、付与した連番を返す"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._lines.append((seq, line))
+            self._chars += len(line)
+            while self._lines and (len(self._lines) > self.max_lines or self._chars > self.max_chars):
+                _, old = self._lines.popleft()
+                self._chars -= len(old)
+            return seq
+
+    def since(self, last_seq: Optional[int] = None) -> Tuple[int, List[str], int]:
+        """
+        指定した連番より後の行を返す
+
+        Args:
+            last_seq: クライアントが最後に受け取った連番 (Noneの場合はバッファ全体)
+
+        Returns:
+            (最初の行の連番, 行のリスト, バッファから既に消えていて返せなかった行数)のタプル
+        """
+        with self._lock:
+            if not self._lines:
+                return self._next_seq, [], 0
+            oldest = self._lines[0][0]
+            start = oldest if last_seq is None else max(last_seq + 1, oldest)
+            missing = 0 if last_seq is None else max(0, oldest - (last_seq + 1))
+            offset = start - oldest
+            lines = [line for _, line in islice(self._lines, offset, None)]
+            return start, lines, missing
+
+    def tail(self, count: int) -> List[str]:
+        """最後の count 行を返す"""
+        with self._lock:
+            skip = max(len(self._lines) - count, 0)
+            return [line for _, line in islice(self._lines, skip, None)]
+
+    def stats(self) -> Dict:
+        """バッファの使用状況を返す"""
+        with self._lock:
+            return {
+                'epoch': self.epoch,
+                'lines': len(self._lines),
+                'chars': self._chars,
+                'next_seq': self._next_seq,
+                'max_lines': self.max_lines,
+                'max_chars': self.max_chars,
+            }
+
+
+class ConsoleBatcher:
+    """
+    コンソール出力の行をバッファし、一定時間ごと、または一定行数ごとに
+    (どちらか早い方で) 1フレームにまとめて送信する
+    """
+
+    def __init__(self, emit: Callable[[int, List[str]], None],
+                 flush_interval_ms: int = 50, max_lines: int = 200,
+                 buffer: Optional[ConsoleBuffer] = None):
+        """
+        Args:
+            emit: 最初の行の連番とまとめた行のリストを受け取って送信する関数
+            flush_interval_ms: 最初の行を受け取ってから送信するまでの最大待ち時間 (ミリ秒)
+            max_lines: 1フレームに含める最大行数
+            buffer: 行を記録するリングバッファ (指定した場合、連番はバッファが付与する)
+        """
+        self._emit = emit
+        self.buffer = buffer
+        self._local_seq = 0
+        self.flush_interval = max(flush_interval_ms, 1) / 1000.0
+        self.max_lines = max(max_lines, 1)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending: List[Tuple[int, str]] = []
+        self._first_pending_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        # 統計情報
+        self._lines_total = 0
+        self._frames_total = 0
+        self._window_started = time.monotonic()
+        self._window_lines = 0
+        self._window_frames = 0
+        self._lines_per_sec = 0.0
+        self._frames_per_sec = 0.0
+
+    def start(self):
+        """送信スレッドを開始する (既に起動済みなら何もしない)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """残りの行を送信し、送信スレッドを終了する"""
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def publish(self, line: str):
+        """1行をバッファに追加する"""
+        line = line.rstrip('\r\n')
+        with self._lock:
+            if self.buffer is not None:
+                seq = self.buffer.append(line)
+            else:
+                seq = self._local_seq
+                self._local_seq += 1
+            self._pending.append((seq, line))
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+                # タイマーを開始させるために送信スレッドを起こす
+                self._wakeup.set()
+            elif len(self._pending) >= self.max_lines:
+                self._wakeup.set()
+
+    def flush(self):
+        """バッファに溜まっている行をすべて送信する"""
+        with self._lock:
+            entries = self._pending
+            self._pending = []
+            self._first_pending_at = None
+        self._send(entries)
+
+    def stats(self) -> Dict:
+        """送信レートなどの統計情報を返す"""
+        with self._lock:
+            self._roll_window(time.monotonic())
+            return {
+                'lines_per_sec': round(self._lines_per_sec, 1),
+                'frames_per_sec': round(self._frames_per_sec, 1),
+                'lines_total': self._lines_total,
+                'frames_total': self._frames_total,
+                'pending': len(self._pending),
+                'flush_interval_ms': int(self.flush_interval * 1000),
+                'max_lines': self.max_lines,
+            }
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                first = self._first_pending_at
+            if first is None:
+                timeout = None
+            else:
+                timeout = max(0.0, first + self.flush_interval - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+            with self._lock:
+                if not self._pending:
+                    continue
+                due = time.monotonic() >= self._first_pending_at + self.flush_interval
+                if not due and len(self._pending) < self.max_lines:
+                    continue
+                entries = self._pending
+                self._pending = []
+                self._first_pending_at = None
+            self._send(entries)
+
+    def _send(self, entries: List[Tuple[int, str]]):
+        for i in range(0, len(entries), self.max_lines):
+            chunk = entries[i:i + self.max_lines]
+            try:
+                self._emit(chunk[0][0], [line for _, line in chunk])
+            except Exception as e:
+                print(f"コンソール出力の送信中にエラーが発生しました: {e}")
+            with self._lock:
+                self._lines_total += len(chunk)
+                self._frames_total += 1
+                self._window_lines += len(chunk)
+                self._window_frames += 1
+                self._roll_window(time.monotonic())
+
+    def _roll_window(self, now: float):
+        """1秒ごとに送信レートを更新する (ロック取得済みで呼ぶこと)"""
+        elapsed = now - self._window_started
+        if elapsed < 1.0:
+            return
+        self._lines_per_sec = self._window_lines / elapsed
+        self._frames_per_sec = self._window_frames / elapsed
+        self._window_started = now
+        self._window_lines = 0
+        self._window_frames = 0
+
+
+class ConsoleSubscriber:
+    """コンソール出力を受け取るクライアント1つ分の送信キュー"""
+
+    def __init__(self, client_id: str, max_queue: int, binary: bool = False):
+        self.client_id = client_id
+        self.max_queue = max_queue
+        # True の場合は行を encode_lines で圧縮したバイナリ形式で送る
+        self.binary = binary
+        self.queue = deque()
+        self.last_seq: Optional[int] = None
+        self.in_flight = 0
+        self.skipped = 0
+        # 送信順序を保つため、1クライアントへの送信は同時に1スレッドだけが行う
+        self.send_lock = threading.RLock()
+
+        # 統計情報
+        self.queued_total = 0
+        self.sent_total = 0
+        self.dropped_total = 0
+        self.frames_total = 0
+        self.bytes_total = 0
+
+    def stats(self) -> Dict:
+        return {
+            'client_id': self.client_id,
+            'transport': 'binary' if self.binary else 'json',
+            'queued': len(self.queue),
+            'in_flight': self.in_flight,
+            'queued_total': self.queued_total,
+            'sent_total': self.sent_total,
+            'dropped_total': self.dropped_total,
+            'frames_total': self.frames_total,
+            'bytes_total': self.bytes_total,
+        }
+
+
+class ConsoleFanout:
+    """
+    コンソール出力をクライアントごとの上限付きキューに振り分けて送信する
+
+    各クライアントは受信したフレームにACKを返し、未ACKのフレームが一定数に達したクライアントには
+    それ以上送信しない。その間に溜まった行がキューの上限を超えた場合は古い行から捨て、
+    次のフレームで「N行スキップ」として通知する。遅いクライアントがいても
+    ログの読み取りや他のクライアントへの配信は止まらない。
+    """
+
+    def __init__(self, send: Callable[[str, Dict, Callable], None],
+                 buffer: Optional[ConsoleBuffer] = None,
+                 max_queue: int = 2000, max_in_flight: int = 4, max_frame_lines: int = 200):
+        """
+        Args:
+            send: (クライアントID, ペイロード, ACK時のコールバック) を受け取って送信する関数
+            buffer: 接続時の再送に使うリングバッファ
+            max_queue: クライアントごとに保持する未送信行の上限
+            max_in_flight: クライアントごとの未ACKフレーム数の上限
+            max_frame_lines: 1フレームに含める最大行数
+        """
+        self._send = send
+        self.buffer = buffer
+        self.max_queue = max(max_queue, 1)
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_frame_lines = max(max_frame_lines, 1)
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, ConsoleSubscriber] = {}
+
+    def subscribe(self, client_id: str, last_seq: Optional[int] = None, binary: bool = False):
+        """
+        クライアントを登録し、リングバッファから取りこぼした行を送信キューに積む
+
+        Args:
+            client_id: クライアントID (Socket.IOのsid)
+            last_seq: クライアントが最後に受け取った連番 (Noneの場合はバッファ全体を再送)
+            binary: 行を圧縮したバイナリ形式で送るか
+        """
+        sub = ConsoleSubscriber(client_id, self.max_queue, binary)
+        with self._lock:
+            if self.buffer is not None:
+                first_seq, lines, missing = self.buffer.since(last_seq)
+                sub.skipped += missing
+                self._enqueue(sub, first_seq, lines)
+            self._subscribers[client_id] = sub
+        self._drain(sub)
+
+    def unsubscribe(self, client_id: str):
+        with self._lock:
+            self._subscribers.pop(client_id, None)
+
+    def publish(self, first_seq: int, lines: List[str]):
+        """すべてのクライアントの送信キューに行を積み、送信できるクライアントに送る"""
+        with self._lock:
+            subs = list(self._subscribers.values())
+            for sub in subs:
+                self._enqueue(sub, first_seq, lines)
+        for sub in subs:
+            self._drain(sub)
+
+    def stats(self) -> List[Dict]:
+        """クライアントごとの統計情報を返す"""
+        with self._lock:
+            return [sub.stats() for sub in self._subscribers.values()]
+
+    def _enqueue(self, sub: ConsoleSubscriber, first_seq: int, lines: List[str]):
+        """送信キューに行を積む (ロック取得済みで呼ぶこと)"""
+        for offset, line in enumerate(lines):
+            seq = first_seq + offset
+            # 再送分とライブ出力の重複を除く
+            if sub.last_seq is not None and seq <= sub.last_seq:
+                continue
+            sub.queue.append((seq, line))
+            sub.last_seq = seq
+            sub.queued_total += 1
+        while len(sub.queue) > sub.max_queue:
+            sub.queue.popleft()
+            sub.skipped += 1
+            sub.dropped_total += 1
+
+    def _drain(self, sub: ConsoleSubscriber):
+        """未ACKフレーム数の上限まで、キューに溜まった行をフレームにして送信する"""
+        with sub.send_lock:
+            while True:
+                with self._lock:
+                    if self._subscribers.get(sub.client_id) is not sub:
+                        return
+                    if sub.in_flight >= self.max_in_flight or (not sub.queue and not sub.skipped):
+                        return
+                    count = min(len(sub.queue), self.max_frame_lines)
+                    entries = [sub.queue.popleft() for _ in range(count)]
+                    next_seq = sub.last_seq + 1 if sub.last_seq is not None else 0
+                    payload = {
+                        'seq': entries[0][0] if entries else next_seq,
+                        'skipped': sub.skipped,
+                    }
+                    sub.skipped = 0
+                    sub.in_flight += 1
+                    sub.sent_total += count
+                    sub.frames_total += 1
+                payload.update(frame_payload([line for _, line in entries], sub.binary))
+                if 'data' in payload:
+                    sub.bytes_total += len(payload['data'])
+                try:
+                    self._send(sub.client_id, payload, lambda *args, s=sub: self._on_ack(s))
+                except Exception as e:
+                    print(f"コンソール出力の送信中にエラーが発生しました: {e}")
+                    with self._lock:
+                        sub.in_flight -= 1
+                    return
+
+    def _on_ack(self, sub: ConsoleSubscriber):
+        with self._lock:
+            sub.in_flight = max(0, sub.in_flight - 1)
+        self._drain(sub)
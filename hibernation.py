@@ -0,0 +1,303 @@
+"""
+アイドル時の休止 (ハイバネーション)
+プレイヤーがいない状態が一定時間続いたサーバーを停止し、代わりに軽量なリスナーでゲームポートを保持する
+リスナーはステータスの問い合わせに「スリープ中」のMOTDで応答し、ログインの要求が来たらサーバーを起動する
+"""
+import json
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from server_ping import (NEXT_STATE_LOGIN, NEXT_STATE_STATUS, ServerPingException, decode_varint,
+                         encode_string, make_packet, read_packet)
+
+# アイドル状態を確認する間隔 (秒)
+CHECK_INTERVAL = 30
+# リスナーが1つの接続の処理に使う最大時間 (秒)
+CLIENT_TIMEOUT = 5.0
+
+DEFAULT_HIBERNATION = {
+    "enabled": False,
+    "idle_minutes": 15,
+    "motd": "§7スリープ中です。接続するとサーバーが起動します",
+    "wake_message": "サーバーを起動しています。30秒ほどしてから再接続してください。",
+}
+
+
+def get_hibernation(cfg: Dict) -> Dict:
+    """インスタンスの設定からアイドル時の休止の設定を返す (足りない項目は既定値で補う)"""
+    return {**DEFAULT_HIBERNATION, **(cfg.get('hibernation') or {})}
+
+
+def parse_handshake(payload: bytes) -> Dict:
+    """ハンドシェイクの本文からプロトコル番号・接続先・次の状態を取り出す"""
+    protocol, offset = decode_varint(payload)
+    length, offset = decode_varint(payload, offset)
+    host = payload[offset:offset + length].decode('utf-8', errors='replace')
+    offset += length
+    port = int.from_bytes(payload[offset:offset + 2], 'big')
+    next_state, _ = decode_varint(payload, offset + 2)
+    return {'protocol': protocol, 'host': host, 'port': port, 'next_state': next_state}
+
+
+class SleepListener:
+    """停止中のサーバーの代わりにゲームポートで待ち受けるリスナー"""
+
+    def __init__(self, host: str, port: int, motd: str, wake_message: str,
+                 on_wake: Callable[[Dict], None], max_players: int = 20):
+        """
+        Args:
+            host / port: 待ち受けるアドレス (サーバーの server-ip / server-port)
+            motd: ステータスの問い合わせに返すMOTD
+            wake_message: ログインしようとしたプレイヤーに表示する切断メッセージ
+            on_wake: ログインの要求を受け取ったときに1回だけ呼ばれる関数 (ハンドシェイクの内容を受け取る)
+            max_players: ステータスに表示する最大人数
+        """
+        self.host = host
+        self.port = port
+        self.motd = motd
+        self.wake_message = wake_message
+        self.max_players = max_players
+        self._on_wake = on_wake
+        self._woken = False
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self.status_requests = 0
+        self.since = time.time()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 終了の確認のため、accept は一定時間ごとに戻るようにする
+        self._sock.settimeout(0.5)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        待ち受けを開始する
+
+        Raises:
+            OSError: ポートを使用できない場合
+        """
+        try:
+            self._sock.bind((self.host or '0.0.0.0', self.port))
+            self._sock.listen()
+        except OSError:
+            self._sock.close()
+            raise
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        self._sock.close()
+
+    def _handle(self, conn: socket.socket):
+        conn.settimeout(CLIENT_TIMEOUT)
+        try:
+            packet_id, payload = read_packet(conn)
+            if packet_id != 0x00:
+                return
+            handshake = parse_handshake(payload)
+            if handshake['next_state'] == NEXT_STATE_STATUS:
+                self._answer_status(conn, handshake)
+            elif handshake['next_state'] == NEXT_STATE_LOGIN:
+                # ログイン状態の切断パケット (0x00) で理由を表示してから閉じる
+                conn.sendall(make_packet(0x00, encode_string(json.dumps({'text': self.wake_message},
+                                                                         ensure_ascii=False))))
+                self._wake(handshake)
+        except (OSError, ServerPingException, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _answer_status(self, conn: socket.socket, handshake: Dict):
+        packet_id, _ = read_packet(conn)
+        if packet_id != 0x00:
+            return
+        self.status_requests += 1
+        status = {
+            # クライアントと同じプロトコル番号を返し、バージョン違いの表示にならないようにする
+            'version': {'name': "Sleeping", 'protocol': handshake['protocol']},
+            'players': {'online': 0, 'max': self.max_players, 'sample': []},
+            'description': {'text': self.motd},
+        }
+        conn.sendall(make_packet(0x00, encode_string(json.dumps(status, ensure_ascii=False))))
+        try:
+            packet_id, payload = read_packet(conn)
+            if packet_id == 0x01:
+                conn.sendall(make_packet(0x01, payload))
+        except (OSError, ServerPingException):
+            pass
+
+    def _wake(self, handshake: Dict):
+        with self._lock:
+            if self._woken:
+                return
+            self._woken = True
+        try:
+            self._on_wake(handshake)
+        except Exception as e:
+            print(f"サーバーの起動の要求の処理中にエラーが発生しました: {e}")
+
+    def close(self):
+        """待ち受けを終了し、ポートを解放する"""
+        self._closed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        else:
+            self._sock.close()
+
+    def stats(self) -> Dict:
+        return {
+            'address': f"{self.host or '0.0.0.0'}:{self.port}",
+            'since': self.since,
+            'status_requests': self.status_requests,
+        }
+
+
+class HibernationManager:
+    """プレイヤーがいないインスタンスを休止させ、ログインの要求で起動する"""
+
+    def __init__(self, list_instances: Callable[[], List], submit: Callable[..., object],
+                 restart: Callable[..., None]):
+        """
+        Args:
+            list_instances: インスタンスの一覧を返す関数
+            submit: OperationManager.submit と同じ引数で操作を開始する関数
+            restart: (インスタンス, 操作) を受け取り、前回と同じ引数でサーバーを起動する関数
+        """
+        self._list_instances = list_instances
+        self._submit = submit
+        self._restart = restart
+        self._lock = threading.Lock()
+        self._empty_since: Dict[str, float] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(CHECK_INTERVAL):
+            for inst in self._list_instances():
+                try:
+                    self.check(inst)
+                except Exception as e:
+                    print(f"アイドル状態の確認中にエラーが発生しました ({inst.id}): {e}")
+
+    def idle_seconds(self, inst, now: Optional[float] = None) -> Optional[float]:
+        """プレイヤーがいない状態が続いている秒数 (プレイヤーがいる場合や停止中は None)"""
+        with self._lock:
+            since = self._empty_since.get(inst.id)
+        return None if since is None else (now or time.time()) - since
+
+    def check(self, inst, now: Optional[float] = None):
+        """
+        プレイヤーがいない状態が設定時間続いていれば、休止の操作を開始する
+
+        Returns:
+            開始した操作 (休止させない場合は None)
+
+        Raises:
+            OperationException: 同じインスタンスで別の操作が実行中の場合
+        """
+        now = now or time.time()
+        settings = get_hibernation(inst.cfg)
+        # 起動完了前はプレイヤーが参加できないため、数えない
+        if not settings['enabled'] or not inst.is_running() or not inst.ready \
+                or inst.player_tracker.count() > 0:
+            with self._lock:
+                self._empty_since.pop(inst.id, None)
+            return None
+        with self._lock:
+            since = self._empty_since.setdefault(inst.id, now)
+        if now - since < settings['idle_minutes'] * 60:
+            return None
+        with self._lock:
+            self._empty_since.pop(inst.id, None)
+        return self._submit('hibernate', inst.id, lambda op: self.hibernate(inst, op))
+
+    def hibernate(self, inst, op):
+        """
+        操作 op としてサーバーを停止し、ゲームポートでスリープ中のリスナーを開始する
+
+        Raises:
+            OSError: ポートを使用できない場合 (サーバーは停止済み)
+        """
+        inst.emit('console_output', {'log': "プレイヤーがいないため、サーバーを休止します..."})
+        inst.stop(on_phase=op.set_phase)
+        inst.emit('status_update', {'status': 'Stopped'})
+        self.listen(inst)
+        op.set_phase("sleeping")
+        return {'port': inst.sleep_listener.port}
+
+    def listen(self, inst):
+        """
+        停止中のインスタンスのゲームポートでリスナーを開始する
+
+        Raises:
+            OSError: ポートを使用できない場合
+        """
+        settings = get_hibernation(inst.cfg)
+        props = inst.properties()
+        _, port = inst.game_address()
+        max_players = props.get('max-players', '20')
+        listener = SleepListener(
+            props.get('server-ip', ''), port, settings['motd'], settings['wake_message'],
+            on_wake=lambda handshake: self._on_login(inst, handshake),
+            max_players=int(max_players) if max_players.isdigit() else 20
+        )
+        listener.start()
+        inst.sleep_listener = listener
+        inst.emit('status_update', {'status': 'Sleeping'})
+        inst.emit('console_output', {'log': f"休止中: {port} 番ポートで接続を待っています。"})
+
+    def _on_login(self, inst, handshake: Dict):
+        inst.emit('console_output', {'log': f"ログインの要求 ({handshake['host']}) を受け取ったため、サーバーを起動します。"})
+        # リスナーのスレッドを止めてポートを解放するため、別のスレッドで起動する
+        threading.Thread(target=self._wake_safely, args=(inst,), daemon=True).start()
+
+    def _wake_safely(self, inst):
+        try:
+            self.wake(inst)
+        except Exception as e:
+            inst.emit('console_output', {'log': f"ERROR: 休止中のサーバーを起動できませんでした: {e}"})
+
+    def wake(self, inst):
+        """
+        リスナーを終了し、前回と同じ引数でサーバーを起動する操作を開始する
+
+        Raises:
+            OperationException: 同じインスタンスで別の操作が実行中の場合
+        """
+        self.release(inst)
+        return self._submit('wake', inst.id, lambda op: self._restart(inst, op))
+
+    def release(self, inst) -> bool:
+        """リスナーを終了してポートを解放する (休止中でなければ False)"""
+        listener, inst.sleep_listener = inst.sleep_listener, None
+        if listener is None:
+            return False
+        listener.close()
+        return True
+
+    def state(self, inst) -> Dict:
+        listener = inst.sleep_listener
+        return {
+            'settings': get_hibernation(inst.cfg),
+            'sleeping': listener is not None,
+            'listener': listener.stats() if listener else None,
+            'idle_seconds': self.idle_seconds(inst),
+        }
@@ -0,0 +1,637 @@
+"""
+サーバーインスタンスの管理
+1つのヘルパーで複数のMinecraftサーバー (ロビー、サバイバル、Modの検証用など) を同時に動かすため、
+インスタンスごとにデータフォルダ・ポート・JVM設定・ログの処理系・バックアップフォルダを分けて持つ
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import mcserverhelper as mc
+from command_channel import CommandCorrelator
+from console_stream import ConsoleBatcher, ConsoleBuffer, ConsoleFanout
+from jvm_profiles import DEFAULT_PROFILE, JVM_LAUNCH_FILE, JvmLaunch, load_launches, plan_launch, record_launch
+from log_index import LOG_INDEX_FILE, LogIndex
+from log_parser import EVENT_SERVER_READY, LogEventBus, LogParser
+from metrics import TpsSampler, detect_software
+from player_tracker import PlayerTracker
+from rcon import RconConnection, RconException, RconReplyLostException, strip_formatting
+from resource_limits import UsageSampler, apply_live, effective, memory_limit, remove_cgroup, validate
+from startup_telemetry import STARTUP_HISTORY_FILE, StartupTelemetry
+from supervisor import CrashSupervisor
+
+DEFAULT_INSTANCE = mc.DEFAULT_INSTANCE
+# インスタンスIDはURLとフォルダ名に使うため、英数字・'-'・'_' のみ許可する
+INSTANCE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+# server_data_dir を指定しないインスタンスのデータフォルダの親
+INSTANCES_DIR = "instances"
+DEFAULT_GAME_PORT = 25565
+# インスタンスごとに上書きできる設定
+INSTANCE_KEYS = ("java_cmd", "jar_path", "server_data_dir", "world_dir", "backup_dir",
+                 "log_file", "server_port", "xmx", "xms", "jvm_profile", "restart_schedule", "resources",
+                 "use_rcon", "rcon_host", "ping_host", "hibernation")
+
+
+class InstanceException(Exception):
+    """インスタンスの操作に関する例外"""
+    pass
+
+
+def instance_config(config: Dict, instance_id: str) -> Dict:
+    """
+    インスタンスの設定を返す
+    既定のインスタンスは設定ファイルの最上位の設定をそのまま使い、
+    それ以外のインスタンスは最上位の設定に instances[インスタンスID] の設定を上書きして使う
+    """
+    base = {key: value for key, value in config.items() if key != "instances"}
+    if instance_id == DEFAULT_INSTANCE:
+        return base
+    overrides = config.get("instances", {}).get(instance_id)
+    if overrides is None:
+        raise InstanceException(f"Unknown instance: {instance_id}")
+    cfg = {**base, "server_data_dir": os.path.join(INSTANCES_DIR, instance_id)}
+    cfg.update(overrides)
+    return cfg
+
+
+class ServerInstance:
+    """
+    1つのMinecraftサーバー
+    コンソール出力の配信・ログの解析・プレイヤーの追跡・TPSの計測をインスタンスごとに持つ
+    """
+
+    def __init__(self, instance_id: str, config: Dict, emit: Callable[..., None],
+                 registry: Optional['InstanceRegistry'] = None):
+        """
+        Args:
+            instance_id: インスタンスID
+            config: アプリ全体の設定 (変更はそのまま反映される)
+            emit: Socket.IOのイベントを送信する関数 (socketio.emit と同じ引数)
+            registry: 所属するインスタンスの一覧 (他のインスタンスのメモリ使用量の見積もりに使う)
+        """
+        self.id = instance_id
+        self._config = config
+        self._emit = emit
+        self._registry = registry
+        # 起動中のサーバーのJVMの設定 (停止中は None)
+        self.launch: Optional[JvmLaunch] = None
+        # 起動完了 ("Done") のログが出たか
+        self.ready = False
+        # 前回の起動に使った引数 (再起動で使う)
+        self._last_start: Optional[Dict] = None
+        # 休止中にゲームポートで待ち受けるリスナー (hibernation.SleepListener、休止中でなければ None)
+        self.sleep_listener = None
+        # このインスタンスを表示しているクライアントが参加するSocket.IOのルーム
+        self.room = f"instance:{instance_id}"
+        cfg = self.cfg
+
+        # 直近のサーバー出力 (接続・再接続したクライアントへの再送用)
+        self.console_buffer = ConsoleBuffer(max_lines=cfg.get('console_scrollback_lines', 5000))
+        # クライアントごとに上限付きの送信キューを持ち、遅いクライアントの分は間引いて送る
+        self.console_fanout = ConsoleFanout(
+            self._send_console_frame,
+            buffer=self.console_buffer,
+            max_queue=cfg.get('console_client_queue_lines', 2000),
+            max_in_flight=cfg.get('console_client_window', 4),
+            max_frame_lines=cfg.get('console_batch_lines', 200)
+        )
+        # サーバー出力は1行ずつではなく、まとめてWebUIに送信する
+        self.console_batcher = ConsoleBatcher(
+            self.console_fanout.publish,
+            flush_interval_ms=cfg.get('console_flush_ms', 50),
+            max_lines=cfg.get('console_batch_lines', 200),
+            buffer=self.console_buffer
+        )
+        self.console_batcher.start()
+
+        # サーバー出力の各行は一度だけ解析し、各機能は events を購読して型付きのイベントを受け取る
+        self.log_parser = LogParser()
+        self.events = LogEventBus()
+        # 参加・退出のログからオンラインのプレイヤーを追跡する
+        self.player_tracker = PlayerTracker(
+            self.events,
+            on_change=lambda snapshot: self.emit('players_update', snapshot)
+        )
+        # コマンドとその出力を対応付ける (mc.send_command_and_wait から利用する)
+        self.command_correlator = CommandCorrelator(
+            self.events,
+            send_command=lambda cmd: mc.send_command(cmd, quiet=True, instance_id=self.id),
+            execute=self._execute_rcon
+        )
+        mc.command_correlators[self.id] = self.command_correlator
+        # 定期的にTPS/MSPTを計測する
+        self.tps_sampler = TpsSampler(
+            self.events,
+            send_and_wait=self.command_correlator.send_and_wait,
+            is_running=self.is_running,
+            interval=cfg.get('tps_sample_interval', 5),
+            show_line=self.console_batcher.publish
+        )
+        self.tps_sampler.start()
+        # 起動から "Done" のログが出るまでの時間を記録する
+        self.startup = StartupTelemetry(
+            self.events,
+            history_path=lambda: self.path(STARTUP_HISTORY_FILE),
+            on_record=self._handle_startup_recorded
+        )
+        # 停止を要求していないのにプロセスが終了した場合に、クラッシュを記録して再起動する
+        self.supervisor = CrashSupervisor(
+            get_config=lambda: self.cfg,
+            data_dir=lambda: self.data_dir,
+            console_tail=self.console_buffer.tail,
+            restart=self._auto_restart,
+            on_event=self.emit
+        )
+
+        self._usage_sampler = UsageSampler()
+        # server.properties で RCON が有効な場合は、コマンドをRCONで送信する
+        self.configure_rcon()
+        self.events.subscribe(self._handle_ready, events=(EVENT_SERVER_READY,))
+
+        self._log_index: Optional[LogIndex] = None
+        self._log_index_lock = threading.Lock()
+
+    @property
+    def cfg(self) -> Dict:
+        """このインスタンスの設定"""
+        return instance_config(self._config, self.id)
+
+    @property
+    def data_dir(self) -> str:
+        return self.cfg.get('server_data_dir', '.')
+
+    def path(self, *parts: str) -> str:
+        """データフォルダからの相対パスを返す"""
+        return os.path.join(self.data_dir, *parts)
+
+    @property
+    def proc(self):
+        return mc.get_server_proc(self.id)
+
+    def is_running(self) -> bool:
+        proc = self.proc
+        return proc is not None and proc.poll() is None
+
+    def status(self) -> str:
+        """サーバーの現在の状態を返す"""
+        return "Running" if self.is_running() else "Stopped"
+
+    def summary(self) -> Dict:
+        """一覧表示用の情報を返す"""
+        cfg = self.cfg
+        return {
+            'id': self.id,
+            'status': self.status(),
+            'server_data_dir': cfg.get('server_data_dir', '.'),
+            'server_port': cfg.get('server_port'),
+            'jar_path': cfg.get('jar_path', ''),
+            'jvm_profile': cfg.get('jvm_profile', DEFAULT_PROFILE),
+            'players': self.player_tracker.count(),
+            'rcon': self.rcon_stats(),
+            'sleeping': self.sleep_listener is not None,
+        }
+
+    def emit(self, event: str, data: Dict):
+        """このインスタンスを表示しているクライアントにイベントを送信する"""
+        self._emit(event, {**data, 'instance': self.id}, to=self.room)
+
+    def update_config(self, values: Dict):
+        """このインスタンスの設定を更新して保存する"""
+        if self.id == DEFAULT_INSTANCE:
+            self._config.update(values)
+        else:
+            self._config.setdefault('instances', {}).setdefault(self.id, {}).update(values)
+        mc.save_config(self._config)
+
+    # --- サーバーの起動・停止 ---
+    def _running_others(self) -> List['ServerInstance']:
+        """このインスタンス以外で動いているインスタンスを返す"""
+        others = self._registry.list() if self._registry else []
+        return [inst for inst in others if inst is not self and inst.is_running()]
+
+    def jvm_instance_count(self) -> int:
+        """ヒープサイズを決めるときに数えるインスタンス数 (動いている他のインスタンスとこのインスタンス)"""
+        return len(self._running_others()) + 1
+
+    def plan_jvm(self, xmx: Optional[str] = None, xms: Optional[str] = None) -> JvmLaunch:
+        """
+        起動に使うJVMの設定を決める
+        ヒープサイズの指定がない場合は、ホストのメモリ量とインスタンス数から決める
+
+        Raises:
+            JvmProfileException: 不明なプロファイルの場合や、メモリを割り当て過ぎる場合
+        """
+        cfg = self.cfg
+        others = self._running_others()
+        return plan_launch(
+            cfg.get('jvm_profile', DEFAULT_PROFILE),
+            xmx=xmx or cfg.get('xmx'),
+            xms=xms or cfg.get('xms'),
+            instance_count=len(others) + 1,
+            others_footprint=sum(inst.launch.footprint for inst in others if inst.launch),
+            allow_overcommit=cfg.get('jvm_allow_overcommit', False),
+            # cgroup でメモリの上限を設定している場合は、その範囲でヒープサイズを決める
+            total=memory_limit(cfg.get('resources'))
+        )
+
+    def jvm_launches(self) -> List[Dict]:
+        """起動に使ったJVMの設定の履歴を新しい順に返す"""
+        return load_launches(self.path(JVM_LAUNCH_FILE))[::-1]
+
+    def start(self, jar_abs_path: str, xmx: Optional[str] = None, xms: Optional[str] = None,
+              world_type: str = "default"):
+        """
+        サーバーを起動し、出力の読み取りを開始する
+
+        Returns:
+            成功した場合は subprocess.Popen、失敗した場合は None
+
+        Raises:
+            JvmProfileException: JVMの設定を決められない場合 (メモリ不足など)
+            InstanceException: 起動中の別のインスタンスと同じゲームポートを使う場合
+        """
+        if self._registry is not None:
+            _, port = self.game_address()
+            for other in self._registry.list():
+                if other is not self and other.is_running() and other.game_address()[1] == port:
+                    raise InstanceException(f"ポート {port} は起動中のインスタンス '{other.id}' が使用しています。")
+        cfg = self.cfg
+        cfg['jar_path'] = jar_abs_path
+        # TPSの計測コマンドはサーバーソフトウェアによって異なる
+        tps_mode = cfg.get('tps_command_mode', 'auto')
+        self.tps_sampler.software = detect_software(jar_abs_path) if tps_mode == 'auto' else tps_mode
+
+        launch = self.plan_jvm(xmx, xms)
+        # 休止中はリスナーがゲームポートを使っているため、先に閉じる
+        listener, self.sleep_listener = self.sleep_listener, None
+        if listener is not None:
+            listener.close()
+        self._last_start = {'jar_abs_path': jar_abs_path, 'xmx': xmx, 'xms': xms, 'world_type': world_type}
+        spawned = time.monotonic()
+        proc = mc.start_server(cfg, xmx=launch.xmx, xms=launch.xms, world_type=world_type,
+                               instance_id=self.id, jvm_flags=launch.flags)
+        if proc:
+            self.launch = launch
+            record_launch(self.path(JVM_LAUNCH_FILE), launch, time.time(),
+                          jar=os.path.basename(jar_abs_path))
+            self.startup.begin(spawned, os.path.basename(jar_abs_path), launch.profile, launch.flags,
+                               [self.path('mods'), self.path('plugins')])
+            self.log_parser.reset()
+            self.supervisor.started()
+            self.configure_rcon()
+            self.ready = False
+            # stdoutとstderrはマージされているため、stdoutのみ読み取る
+            # 読み取りは mc.output_mux のスレッドで行われ、サーバーごとのスレッドは作らない
+            mc.output_mux.register(proc, self._handle_line, on_exit=lambda: self._handle_exit(proc))
+        return proc
+
+    def stop(self, kill_schedule: Optional[List[float]] = None,
+             on_phase: Optional[Callable[[str], None]] = None) -> bool:
+        """
+        サーバーを停止する (停止するまで戻らない)
+
+        Args:
+            kill_schedule: [terminate するまでの秒数, kill するまでの秒数] (省略時は設定値)
+            on_phase: 進行状況 ("saving", "terminating", "stopped", "killed") を受け取る関数
+        """
+        self.supervisor.stop_requested()
+        return mc.stop_server(self.id, kill_schedule=kill_schedule or self.cfg.get('stop_kill_schedule'),
+                              on_phase=on_phase)
+
+    def restart(self, kill_schedule: Optional[List[float]] = None,
+                on_phase: Optional[Callable[[str], None]] = None):
+        """
+        サーバーを停止し、前回と同じ引数で起動する
+
+        Returns:
+            起動したサーバーの subprocess.Popen
+
+        Raises:
+            InstanceException: 一度も起動していない場合や、起動に失敗した場合
+            JvmProfileException: JVMの設定を決められない場合
+        """
+        if self._last_start is None:
+            raise InstanceException("このインスタンスはまだ起動されていないため、再起動できません。")
+        notify = on_phase or (lambda phase: None)
+        if self.is_running():
+            self.stop(kill_schedule, on_phase=notify)
+        notify("starting")
+        proc = self.start(**self._last_start)
+        if not proc:
+            raise InstanceException("サーバーの起動に失敗しました。コンソールログを確認してください。")
+        notify("started")
+        return proc
+
+    def _auto_restart(self) -> bool:
+        """クラッシュ後に前回と同じ引数で起動する (CrashSupervisor から呼ばれる)"""
+        if self._last_start is None or self.is_running():
+            return False
+        # 復元などの操作の実行中に起動すると、操作中のワールドを使ってしまう
+        if self._registry is not None and self._registry.is_busy(self.id):
+            self.emit('console_output', {'log': "別の操作が実行中のため、自動での再起動を中止しました。"})
+            return False
+        self.emit('console_output', {'log': "--- サーバーを自動で再起動します ---"})
+        if not self.start(**self._last_start):
+            return False
+        self.emit('status_update', {'status': 'Running'})
+        return True
+
+    def send_command(self, cmd: str, quiet: bool = False) -> bool:
+        return mc.send_command(cmd, quiet=quiet, instance_id=self.id)
+
+    def send_command_and_wait(self, cmd: str, timeout: float = 3.0, until=None, quiet: bool = False):
+        return mc.send_command_and_wait(cmd, timeout=timeout, until=until, quiet=quiet, instance_id=self.id)
+
+    def backup_world(self, quiet: bool = False) -> Optional[str]:
+        """
+        ワールドのバックアップを作成し、マニフェスト (またはアーカイブ) のファイル名を返す (失敗した場合は None)
+        起動中の場合は save-off で自動保存を止め、save-all flush で書き込みを終えてから読み込み、最後に save-on で戻す
+        (読み込み中にサーバーがファイルを書き換えると、壊れたバックアップや古いチャンクが残るため)
+        """
+        if not self.is_running():
+            return mc.backup_world(self.cfg)
+        self.send_command("save-off", quiet=quiet)
+        try:
+            self.send_command_and_wait("save-all flush", timeout=60,
+                                       until=lambda record: "Saved the game" in record.message, quiet=quiet)
+            return mc.backup_world(self.cfg)
+        finally:
+            self.send_command("save-on", quiet=quiet)
+
+    def properties(self) -> Dict[str, str]:
+        """このインスタンスの server.properties の内容"""
+        return mc.get_properties(self.cfg)
+
+    def game_address(self) -> Tuple[str, int]:
+        """ステータスの問い合わせに使うゲームポートのアドレス"""
+        cfg = self.cfg
+        props = self.properties()
+        host = cfg.get('ping_host') or props.get('server-ip') or '127.0.0.1'
+        try:
+            port = int(cfg.get('server_port') or props.get('server-port') or DEFAULT_GAME_PORT)
+        except ValueError:
+            port = DEFAULT_GAME_PORT
+        return host, port
+
+    # --- RCON ---
+    def configure_rcon(self) -> Optional[RconConnection]:
+        """
+        server.properties の enable-rcon / rcon.port / rcon.password から、コマンドの送信に使うRCON接続を用意する
+        RCONが無効な場合は接続を閉じて None を返す
+        """
+        cfg = self.cfg
+        props = mc.get_properties(cfg)
+        password = props.get('rcon.password', '')
+        current = mc.rcon_connections.get(self.id)
+        enabled = cfg.get('use_rcon', True) and props.get('enable-rcon', 'false').lower() == 'true'
+        try:
+            port = int(props.get('rcon.port') or 25575)
+        except ValueError:
+            print(f"rcon.port の値が正しくありません: {props.get('rcon.port')}")
+            enabled = False
+        if not enabled or not password:
+            if current is not None:
+                current.close()
+                mc.rcon_connections.pop(self.id, None)
+            return None
+        host = cfg.get('rcon_host', '127.0.0.1')
+        if current is not None:
+            if current.matches(host, port, password):
+                return current
+            current.close()
+        connection = RconConnection(host, port, password, on_response=self._handle_rcon_response)
+        mc.rcon_connections[self.id] = connection
+        return connection
+
+    def rcon_stats(self) -> Optional[Dict]:
+        connection = mc.rcon_connections.get(self.id)
+        return connection.stats() if connection else None
+
+    def _execute_rcon(self, cmd: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        RCONでコマンドを実行して応答を返す (RCONが使えない場合は None)
+        送信した後に応答を受け取れなかった場合は RconReplyLostException をそのまま投げる
+        (CommandCorrelator が標準入力で送り直さずに、コンソール出力で完了を待つ)
+        """
+        connection = mc.rcon_connections.get(self.id)
+        if connection is None or not connection.available():
+            return None
+        try:
+            return strip_formatting(connection.command(cmd, timeout))
+        except RconReplyLostException:
+            raise
+        except RconException as e:
+            print(f"RCONでコマンドを送信できませんでした: {e}")
+            return None
+
+    def _handle_rcon_response(self, cmd: str, response: str):
+        """RCONで送信したコマンドの応答をコンソールに表示する (標準出力には出力されないため)"""
+        for line in strip_formatting(response).splitlines():
+            self.console_batcher.publish(line)
+
+    def _handle_ready(self, record):
+        self.ready = True
+        # RCONはサーバーの起動完了後に使えるようになるため、起動中の接続の失敗による待ち時間を解除する
+        connection = mc.rcon_connections.get(self.id)
+        if connection is not None:
+            connection.reset_backoff()
+
+    # --- リソース制御 ---
+    def set_resources(self, resources: Dict) -> List[str]:
+        """
+        リソース制御の設定を保存する
+        起動中の場合は、優先度とアフィニティをすぐにすべてのスレッドに適用する (cgroup は次の起動から)
+
+        Returns:
+            起動中のプロセスに適用できなかった内容のメッセージのリスト
+
+        Raises:
+            ResourceLimitException: 設定が正しくない場合
+        """
+        resources = validate(resources)
+        self.update_config({'resources': resources})
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            return []
+        return apply_live(proc.pid, resources)
+
+    def resource_usage(self) -> Dict:
+        """設定したリソース制御と、実際に適用されている値・使用量を返す"""
+        proc = self.proc
+        result = {'id': self.id, 'configured': self.cfg.get('resources') or {}}
+        if proc is not None and proc.poll() is None:
+            result['effective'] = effective(proc.pid)
+            result['usage'] = self._usage_sampler.sample(proc.pid)
+        return result
+
+    def _handle_line(self, line: str):
+        """サーバー出力の1行をWebUIへの送信とイベントの解析に回す (TPSの計測コマンドの応答は表示しない)"""
+        self.tps_sampler.filter_console(line)
+        self.events.publish(self.log_parser.parse(line))
+
+    def _handle_exit(self, proc):
+        """
+        サーバーの出力が終わった (プロセスが終了した) ときの後処理
+        mc.output_mux が別のスレッドで呼ぶため、プロセスの終了を待っても他のサーバーの出力は止まらない
+        """
+        self.console_batcher.flush()
+        if self.proc is not None and self.proc is not proc:
+            # 再起動で既に次のプロセスが起動している
+            return
+        self.ready = False
+        try:
+            exit_code = proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            exit_code = None
+        self.launch = None
+        self.startup.abort()
+        # オンラインのプレイヤーをクリアし、次に起動完了するまでTPSの計測を止める
+        self.player_tracker.reset()
+        self.tps_sampler.reset()
+        remove_cgroup(self.cfg.get('resources'), self.id)
+        self.supervisor.process_exited(exit_code)
+
+    def _handle_startup_recorded(self, entry: Dict):
+        self.emit('console_output', {
+            'log': f"起動時間: {entry['done_seconds']:.1f}s (ログ) / {entry['wall_seconds']:.1f}s (プロセス起動から)"
+        })
+
+    # --- Webコンソール ---
+    def _send_console_frame(self, sid: str, payload: Dict, ack: Callable):
+        """1クライアントにコンソール出力のフレームを送信する (クライアントは描画後にACKを返す)"""
+        payload['epoch'] = self.console_buffer.epoch
+        payload['instance'] = self.id
+        self._emit('console_batch', payload, to=sid, callback=ack)
+
+    def subscribe_console(self, sid: str, auth: Dict):
+        """
+        コンソール出力の配信先に登録し、取りこぼした行を再送する
+        再接続時はクライアントが最後に受け取った連番を送ってくるので、それ以降の行のみ返す
+        """
+        last_seq = auth.get('last_seq')
+        if auth.get('epoch') != self.console_buffer.epoch or not isinstance(last_seq, int):
+            last_seq = None
+        # transport='binary' を指定したクライアントには圧縮したバイナリ形式で送る
+        self.console_fanout.subscribe(sid, last_seq, binary=auth.get('transport') == 'binary')
+
+    def unsubscribe_console(self, sid: str):
+        self.console_fanout.unsubscribe(sid)
+
+    def console_stats(self) -> Dict:
+        return {
+            **self.console_batcher.stats(),
+            'scrollback': self.console_buffer.stats(),
+            'clients': self.console_fanout.stats()
+        }
+
+    # --- ログ検索 ---
+    def get_log_index(self) -> LogIndex:
+        """ログ検索インデックスを返す (初回呼び出し時に作成する)"""
+        with self._log_index_lock:
+            if self._log_index is None:
+                cfg = self.cfg
+                logs_dir = os.path.join(self.data_dir, os.path.dirname(cfg.get('log_file', 'logs/latest.log')))
+                self._log_index = LogIndex(logs_dir, db_path=self.path(LOG_INDEX_FILE))
+            return self._log_index
+
+    def close(self):
+        """インスタンスの削除時に、送信・計測のスレッドを止める"""
+        self.console_batcher.close()
+        self.tps_sampler.stop()
+        self.supervisor.close()
+        listener, self.sleep_listener = self.sleep_listener, None
+        if listener is not None:
+            listener.close()
+        connection = mc.rcon_connections.pop(self.id, None)
+        if connection is not None:
+            connection.close()
+        mc.command_correlators.pop(self.id, None)
+
+
+class InstanceRegistry:
+    """設定ファイルに登録されたサーバーインスタンスの一覧"""
+
+    def __init__(self, config: Dict, emit: Callable[..., None],
+                 is_busy: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            config: アプリ全体の設定 (instances キーにインスタンスごとの設定を持つ)
+            emit: Socket.IOのイベントを送信する関数 (socketio.emit と同じ引数)
+            is_busy: インスタンスIDを受け取り、そのインスタンスで操作 (復元など) が実行中なら True を返す関数
+        """
+        self._config = config
+        self._emit = emit
+        self._is_busy = is_busy or (lambda instance_id: False)
+        self._lock = threading.Lock()
+        self._instances: Dict[str, ServerInstance] = {}
+        self._instances[DEFAULT_INSTANCE] = ServerInstance(DEFAULT_INSTANCE, config, emit, self)
+        for instance_id in config.get('instances', {}):
+            if INSTANCE_ID_RE.match(instance_id) and instance_id != DEFAULT_INSTANCE:
+                self._instances[instance_id] = ServerInstance(instance_id, config, emit, self)
+
+    def get(self, instance_id: str) -> ServerInstance:
+        instance = self._instances.get(instance_id)
+        if instance is None:
+            raise InstanceException(f"Unknown instance: {instance_id}")
+        return instance
+
+    def list(self) -> List[ServerInstance]:
+        return list(self._instances.values())
+
+    def is_busy(self, instance_id: str) -> bool:
+        """インスタンスで操作 (復元など) が実行中か"""
+        return self._is_busy(instance_id)
+
+    def _used_ports(self) -> Dict[int, str]:
+        """登録されているインスタンスのゲームポート -> インスタンスID"""
+        return {instance.game_address()[1]: instance.id for instance in self._instances.values()}
+
+    def create(self, instance_id: str, settings: Optional[Dict] = None) -> ServerInstance:
+        """
+        インスタンスを追加して設定ファイルに保存する
+        server_port を指定しない場合は、他のインスタンスが使っていないポートを割り当てる
+        """
+        if not INSTANCE_ID_RE.match(instance_id or ''):
+            raise InstanceException("インスタンスIDには英数字、'-'、'_' のみ使用できます (32文字以内)。")
+        settings = {key: value for key, value in (settings or {}).items() if key in INSTANCE_KEYS}
+        with self._lock:
+            if instance_id in self._instances:
+                raise InstanceException(f"インスタンス '{instance_id}' は既に存在します。")
+            used = self._used_ports()
+            port = settings.get('server_port')
+            if port:
+                try:
+                    port = int(port)
+                except (TypeError, ValueError):
+                    port = 0
+                if not 1 <= port <= 65535:
+                    raise InstanceException(f"ポートの値が正しくありません: {settings['server_port']}")
+                if port in used:
+                    raise InstanceException(f"ポート {port} はインスタンス '{used[port]}' が使用しています。")
+            else:
+                port = DEFAULT_GAME_PORT
+                while port in used:
+                    port += 1
+            settings['server_port'] = port
+            self._config.setdefault('instances', {})[instance_id] = settings
+            instance = ServerInstance(instance_id, self._config, self._emit, self)
+            mc.ensure_dir(instance.data_dir)
+            self._instances[instance_id] = instance
+            mc.save_config(self._config)
+        return instance
+
+    def remove(self, instance_id: str):
+        """インスタンスを登録から外す (データフォルダは削除しない)"""
+        if instance_id == DEFAULT_INSTANCE:
+            raise InstanceException("既定のインスタンスは削除できません。")
+        with self._lock:
+            instance = self.get(instance_id)
+            if instance.is_running():
+                raise InstanceException("サーバーが起動中です。停止してから削除してください。")
+            del self._instances[instance_id]
+            self._config.get('instances', {}).pop(instance_id, None)
+            mc.save_config(self._config)
+        instance.close()
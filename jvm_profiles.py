@@ -0,0 +1,259 @@
+"""
+JVMの起動プロファイル
+GCの設定 (Aikar's flags, 世代別ZGC, 省メモリ) を選べるようにし、
+ヒープサイズをホストのメモリ量と起動中のインスタンス数から決める
+"""
+import ctypes
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# OSや他のプロセスのために残しておくメモリ (全体に対する割合と最小値)
+OS_RESERVE_FRACTION = 0.2
+OS_RESERVE_MIN = 1 * GB
+# ヒープサイズを自動で決める場合の刻み
+HEAP_STEP = 256 * MB
+# ホストのメモリ量が分からない場合の既定のヒープサイズ
+FALLBACK_HEAP = 2 * GB
+
+# Aikar's flags (https://docs.papermc.io/paper/aikars-flags)
+_AIKAR_FLAGS = [
+    "-XX:+UseG1GC", "-XX:+ParallelRefProcEnabled", "-XX:MaxGCPauseMillis=200",
+    "-XX:+UnlockExperimentalVMOptions", "-XX:+DisableExplicitGC", "-XX:+AlwaysPreTouch",
+    "-XX:G1HeapWastePercent=5", "-XX:G1MixedGCCountTarget=4", "-XX:G1MixedGCLiveThresholdPercent=90",
+    "-XX:G1RSetUpdatingPauseTimePercent=5", "-XX:SurvivorRatio=32", "-XX:+PerfDisableSharedMem",
+    "-XX:MaxTenuringThreshold=1", "-Dusing.aikars.flags=https://mcflags.emc.gs", "-Daikars.new.flags=true",
+]
+# ヒープが12GB未満の場合と、12GB以上の場合で値が異なる設定
+_AIKAR_SMALL_HEAP = ["-XX:G1NewSizePercent=30", "-XX:G1MaxNewSizePercent=40", "-XX:G1HeapRegionSize=8M",
+                     "-XX:G1ReservePercent=20", "-XX:InitiatingHeapOccupancyPercent=15"]
+_AIKAR_LARGE_HEAP = ["-XX:G1NewSizePercent=40", "-XX:G1MaxNewSizePercent=50", "-XX:G1HeapRegionSize=16M",
+                     "-XX:G1ReservePercent=15", "-XX:InitiatingHeapOccupancyPercent=20"]
+
+# プロファイルID -> 設定
+#   flags: -Xmx/-Xms 以外に付けるフラグ
+#   xms_equals_xmx: -Xms を -Xmx と同じ値にする (AlwaysPreTouch と合わせてヒープを最初に確保する)
+#   min_heap / max_heap: 自動で決めるヒープサイズの範囲
+#   overhead: ヒープ以外 (メタスペース、スレッド、GCの管理領域など) に使うメモリのヒープに対する割合
+PROFILES: Dict[str, Dict] = {
+    "standard": {
+        "label": "標準 (JVMの既定のGC)",
+        "flags": [],
+        "xms_equals_xmx": False,
+        "min_heap": 1 * GB,
+        "max_heap": None,
+        "overhead": 0.25,
+    },
+    "aikar": {
+        "label": "Aikar's flags (G1GC)",
+        "flags": _AIKAR_FLAGS,
+        "xms_equals_xmx": True,
+        "min_heap": 2 * GB,
+        "max_heap": None,
+        "overhead": 0.25,
+    },
+    "zgc": {
+        "label": "世代別ZGC (Java 21以降)",
+        "flags": ["-XX:+UseZGC", "-XX:+ZGenerational", "-XX:+AlwaysPreTouch",
+                  "-XX:+DisableExplicitGC", "-XX:+PerfDisableSharedMem"],
+        "xms_equals_xmx": True,
+        "min_heap": 4 * GB,
+        "max_heap": None,
+        "overhead": 0.35,
+    },
+    "low_memory": {
+        "label": "省メモリ (SerialGC)",
+        "flags": ["-XX:+UseSerialGC", "-XX:+UseStringDeduplication", "-Xss512k",
+                  "-XX:ReservedCodeCacheSize=64m"],
+        "xms_equals_xmx": False,
+        "min_heap": 512 * MB,
+        "max_heap": 2 * GB,
+        "overhead": 0.15,
+    },
+}
+DEFAULT_PROFILE = "standard"
+
+_SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "K": 1024, "M": MB, "G": GB, "T": 1024 * GB}
+
+
+class JvmProfileException(Exception):
+    """JVMの起動設定に関する例外 (不明なプロファイル、メモリの割り当て過ぎなど)"""
+    pass
+
+
+class JvmLaunch(NamedTuple):
+    """サーバーの起動に使うJVMの設定"""
+    profile: str
+    xmx: str
+    xms: str
+    flags: List[str]
+    heap_bytes: int     # -Xmx のバイト数
+    footprint: int      # ヒープ以外も含めたメモリ使用量の見積もり
+
+
+def parse_size(value: str) -> int:
+    """'2G', '512M', '1024' (MB) のようなサイズをバイト数に変換する"""
+    match = _SIZE_RE.match(str(value))
+    if not match:
+        raise JvmProfileException(f"メモリサイズの形式が正しくありません: {value}")
+    number, unit = match.groups()
+    # 単位がない場合はMBとみなす (-Xmx と異なり、WebUIやCLIでの入力を想定)
+    multiplier = _SIZE_UNITS[unit.upper()] if unit else MB
+    return int(float(number) * multiplier)
+
+
+def format_size(size: int) -> str:
+    """バイト数を -Xmx に渡せる形式 (MB単位) に変換する"""
+    return f"{max(size // MB, 1)}M"
+
+
+def total_memory() -> Optional[int]:
+    """ホストの物理メモリ量 (バイト) を返す。取得できない場合は None"""
+    if os.name == 'nt':
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return int(status.ullTotalPhys)
+        return None
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def usable_memory(total: int) -> int:
+    """サーバーに割り当ててよいメモリ量 (OS用に残す分を除く)"""
+    return max(total - max(OS_RESERVE_MIN, int(total * OS_RESERVE_FRACTION)), 0)
+
+
+def get_profile(profile: str) -> Dict:
+    if profile not in PROFILES:
+        raise JvmProfileException(f"不明なJVMプロファイルです: {profile}")
+    return PROFILES[profile]
+
+
+def footprint(profile: str, heap: int) -> int:
+    """ヒープ以外も含めたメモリ使用量の見積もり"""
+    return int(heap * (1 + get_profile(profile)["overhead"]))
+
+
+def recommend_heap(profile: str, instance_count: int = 1, others_footprint: int = 0,
+                   total: Optional[int] = None) -> int:
+    """
+    ホストのメモリ量からヒープサイズを決める
+
+    Args:
+        profile: プロファイルID
+        instance_count: このホストで動かすインスタンスの数 (メモリを均等に分ける)
+        others_footprint: 起動中の他のインスタンスが使っているメモリの見積もり
+        total: ホストのメモリ量 (省略時は total_memory() の値)
+    """
+    spec = get_profile(profile)
+    total = total_memory() if total is None else total
+    if not total:
+        return FALLBACK_HEAP
+    usable = usable_memory(total)
+    per_instance = usable / max(instance_count, 1)
+    available = max(usable - others_footprint, 0)
+    heap = int(min(per_instance, available) / (1 + spec["overhead"]))
+    heap = heap // HEAP_STEP * HEAP_STEP
+    if spec["max_heap"]:
+        heap = min(heap, spec["max_heap"])
+    return max(heap, spec["min_heap"])
+
+
+def plan_launch(profile: str, xmx: Optional[str] = None, xms: Optional[str] = None,
+                instance_count: int = 1, others_footprint: int = 0,
+                allow_overcommit: bool = False, total: Optional[int] = None) -> JvmLaunch:
+    """
+    起動に使うJVMの設定を決める
+
+    Args:
+        profile: プロファイルID
+        xmx: 最大ヒープサイズ。None または "auto" の場合はホストのメモリ量から決める
+        xms: 初期ヒープサイズ。プロファイルが xms_equals_xmx の場合は無視する
+        instance_count: このホストで動かすインスタンスの数
+        others_footprint: 起動中の他のインスタンスが使っているメモリの見積もり
+        allow_overcommit: True の場合、ホストのメモリを超える割り当てを許可する
+        total: ホストのメモリ量 (省略時は total_memory() の値)
+
+    Raises:
+        JvmProfileException: 不明なプロファイルの場合や、メモリを割り当て過ぎる場合
+    """
+    spec = get_profile(profile)
+    total = total_memory() if total is None else total
+    if not xmx or str(xmx).lower() == "auto":
+        heap = recommend_heap(profile, instance_count, others_footprint, total)
+    else:
+        heap = parse_size(xmx)
+
+    if spec["xms_equals_xmx"] or not xms or str(xms).lower() == "auto":
+        initial = heap if spec["xms_equals_xmx"] else min(heap, max(spec["min_heap"] // 2, 256 * MB))
+    else:
+        initial = min(parse_size(xms), heap)
+
+    flags = list(spec["flags"])
+    if profile == "aikar":
+        flags += _AIKAR_LARGE_HEAP if heap >= 12 * GB else _AIKAR_SMALL_HEAP
+
+    needed = footprint(profile, heap)
+    if total and not allow_overcommit:
+        usable = usable_memory(total)
+        if needed + others_footprint > usable:
+            raise JvmProfileException(
+                f"メモリが不足しています: このサーバーに約 {needed // MB} MB、起動中の他のサーバーに約 "
+                f"{others_footprint // MB} MB が必要ですが、割り当て可能なのは {usable // MB} MB です "
+                f"(ホストのメモリ {total // MB} MB)。"
+            )
+    return JvmLaunch(profile, format_size(heap), format_size(initial), flags, heap, needed)
+
+
+def list_profiles() -> List[Dict]:
+    return [{'id': key, 'label': spec["label"], 'flags': spec["flags"]} for key, spec in PROFILES.items()]
+
+
+# インスタンスのデータフォルダに保存する、起動に使ったJVMの設定の履歴
+JVM_LAUNCH_FILE = "jvm_launches.json"
+JVM_LAUNCH_HISTORY = 100
+
+
+def load_launches(path: str) -> List[Dict]:
+    """起動に使ったJVMの設定の履歴を読み込む (古い順)"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return []
+
+
+def record_launch(path: str, launch: JvmLaunch, started: float, **extra) -> Dict:
+    """起動に使ったJVMの設定を履歴に追加する"""
+    entry = {
+        'started': started,
+        'profile': launch.profile,
+        'xmx': launch.xmx,
+        'xms': launch.xms,
+        'flags': launch.flags,
+        **extra,
+    }
+    launches = load_launches(path)
+    launches.append(entry)
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(launches[-JVM_LAUNCH_HISTORY:], f, ensure_ascii=False, indent=2)
+    except IOError as e:
+        print(f"JVM設定の履歴を保存できませんでした: {e}")
+    return entry
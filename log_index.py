@@ -0,0 +1,288 @@
+"""
+サーバーログの全文検索インデックス
+logs/latest.log とローテートされた logs/*.log.gz を SQLite (FTS5) に取り込み、高速に検索する
+"""
+import gzip
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from log_parser import LogParser, parse_line
+
+LOG_INDEX_FILE = "log_index.sqlite3"
+# ローテートされたログのファイル名 (例: 2024-01-02-1.log.gz)
+ARCHIVE_NAME_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})-\d+\.log\.gz$')
+
+LATEST_LOG = "latest.log"
+BATCH_SIZE = 5000
+
+
+class LogIndexException(Exception):
+    """ログインデックス関連のエラー"""
+    pass
+
+
+class LogIndex:
+    """ログディレクトリの増分インデックス"""
+
+    def __init__(self, logs_dir: str, db_path: str = LOG_INDEX_FILE):
+        """
+        Args:
+            logs_dir: サーバーのログディレクトリ (例: "./logs")
+            db_path: インデックスを保存するSQLiteファイルのパス
+        """
+        self.logs_dir = logs_dir
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    offset INTEGER NOT NULL DEFAULT 0,
+                    head BLOB,
+                    day TEXT,
+                    last_time TEXT
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    ts TEXT NOT NULL,
+                    thread TEXT,
+                    level TEXT,
+                    message TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_ts ON entries(ts);
+                CREATE INDEX IF NOT EXISTS entries_file ON entries(file);
+                CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                    message, content='entries', content_rowid='id'
+                );
+            """)
+
+    # --- Indexing ---
+    def update(self) -> int:
+        """
+        ログディレクトリの差分をインデックスに取り込む
+
+        Returns:
+            新たに取り込んだ行数
+        """
+        if not os.path.isdir(self.logs_dir):
+            return 0
+        added = 0
+        with self._lock:
+            for name in sorted(os.listdir(self.logs_dir)):
+                match = ARCHIVE_NAME_RE.match(name)
+                if match:
+                    day = date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+                    added += self._index_archive(name, day)
+            added += self._index_latest()
+        return added
+
+    def _file_state(self, name: str):
+        return self._conn.execute(
+            "SELECT size, mtime, offset, head, day, last_time FROM files WHERE name = ?", (name,)
+        ).fetchone()
+
+    def _drop_file(self, name: str):
+        """ファイルの既存エントリを削除する"""
+        rows = self._conn.execute("SELECT id, message FROM entries WHERE file = ?", (name,)).fetchall()
+        self._conn.executemany(
+            "INSERT INTO entries_fts(entries_fts, rowid, message) VALUES('delete', ?, ?)", rows
+        )
+        self._conn.execute("DELETE FROM entries WHERE file = ?", (name,))
+        self._conn.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def _index_archive(self, name: str, day: date) -> int:
+        """ローテートされたgzログを取り込む (一度取り込んだものは再度展開しない)"""
+        path = os.path.join(self.logs_dir, name)
+        st = os.stat(path)
+        state = self._file_state(name)
+        if state and state[0] == st.st_size and state[1] == st.st_mtime:
+            return 0
+        try:
+            with self._conn:
+                if state:
+                    self._drop_file(name)
+                with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+                    lines = (line.rstrip('\r\n') for line in f)
+                    _, last_time, count = self._insert_lines(name, lines, day, None)
+                self._conn.execute(
+                    "INSERT INTO files(name, size, mtime, offset, day, last_time) VALUES(?, ?, ?, ?, ?, ?)",
+                    (name, st.st_size, st.st_mtime, st.st_size, day.isoformat(), last_time)
+                )
+        except (OSError, EOFError) as e:
+            print(f"ログアーカイブ '{name}' の読み込みに失敗しました: {e}")
+            return 0
+        return count
+
+    def _index_latest(self) -> int:
+        """latest.log の増えた分だけを取り込む"""
+        path = os.path.join(self.logs_dir, LATEST_LOG)
+        if not os.path.isfile(path):
+            return 0
+        st = os.stat(path)
+        state = self._file_state(LATEST_LOG)
+        with open(path, 'rb') as f:
+            head = f.read(64)
+            offset = 0
+            if state:
+                prev_offset, prev_head = state[2], state[3]
+                # 縮んだ、または先頭が変わった場合はローテートされたとみなして取り込み直す
+                if st.st_size < prev_offset or (prev_head is not None and not head.startswith(bytes(prev_head))):
+                    with self._conn:
+                        self._drop_file(LATEST_LOG)
+                    state = None
+                else:
+                    offset = prev_offset
+            if state and offset == st.st_size:
+                return 0
+            f.seek(offset)
+            data = f.read()
+
+        # 行の途中までしか書かれていない部分は次回に回す
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+        lines = data[:end].decode('utf-8', errors='replace').splitlines()
+
+        if state:
+            day = date.fromisoformat(state[4])
+            last_time = state[5]
+        else:
+            # 日付を跨いだ回数を数え、最終更新日から開始日を逆算する
+            wraps = _count_day_wraps(lines)
+            day = datetime.fromtimestamp(st.st_mtime).date() - timedelta(days=wraps)
+            last_time = None
+
+        with self._conn:
+            day, last_time, count = self._insert_lines(LATEST_LOG, lines, day, last_time)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files(name, size, mtime, offset, head, day, last_time) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (LATEST_LOG, st.st_size, st.st_mtime, offset + end, head,
+                 day.isoformat(), last_time)
+            )
+        return count
+
+    def _insert_lines(self, name: str, lines: Iterable[str], day: date, last_time: Optional[str]):
+        """行を解析してエントリを追加する。(最終行の日付, 最終行の時刻, 追加した行数) を返す"""
+        # スタックトレースなどの継続行は直前の行の時刻とレベルを引き継ぐ
+        parser = LogParser()
+        batch = []
+        count = 0
+        for line in lines:
+            if not line:
+                continue
+            record = parser.parse(line)
+            if record.time is not None:
+                if last_time is not None and record.time < last_time:
+                    day += timedelta(days=1)
+                last_time = record.time
+            ts = f"{day.isoformat()} {last_time or '00:00:00'}"
+            batch.append((name, ts, record.thread, record.level, record.message))
+            if len(batch) >= BATCH_SIZE:
+                count += self._flush_batch(batch)
+                batch = []
+        count += self._flush_batch(batch)
+        return day, last_time, count
+
+    def _flush_batch(self, batch) -> int:
+        for row in batch:
+            cur = self._conn.execute(
+                "INSERT INTO entries(file, ts, thread, level, message) VALUES(?, ?, ?, ?, ?)", row
+            )
+            self._conn.execute(
+                "INSERT INTO entries_fts(rowid, message) VALUES(?, ?)", (cur.lastrowid, row[4])
+            )
+        return len(batch)
+
+    # --- Search ---
+    def search(self, query: str = "", start: Optional[str] = None, end: Optional[str] = None,
+               levels: Optional[List[str]] = None, limit: int = 200, order: str = "desc") -> List[Dict]:
+        """
+        インデックスを検索する
+
+        Args:
+            query: 検索語 (空白区切りのAND検索、各語は前方一致)
+            start: この日時以降 (例: "2024-01-02" または "2024-01-02 12:00:00")
+            end: この日時以前
+            levels: ログレベルのリスト (例: ["WARN", "ERROR"])
+            limit: 最大件数
+            order: "asc" (古い順) または "desc" (新しい順)
+
+        Returns:
+            エントリの辞書のリスト
+        """
+        sql = "SELECT e.ts, e.file, e.thread, e.level, e.message FROM entries e"
+        where, params = [], []
+        match = _to_fts_query(query)
+        if match:
+            sql += " JOIN entries_fts ON entries_fts.rowid = e.id"
+            where.append("entries_fts MATCH ?")
+            params.append(match)
+        if start:
+            where.append("e.ts >= ?")
+            params.append(_normalize_ts(start, end_of_day=False))
+        if end:
+            where.append("e.ts <= ?")
+            params.append(_normalize_ts(end, end_of_day=True))
+        if levels:
+            where.append(f"e.level IN ({','.join('?' * len(levels))})")
+            params.extend(level.upper() for level in levels)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        direction = "ASC" if order == "asc" else "DESC"
+        sql += f" ORDER BY e.ts {direction}, e.id {direction} LIMIT ?"
+        params.append(int(limit))
+
+        with self._lock:
+            try:
+                rows = self._conn.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                raise LogIndexException(f"ログ検索エラー: {e}")
+        return [
+            {'time': ts, 'file': file, 'thread': thread, 'level': level, 'message': message}
+            for ts, file, thread, level, message in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {'files': files, 'entries': entries}
+
+
+def _count_day_wraps(lines: List[str]) -> int:
+    wraps = 0
+    last_time = None
+    for line in lines:
+        time_str = parse_line(line).time
+        if time_str is None:
+            continue
+        if last_time is not None and time_str < last_time:
+            wraps += 1
+        last_time = time_str
+    return wraps
+
+
+def _to_fts_query(query: str) -> str:
+    """利用者の入力をFTS5のクエリに変換する (各語をフレーズとして扱い前方一致にする)"""
+    terms = [t.replace('"', '""') for t in (query or "").split()]
+    return " ".join(f'"{t}"*' for t in terms if t)
+
+
+def _normalize_ts(value: str, end_of_day: bool) -> str:
+    """日付のみ、または 'T' 区切りの日時を比較用の文字列にそろえる"""
+    value = value.strip().replace('T', ' ')
+    if len(value) == 10:
+        return value + (" 23:59:59" if end_of_day else " 00:00:00")
+    return value[:19]
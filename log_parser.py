@@ -0,0 +1,145 @@
+"""
+サーバーログの構造化パーサー
+サーバー出力の各行を一度だけ解析して LogRecord に変換し、既知のイベントを分類して購読者に配信する
+"""
+import re
+import threading
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+# 例: [12:34:56] [Server thread/INFO]: Done (12.345s)! For help, type "help"
+#     [12:34:56] [Server thread/INFO] [minecraft/DedicatedServer]: ...
+#     [02Jan2024 12:34:56.789] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: ...
+#     [12:34:56 INFO]: ... (Paper/Purpur のコンソール出力。スレッド名がない)
+LINE_RE = re.compile(
+    r'^\[(?:\d{2}[A-Za-z]{3}\d{4} )?(\d{2}:\d{2}:\d{2})(?:\.\d+)?(?:\] \[([^\]]*?)/| )([A-Z]+)\]'
+    r'(?: \[([^\]]*)\])?: ?(.*)$'
+)
+
+# --- イベント種別 ---
+EVENT_PLAYER_JOIN = "player_join"
+EVENT_PLAYER_LEAVE = "player_leave"
+EVENT_CHAT = "chat"
+EVENT_SERVER_READY = "server_ready"
+EVENT_CANT_KEEP_UP = "cant_keep_up"
+EVENT_STACK_TRACE = "stack_trace"
+
+# (イベント種別, 事前チェック用の部分文字列, 正規表現)
+# 部分文字列が含まれない行では正規表現を実行しない
+_EVENT_PATTERNS: Tuple[Tuple[str, str, "re.Pattern"], ...] = (
+    (EVENT_PLAYER_JOIN, " joined the game", re.compile(r'^(\w{1,16}) joined the game$')),
+    (EVENT_PLAYER_LEAVE, " left the game", re.compile(r'^(\w{1,16}) left the game$')),
+    (EVENT_CHAT, "<", re.compile(r'^(?:\[Not Secure\] )?<(\w{1,16})> (.*)$')),
+    (EVENT_SERVER_READY, "Done (", re.compile(r'^Done \((\d+(?:\.\d+)?)s\)!')),
+    (EVENT_CANT_KEEP_UP, "Can't keep up!", re.compile(
+        r"^Can't keep up! Is the server overloaded\? Running (\d+)ms or (\d+) ticks behind")),
+)
+
+# スタックトレースの行 (例: "\tat net.minecraft...", "Caused by: ...", "java.lang.NullPointerException: ...")
+_STACK_TRACE_RE = re.compile(r'^(?:\s+at |\s*\.\.\. \d+ more|Caused by: |Suppressed: |[\w.$]+(?:Exception|Error|Throwable)(?::|$))')
+
+
+class LogRecord(NamedTuple):
+    """解析済みのログ1行"""
+    line: str                     # 元の行
+    time: Optional[str]           # "HH:MM:SS"
+    thread: Optional[str]         # 例: "Server thread"
+    level: Optional[str]          # 例: "INFO"
+    source: Optional[str]         # 例: "minecraft/DedicatedServer" (Forge系のみ)
+    message: str
+    event: Optional[str] = None   # イベント種別 (EVENT_*)
+    data: Tuple = ()              # イベントごとの値 (例: 参加したプレイヤー名)
+
+
+def parse_line(line: str) -> LogRecord:
+    """
+    前後の行を考慮せずに1行を解析する
+    ヘッダーのない行は time/thread/level が None の LogRecord になる
+    """
+    line = line.rstrip('\r\n')
+    match = LINE_RE.match(line)
+    if not match:
+        return LogRecord(line, None, None, None, None, line)
+    time_str, thread, level, source, message = match.groups()
+    event, data = _classify(message)
+    return LogRecord(line, time_str, thread, level, source, message, event, data)
+
+
+def _classify(message: str) -> Tuple[Optional[str], Tuple]:
+    for event, keyword, pattern in _EVENT_PATTERNS:
+        if keyword in message:
+            match = pattern.match(message)
+            if match:
+                return event, match.groups()
+    return None, ()
+
+
+class LogParser:
+    """
+    サーバー出力を順に解析するパーサー
+    ヘッダーのない継続行 (スタックトレースなど) は直前の行の時刻・スレッド・レベルを引き継ぐ
+    """
+
+    def __init__(self):
+        self._last: Optional[LogRecord] = None
+
+    def parse(self, line: str) -> LogRecord:
+        record = parse_line(line)
+        if record.time is None:
+            last = self._last
+            event = EVENT_STACK_TRACE if _STACK_TRACE_RE.match(record.message) else None
+            if last is not None:
+                record = record._replace(time=last.time, thread=last.thread,
+                                         level=last.level, source=last.source, event=event)
+            else:
+                record = record._replace(event=event)
+        else:
+            self._last = record
+        return record
+
+    def reset(self):
+        self._last = None
+
+
+class LogEventBus:
+    """LogRecord を購読者に配信する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Tuple[Callable[[LogRecord], None], Optional[frozenset]]] = {}
+        # 配信時にロックを取らずに済むよう、購読者一覧のスナップショットを持っておく
+        self._snapshot: Tuple = ()
+        self._next_id = 0
+
+    def subscribe(self, callback: Callable[[LogRecord], None],
+                  events: Optional[Iterable[str]] = None) -> int:
+        """
+        購読を登録する
+
+        Args:
+            callback: LogRecord を受け取る関数
+            events: 受け取るイベント種別 (Noneの場合はすべての行を受け取る)
+
+        Returns:
+            購読解除に使うID
+        """
+        with self._lock:
+            token = self._next_id
+            self._next_id += 1
+            self._subscribers[token] = (callback, frozenset(events) if events is not None else None)
+            self._snapshot = tuple(self._subscribers.values())
+            return token
+
+    def unsubscribe(self, token: int):
+        with self._lock:
+            self._subscribers.pop(token, None)
+            self._snapshot = tuple(self._subscribers.values())
+
+    def publish(self, record: LogRecord):
+        for callback, events in self._snapshot:
+            if events is not None and record.event not in events:
+                continue
+            try:
+                callback(record)
+            except Exception as e:
+                print(f"ログイベントの処理中にエラーが発生しました: {e}")
+
@@ -10,6 +10,15 @@ import urllib.request
 import tarfile
 import threading
 
+from process_io import OutputMultiplexer
+import resource_limits
+from rcon import RconException, RconReplyLostException
+import backup_store
+from backup_store import BackupStoreException
+import archive_writer
+import compression_policy
+import world_restore
+
 # ==== Config loading (.env or config.json) ====
 # 設定ファイル: 実行ディレクトリ内の 'mcserve_helper_config.json'
 # サーバーデータ: '.' (実行ディレクトリ)
@@ -24,16 +33,102 @@ DEFAULT_CONFIG = {
     "server_data_dir": ".", # サーバー関連ファイルのルートディレクトリ
     "world_dir": "world",
     "backup_dir": "backups",
+    # バックアップの形式 ("snapshot": 重複排除のスナップショット, "zip": ワールド全体のzip,
+    # "tar.zst" / "tar.lz4": ワールド全体のtar (zstandard / lz4 パッケージが必要))
+    "backup_format": "snapshot",
+    # バックアップの圧縮に使うスレッドの数 (0 の場合はCPUのコア数)
+    "backup_workers": 0,
+    # バックアップの圧縮ポリシー (exclude: 含めないファイル, store: 圧縮済みのため圧縮せずに保存するファイル)
+    # パターンはファイル名、またはワールドフォルダからの相対パス ('/' 区切り) に一致させる
+    "backup_policy": {
+        "exclude": ["session.lock", "*.tmp"],
+        "store": ["*.mca", "*.mcc", "*.dat", "*.dat_old", "*.nbt", "*.png", "*.gz", "*.zip", "*.jar"],
+    },
+    # スナップショットでリージョンファイル (.mca) をゲームのチャンクごとに保存し、更新されたチャンクだけを読み込む
+    "backup_region_chunks": True,
     "ops_file": "ops.json",
     "whitelist_file": "whitelist.json",
     "log_file": "logs/latest.log",
-    "eula_file": "eula.txt"
+    "eula_file": "eula.txt",
+    # Webコンソールへの送信間隔 (ミリ秒) と1フレームあたりの最大行数
+    "console_flush_ms": 50,
+    "console_batch_lines": 200,
+    # 再接続時に再送するためにメモリ上に保持するコンソール出力の行数
+    "console_scrollback_lines": 5000,
+    # クライアントごとの未送信行の上限と、ACK待ちにできるフレーム数
+    "console_client_queue_lines": 2000,
+    "console_client_window": 4,
+    # TPS/MSPTの計測間隔 (秒, 0で無効) と計測コマンドの種類 ("auto", "paper", "forge", "neoforge", "vanilla", "unknown")
+    # "auto" では公式サーバーはJAR名から 1.20.3 以降と分かる場合だけ計測する (それ以外で計測するには "vanilla" を指定する)
+    "tps_sample_interval": 5,
+    "tps_command_mode": "auto",
+    # JVMのプロファイル ("standard", "aikar", "zgc", "low_memory")
+    # ホストのメモリを超えるヒープの割り当てを許可するか
+    "jvm_profile": "standard",
+    "jvm_allow_overcommit": False,
+    # 停止時、'stop' を送信してからプロセスを終了 (terminate) するまでと、
+    # 終了してから強制終了 (kill) するまでに待つ秒数
+    "stop_kill_schedule": [60, 15],
+    # 停止を要求していないのにサーバーが終了した (クラッシュした) 場合に自動で再起動する
+    "crash_auto_restart": True,
+    # 再起動までの待ち時間 (クラッシュが続くたびに2倍にし、crash_restart_max_delay 秒で頭打ちにする)
+    "crash_restart_delay": 10,
+    "crash_restart_max_delay": 300,
+    # crash_loop_window 秒の間に crash_loop_limit 回を超えてクラッシュした場合は自動再起動をやめる
+    "crash_loop_limit": 3,
+    "crash_loop_window": 600,
+    # クラッシュの履歴に記録する直前のコンソール出力の行数
+    "crash_console_lines": 100,
+    # 定期再起動 (times の時刻に、warnings 秒前から予告し、save-all・バックアップをしてから再起動する)
+    # オンラインのプレイヤーが max_players 人を超える場合は、when_busy が "delay" なら
+    # delay_minutes 分ずつ (最大 max_delays 回) 遅らせ、"skip" ならその回を見送る
+    "restart_schedule": {
+        "enabled": False,
+        "times": ["04:00"],
+        "warnings": [600, 300, 60, 10],
+        "backup": True,
+        "max_players": None,
+        "when_busy": "delay",
+        "delay_minutes": 10,
+        "max_delays": 6,
+    },
+    # server.properties で enable-rcon=true の場合、コマンドを標準入力ではなくRCONで送信する
+    "use_rcon": True,
+    # RCONの接続先のホスト (ポートとパスワードは server.properties の rcon.port / rcon.password)
+    "rcon_host": "127.0.0.1",
+    # ゲームポートへのステータスの問い合わせ (Server List Ping) の間隔・タイムアウト (秒)
+    "ping_interval": 5,
+    "ping_timeout": 3,
+    # 起動完了後にこの回数だけ連続して応答がない場合は、応答なし (ハング) とみなす
+    "ping_unresponsive_after": 3,
+    # 問い合わせ先のホスト (空の場合は server.properties の server-ip、なければ 127.0.0.1)
+    "ping_host": "",
+    # プロセスのリソース制御 (cpu_affinity, nice, ionice_class/ionice_level,
+    # cgroup_memory_max, cgroup_cpu_max, cgroup_root)。インスタンスごとに上書きできる
+    "resources": {},
+    # アイドル時の休止 (プレイヤーがいない状態が idle_minutes 分続いたらサーバーを停止し、
+    # ゲームポートで motd を返すリスナーに切り替える。ログインの要求が来たら wake_message を表示して起動する)
+    "hibernation": {
+        "enabled": False,
+        "idle_minutes": 15,
+        "motd": "§7スリープ中です。接続するとサーバーが起動します",
+        "wake_message": "サーバーを起動しています。30秒ほどしてから再接続してください。",
+    },
+    # 追加のサーバーインスタンス (インスタンスID -> このインスタンスで上書きする設定)
+    # 例: {"lobby": {"server_data_dir": "instances/lobby", "server_port": 25566, "xmx": "2G"}}
+    "instances": {}
 }
 
+# 設定ファイルの最上位の設定で動くインスタンスのID
+DEFAULT_INSTANCE = "default"
+
 # グローバルプロセスオブジェクト
 # これらはapp.pyから直接管理される
-server_proc = None # Minecraft server process
+server_procs = {} # インスタンスID -> Minecraft server process
 ownserver_proc = None # Ownserver for MC process
+command_correlators = {} # インスタンスID -> サーバー出力とコマンドを対応付ける CommandCorrelator (send_command_and_wait 用)
+output_mux = OutputMultiplexer() # すべての子プロセスの出力を1つのスレッドで読み取る
+rcon_connections = {} # インスタンスID -> RconConnection (RCONが有効なインスタンスのみ)
 
 
 def load_config():
@@ -72,13 +167,20 @@ def ensure_eula(cfg):
         print(f"EULA 同意ファイルの作成に失敗しました: {e}")
 
 
-def start_server(cfg, xmx="1024M", xms="1024M", world_type="default"):
+def get_server_proc(instance_id=DEFAULT_INSTANCE):
+    """インスタンスのサーバープロセスを返す (起動していない場合は None)"""
+    return server_procs.get(instance_id)
+
+
+def start_server(cfg, xmx="1024M", xms="1024M", world_type="default", instance_id=DEFAULT_INSTANCE,
+                 jvm_flags=None):
     """
     Minecraftサーバーを起動する。
+    jvm_flags には -Xmx/-Xms 以外のJVMのフラグ (GCの設定など) を指定する。
     成功した場合はsubprocess.Popenオブジェクトを、失敗した場合はNoneを返す。
     """
-    global server_proc
-    
+    server_proc = server_procs.get(instance_id)
+
     server_data_dir = cfg.get('server_data_dir', '.')
     ensure_dir(server_data_dir)
     ensure_eula(cfg)
@@ -109,10 +211,27 @@ def start_server(cfg, xmx="1024M", xms="1024M", world_type="default"):
             for key, value in props.items():
                 f.write(f"{key}={value}\n")
 
-    cmd = [cfg['java_cmd'], f"-Xmx{xmx}", f"-Xms{xms}", "-Dfile.encoding=UTF-8", "-jar", jar_abs_path, "nogui"]
+    # インスタンスごとのポートを server.properties に反映する
+    if cfg.get('server_port'):
+        save_properties(cfg, {'server-port': cfg['server_port']})
+
+    cmd = [cfg['java_cmd'], f"-Xmx{xmx}", f"-Xms{xms}", *(jvm_flags or []),
+           "-Dfile.encoding=UTF-8", "-jar", jar_abs_path, "nogui"]
+
+    # CPUアフィニティ・優先度は taskset / nice / ionice で exec の前に設定し、JVMのすべてのスレッドに引き継がせる
+    try:
+        resources = resource_limits.validate(cfg.get('resources') or {})
+    except resource_limits.ResourceLimitException as e:
+        print(f"Error: リソース制御の設定が正しくありません: {e}")
+        return None
+    prefix, apply_later = resource_limits.command_prefix(resources)
+    cmd = prefix + cmd
     
     # stdoutとstderrをキャプチャするためにPIPEを使用
     try:
+        # taskset などを前に付けた場合も、Javaが見つからないことを起動前に知らせる
+        if prefix and shutil.which(cfg['java_cmd']) is None:
+            raise FileNotFoundError(cfg['java_cmd'])
         proc = subprocess.Popen(
             cmd, 
             stdin=subprocess.PIPE, 
@@ -122,10 +241,17 @@ def start_server(cfg, xmx="1024M", xms="1024M", world_type="default"):
             cwd=server_data_dir, # サーバーの作業ディレクトリを変更
             encoding='utf-8',
             errors='replace',
-            bufsize=1
+            bufsize=1,
+            **resource_limits.popen_options(resources)
         )
         print(f"サーバーを起動しました (PID: {proc.pid})")
-        server_proc = proc
+        # taskset などのコマンドがない項目 (Windows ではアフィニティ) は、起動直後のプロセスに設定する (失敗しても警告だけにする)
+        if apply_later:
+            for error in resource_limits.apply_live(proc.pid, apply_later):
+                print(f"警告: 優先度・アフィニティを設定できませんでした: {error}")
+        # cgroup のメモリ・CPUの上限は起動直後にプロセスを移して適用する
+        resource_limits.apply_on_start(proc, resources, instance_id)
+        server_procs[instance_id] = proc
         return proc
     except FileNotFoundError:
         print(f"Error: Javaが見つかりません。コマンド '{cfg['java_cmd']}' が実行できませんでした。Javaがインストールされているか確認してください。")
@@ -134,129 +260,252 @@ def start_server(cfg, xmx="1024M", xms="1024M", world_type="default"):
         print(f"Error: サーバーの起動中に予期しないエラーが発生しました: {e}")
         return None
 
-def stop_server():
-    """サーバーを停止する。"""
-    global server_proc
+def _terminate_process(proc, grace, notify):
+    """
+    プロセスを終了し、grace 秒以内に終了しなければ強制終了する
+    Windows では /F なしの taskkill で終了を要求し、終了しなければ /F で子プロセスごと強制終了する
+    """
+    windows = platform.system() == 'Windows'
+    notify("terminating")
+    if windows:
+        subprocess.call(["taskkill", "/PID", str(proc.pid), "/T"])
+    else:
+        proc.terminate()
+    try:
+        proc.wait(timeout=grace)
+        notify("stopped")
+    except subprocess.TimeoutExpired:
+        if windows:
+            subprocess.call(["taskkill", "/PID", str(proc.pid), "/F", "/T"])
+        else:
+            proc.kill()
+        proc.wait()
+        notify("killed")
+
+
+def stop_server(instance_id=DEFAULT_INSTANCE, kill_schedule=None, on_phase=None):
+    """
+    サーバーを停止する。
+    'stop' を送信してから kill_schedule[0] 秒待っても終了しない場合はプロセスを終了し、
+    さらに kill_schedule[1] 秒待っても終了しない場合は強制終了する。
+    on_phase には進行状況 ("saving", "terminating", "stopped", "killed") を受け取る関数を指定できる。
+    """
+    schedule = kill_schedule or DEFAULT_CONFIG['stop_kill_schedule']
+    notify = on_phase or (lambda phase: None)
+    server_proc = server_procs.get(instance_id)
     if server_proc and server_proc.poll() is None:
         print("サーバーに 'stop' コマンドを送信し、正常なシャットダウンを試みます...")
         try:
             server_proc.stdin.write("stop\n")
             server_proc.stdin.flush()
-            server_proc.wait(timeout=60)
+            notify("saving")
+            server_proc.wait(timeout=schedule[0])
             print("サーバーは正常に停止しました。")
-        except (subprocess.TimeoutExpired, BrokenPipeError):
+            notify("stopped")
+        except (subprocess.TimeoutExpired, BrokenPipeError, OSError):
             print("シャットダウンがタイムアウトしたか、パイプが壊れました。プロセスを強制終了します。")
-            if platform.system() == 'Windows':
-                subprocess.check_call(["taskkill", "/PID", str(server_proc.pid), "/F"])
-            else:
-                server_proc.terminate()
-            server_proc.wait()
+            _terminate_process(server_proc, schedule[1], notify)
             print("サーバーを強制的に停止しました。")
         except Exception as e:
             print(f"サーバー停止中にエラーが発生しました: {e}")
         finally:
-            server_proc = None
+            server_procs.pop(instance_id, None)
             return True
     else:
         print("サーバーは起動していません。")
-        server_proc = None
+        server_procs.pop(instance_id, None)
         return False
 
 
-def send_command(cmd):
-    """サーバーにコマンドを送信する。"""
-    global server_proc
+def send_command(cmd, quiet=False, instance_id=DEFAULT_INSTANCE):
+    """
+    サーバーにコマンドを送信する。quiet=True の場合は送信したコマンドを表示しない。
+    RCONが使える場合はRCONで送信し、応答をコンソールに表示する (quiet=True の場合は表示しない)。
+    RCONで送信できなかった場合は標準入力で送信する (RCONで送信した後に応答がなかった場合は、二重に実行しないよう送り直さない)。
+    """
+    rcon = rcon_connections.get(instance_id)
+    if rcon is not None and rcon.available():
+        try:
+            response = rcon.command(cmd)
+        except RconReplyLostException as e:
+            print(e)
+            return True
+        except RconException as e:
+            print(f"RCONでコマンドを送信できませんでした: {e}")
+        else:
+            if not quiet:
+                print(f"コマンド送信 (RCON): {cmd}")
+                rcon.echo(cmd, response)
+            return True
+
+    server_proc = server_procs.get(instance_id)
 
     if not server_proc or server_proc.poll() is not None:
-        print("サーバーが起動していないか、既に停止しています。")
+        if not quiet:
+            print("サーバーが起動していないか、既に停止しています。")
         return False
     try:
         server_proc.stdin.write(cmd + "\n")
         server_proc.stdin.flush()
-        print(f"コマンド送信: {cmd}")
+        if not quiet:
+            print(f"コマンド送信: {cmd}")
         return True
     except (BrokenPipeError, ValueError, OSError) as e:
         print(f"コマンド送信エラー: {e}")
         return False
 
 
+def send_command_and_wait(cmd, timeout=3.0, until=None, quiet=False, instance_id=DEFAULT_INSTANCE):
+    """
+    サーバーにコマンドを送信し、そのコマンドの出力とみなせる行を返す。
+    until を指定した場合は、その関数が True を返す行を受け取った時点で待機を終える。
+    コマンドを送信できなかった場合は None を返す。
+    """
+    command_correlator = command_correlators.get(instance_id)
+    if command_correlator is None:
+        print("コマンドの応答を受け取る準備ができていません。")
+        return None
+    result = command_correlator.send_and_wait(cmd, timeout=timeout, until=until)
+    if not result.sent:
+        return None
+    if not quiet:
+        print(f"コマンド送信: {cmd} (応答 {len(result.lines)} 行)")
+    return result.lines
+
+
 def backup_world(cfg):
-    """ワールドのバックアップを作成する。成功した場合はzipファイル名を返す。"""
+    """
+    ワールドのバックアップを作成する。成功した場合はマニフェスト (またはアーカイブ) のファイル名を返す。
+    backup_format が "snapshot" の場合は、変更のあったファイルの内容だけをチャンクストアに保存する。
+    それ以外の場合は、ワールド全体を複数のスレッドで圧縮してアーカイブに書き込む。
+    """
     server_data_dir = cfg.get('server_data_dir', '.')
     world = os.path.join(server_data_dir, cfg['world_dir'])
     bakdir = os.path.join(server_data_dir, cfg['backup_dir'])
     ensure_dir(bakdir)
+    fmt = cfg.get('backup_format', 'snapshot')
+    workers = cfg.get('backup_workers') or archive_writer.default_workers()
+    policy = compression_policy.CompressionPolicy(compression_policy.get_policy(cfg))
+    if fmt == 'snapshot':
+        try:
+            manifest = backup_store.create_snapshot(world, bakdir,
+                                                    region_chunks=cfg.get('backup_region_chunks', True),
+                                                    workers=workers, policy=policy)
+        except Exception as e:
+            print(f"バックアップ作成中にエラー: {e}")
+            return None
+        stats = manifest['stats']
+        print(f"バックアップを作成しました: {manifest['path']} "
+              f"(ファイル {stats['files']} 個中 {stats['unchanged_files']} 個は変更なし, "
+              f"リージョンのチャンク {stats['region_chunks']} 個中 {stats['region_chunks_unchanged']} 個は変更なし, "
+              f"新規データ {stats['stored_bytes'] / 1024 / 1024:.1f} MB, {stats['duration']} 秒, "
+              f"{stats['mb_per_s']} MB/s)")
+        print(f"圧縮ポリシー: {compression_policy.describe_report(stats['policy'])}")
+        return manifest['path']
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_name = os.path.join(bakdir, f"world_backup_{timestamp}.zip")
+    archive_name = os.path.join(bakdir, f"world_backup_{timestamp}{archive_writer.SUFFIXES.get(fmt, '')}")
     try:
-        with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as z:
-            for root, dirs, files in os.walk(world):
-                for file in files:
-                    full = os.path.join(root, file)
-                    rel = os.path.relpath(full, world)
-                    z.write(full, arcname=rel)
-        print(f"バックアップを作成しました: {zip_name}")
-        return zip_name
+        stats = archive_writer.write_archive(world, archive_name, fmt, workers=workers, policy=policy)
+        print(f"バックアップを作成しました: {archive_name} "
+              f"({stats['bytes'] / 1024 / 1024:.1f} MB -> {stats['compressed_bytes'] / 1024 / 1024:.1f} MB, "
+              f"{stats['duration']} 秒, {stats['mb_per_s']} MB/s, {stats['workers']} スレッド)")
+        print(f"圧縮ポリシー: {compression_policy.describe_report(stats['policy'])}")
+        return archive_name
     except Exception as e:
         print(f"バックアップ作成中にエラー: {e}")
         return None
 
 
 def list_backups(cfg):
-    """バックアップのリストを返す。"""
+    """バックアップ (スナップショットのマニフェストとアーカイブ) のリストを返す。"""
     server_data_dir = cfg.get('server_data_dir', '.')
     bakdir = os.path.join(server_data_dir, cfg['backup_dir'])
     ensure_dir(bakdir)
     if not os.path.exists(bakdir) or not os.path.isdir(bakdir):
         return []
-    backups = sorted(os.listdir(bakdir), reverse=True)
+    backups = sorted((name for name in os.listdir(bakdir)
+                      if os.path.isfile(os.path.join(bakdir, name))
+                      and (archive_writer.archive_format(name) or backup_store.is_snapshot_name(name))),
+                     reverse=True)
     return backups
 
 
-def restore_backup(cfg, backup_file):
-    """指定されたバックアップファイルを復元する。"""
+def restore_backup(cfg, backup_file, instance_id=DEFAULT_INSTANCE, on_progress=None):
+    """
+    指定されたバックアップファイルを復元する。
+    作業フォルダに並列に展開して確認してから、ワールドフォルダと入れ替える (失敗した場合は元のワールドが残る)。
+    on_progress には展開の進行状況 (phase, done, total など) が渡される。
+    """
     server_data_dir = cfg.get('server_data_dir', '.')
     world = os.path.join(server_data_dir, cfg['world_dir'])
     bakdir = os.path.join(server_data_dir, cfg['backup_dir'])
     zip_path = os.path.join(bakdir, backup_file)
 
-    if not os.path.exists(zip_path):
+    if os.path.basename(backup_file) != backup_file or not os.path.exists(zip_path):
         msg = f"バックアップファイル '{backup_file}' が見つかりません。"
         print(msg)
         return False, msg
 
+    server_proc = server_procs.get(instance_id)
     if server_proc and server_proc.poll() is None:
         msg = "サーバーが起動中です。復元前にサーバーを停止してください。"
         print(msg)
         return False, msg
 
+    if not backup_store.is_snapshot_name(backup_file):
+        fmt = archive_writer.archive_format(backup_file)
+        if fmt not in archive_writer.available_formats():
+            msg = f"'{backup_file}' の形式 ({fmt}) を読み込むためのパッケージがインストールされていません。"
+            print(msg)
+            return False, msg
+
     try:
-        if os.path.isdir(world):
-            print("既存のワールドフォルダを削除中...")
-            shutil.rmtree(world)
         print(f"'{backup_file}' を復元しています...")
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            z.extractall(world)
-        msg = "復元完了。"
+        stats = world_restore.restore_world(
+            bakdir, backup_file, world, workers=cfg.get('backup_workers') or None, on_progress=on_progress,
+            is_running=lambda: server_procs.get(instance_id) is not None and server_procs[instance_id].poll() is None
+        )
+        msg = (f"復元完了 (ファイル {stats['files']} 個, {stats['bytes'] / 1024 / 1024:.1f} MB, "
+               f"{stats['duration']} 秒, {stats['mb_per_s']} MB/s, {stats['workers']} スレッド)。")
         print(msg)
         return True, msg
     except Exception as e:
-        msg = f"復元中にエラーが発生しました: {e}"
+        msg = f"復元中にエラーが発生しました (元のワールドは残っています): {e}"
+        print(msg)
+        return False, msg
+
+
+def delete_backup(cfg, backup_file):
+    """
+    指定されたバックアップを削除する。
+    スナップショットの場合は、他のスナップショットから参照されていないチャンクも削除する。
+    """
+    server_data_dir = cfg.get('server_data_dir', '.')
+    bakdir = os.path.join(server_data_dir, cfg['backup_dir'])
+    path = os.path.join(bakdir, backup_file)
+    if os.path.basename(backup_file) != backup_file or not os.path.isfile(path):
+        return False, f"バックアップファイル '{backup_file}' が見つかりません。"
+    try:
+        if backup_store.is_snapshot_name(backup_file):
+            result = backup_store.delete_snapshot(bakdir, backup_file)
+            msg = f"削除しました (解放した容量: {result['freed_bytes'] / 1024 / 1024:.1f} MB)。"
+        else:
+            os.remove(path)
+            msg = "削除しました。"
+    except (OSError, BackupStoreException) as e:
+        msg = f"削除中にエラーが発生しました: {e}"
         print(msg)
         return False, msg
+    print(f"バックアップ '{backup_file}' を{msg}")
+    return True, msg
 
 
 def log_reader(process, callback):
     """
     プロセスの出力を非同期で読み取り、コールバック関数に渡す。
+    読み取りは output_mux のスレッドで行われ、プロセスごとのスレッドは作らない。
     """
-    try:
-        for line in iter(process.stdout.readline, ''):
-            callback(line.strip())
-    except Exception as e:
-        print(f"ログ読み取り中にエラーが発生しました: {e}")
-    finally:
-        process.stdout.close()
+    output_mux.register(process, lambda line: callback(line.strip()))
 
 
 def setup_and_run_ownserver(port=25565, log_callback=None):
@@ -300,7 +549,7 @@ def setup_and_run_ownserver(port=25565, log_callback=None):
         # print(f"Ownserverがバックグラウンドで起動しました (PID: {proc.pid})。")
         
         if log_callback:
-            threading.Thread(target=log_reader, args=(proc, log_callback), daemon=True).start()
+            log_reader(proc, log_callback)
 
         ownserver_proc = proc
         return proc
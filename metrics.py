@@ -0,0 +1,329 @@
+"""
+サーバーのTPS/MSPTの計測と時系列データの保存
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from command_channel import CommandResult
+from log_parser import EVENT_SERVER_READY, LogEventBus, LogRecord, parse_line
+
+# (名前, バケットの幅 (秒), 保持するバケット数)
+# 1秒粒度で1時間、1分粒度で1日、1時間粒度で30日分を保持する
+TIERS = (
+    ("1s", 1, 3600),
+    ("1m", 60, 1440),
+    ("1h", 3600, 720),
+)
+
+# 色コード (§a など) とANSIエスケープシーケンス
+_COLOR_RE = re.compile(r'§.|\x1b\[[0-9;]*m')
+
+# Paper/Purpur: "TPS from last 1m, 5m, 15m: 20.0, 20.0, 20.0" (上限に張り付いている場合は "*20.0")
+_PAPER_TPS_RE = re.compile(r'TPS from last 1m, 5m, 15m: \*?([\d.]+), \*?([\d.]+), \*?([\d.]+)')
+# Paper/Purpur: "Server tick times (avg/min/max) from last 5s, 10s, 1m:" の次の行
+#   "◴ 1.2/0.8/3.4, 1.1/0.7/3.5, 1.0/0.6/4.0"
+_PAPER_MSPT_HEADER = "Server tick times (avg/min/max)"
+_PAPER_MSPT_RE = re.compile(r'([\d.]+)/([\d.]+)/([\d.]+),')
+# Forge/Mohist: "Overall: Mean tick time: 1.234 ms. Mean TPS: 20.000"
+_FORGE_TPS_RE = re.compile(r'Overall\s*:\s*Mean tick time: ([\d.]+) ms\. Mean TPS: ([\d.]+)')
+# NeoForge: "Overall: 20.000 TPS (1.234 ms/tick)"
+_NEOFORGE_TPS_RE = re.compile(r'Overall: ([\d.]+) TPS \(([\d.]+) ms/tick\)')
+# Vanilla (1.20.3以降の tick query): "Average time per tick: 1.2ms (Target: 50.0ms)"
+_VANILLA_MSPT_RE = re.compile(r'Average time per tick: ([\d.]+)ms')
+# 計測コマンドの応答として出力される、値以外の行 (コンソールに表示しない)
+_SAMPLE_OUTPUT_RES = (
+    re.compile(r'Mean tick time: [\d.]+ ms'),                # Forge のディメンションごとの行
+    re.compile(r'[\d.]+ TPS \([\d.]+ ms/tick\)'),           # NeoForge のディメンションごとの行
+    re.compile(r'Target tick rate: |Percentiles: |The game is (running|frozen|sprinting)|Time per tick'),
+)
+# 計測コマンドを使えないサーバーのエラー ("Unknown or incomplete command, see below for error" の次の行が
+# "tps<--[HERE]" のように入力したコマンドを示す。10文字を超える部分は "..." に省略される)
+_COMMAND_ERROR_RE = re.compile(r'Unknown or incomplete command|Incorrect argument for command')
+_ERROR_HERE_RE = re.compile(r'^(\.\.\.)?(.*)<--\[HERE\]')
+# 公式サーバーのJARファイル名 (minecraft_server.1.21.jar / ダウンロードした server-vanilla-1.21.jar)
+_VANILLA_JAR_RE = re.compile(r'(?:minecraft_server|server-vanilla)[.-](\d+)\.(\d+)(?:\.(\d+))?')
+# tick query が追加されたバージョン
+VANILLA_TICK_QUERY_VERSION = (1, 20, 3)
+
+# サーバーソフトウェアごとの計測コマンド ("unknown" は計測しない)
+SAMPLE_COMMANDS = {
+    "paper": ["tps", "mspt"],
+    "forge": ["forge tps"],
+    "neoforge": ["neoforge tps"],
+    "vanilla": ["tick query"],
+}
+SOFTWARE_UNKNOWN = "unknown"
+# 応答から値を読み取れない計測がこの回数続いたら、次に起動するまで計測を止める
+MAX_EMPTY_SAMPLES = 3
+
+
+class _Tier:
+    """一定幅のバケットに集約した時系列データ"""
+
+    def __init__(self, step: int, size: int):
+        self.step = step
+        self.buckets = deque(maxlen=size)
+        self.current: Optional[List] = None  # [開始時刻, 合計, 件数, 最小, 最大]
+
+    def add(self, ts: float, value: float):
+        start = int(ts // self.step) * self.step
+        cur = self.current
+        if cur is not None and cur[0] == start:
+            cur[1] += value
+            cur[2] += 1
+            cur[3] = min(cur[3], value)
+            cur[4] = max(cur[4], value)
+            return
+        if cur is not None:
+            self.buckets.append(cur)
+        self.current = [start, value, 1, value, value]
+
+    def points(self, since: Optional[float] = None) -> List[List[float]]:
+        buckets = list(self.buckets)
+        if self.current is not None:
+            buckets.append(self.current)
+        return [
+            [start, round(total / count, 3), round(low, 3), round(high, 3)]
+            for start, total, count, low, high in buckets
+            if since is None or start >= since
+        ]
+
+
+class TimeSeries:
+    """1秒・1分・1時間の3段階にダウンサンプリングして保持する時系列データ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = {name: _Tier(step, size) for name, step, size in TIERS}
+
+    def add(self, value: float, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            for tier in self._tiers.values():
+                tier.add(ts, value)
+
+    def query(self, tier: str = "1m", since: Optional[float] = None) -> List[List[float]]:
+        """
+        指定した粒度のデータを返す
+
+        Returns:
+            [バケットの開始時刻, 平均, 最小, 最大] のリスト
+        """
+        if tier not in self._tiers:
+            raise ValueError(f"Unknown tier: {tier}")
+        with self._lock:
+            return self._tiers[tier].points(since)
+
+
+def detect_software(jar_path: str) -> str:
+    """
+    JARファイル名からTPSの計測方法を推定する
+    公式サーバーは tick query があるバージョン (1.20.3以降) とファイル名から分かる場合だけ "vanilla" とし、
+    分からない場合は計測しない ("unknown")。存在しないコマンドを送り続けないため
+    """
+    name = os.path.basename(jar_path or "").lower()
+    if "neoforge" in name:
+        return "neoforge"
+    if "forge" in name or "mohist" in name:
+        return "forge"
+    if "paper" in name or "purpur" in name or "folia" in name:
+        return "paper"
+    match = _VANILLA_JAR_RE.search(name)
+    if match:
+        version = tuple(int(part or 0) for part in match.groups())
+        if version >= VANILLA_TICK_QUERY_VERSION:
+            return "vanilla"
+    return SOFTWARE_UNKNOWN
+
+
+def parse_tps_output(records: List[LogRecord]) -> Dict[str, float]:
+    """
+    計測コマンドの出力からTPSとMSPTを読み取る
+
+    Returns:
+        {"tps": ..., "mspt": ...} (読み取れた値のみ)
+    """
+    values: Dict[str, float] = {}
+    expect_mspt = False
+    for record in records:
+        message = _COLOR_RE.sub('', record.message)
+        if expect_mspt:
+            expect_mspt = False
+            match = _PAPER_MSPT_RE.search(message)
+            if match:
+                values["mspt"] = float(match.group(1))
+                continue
+        if _PAPER_MSPT_HEADER in message:
+            expect_mspt = True
+            continue
+
+        match = _PAPER_TPS_RE.search(message)
+        if match:
+            values["tps"] = float(match.group(1))
+            continue
+        match = _FORGE_TPS_RE.search(message)
+        if match:
+            values["mspt"] = float(match.group(1))
+            values["tps"] = float(match.group(2))
+            continue
+        match = _NEOFORGE_TPS_RE.search(message)
+        if match:
+            values["tps"] = float(match.group(1))
+            values["mspt"] = float(match.group(2))
+            continue
+        match = _VANILLA_MSPT_RE.search(message)
+        if match:
+            mspt = float(match.group(1))
+            values["mspt"] = mspt
+            values["tps"] = min(20.0, 1000.0 / mspt) if mspt > 0 else 20.0
+    return values
+
+
+def _is_value_line(message: str) -> bool:
+    return any(pattern.search(message) for pattern in
+               (_PAPER_TPS_RE, _PAPER_MSPT_RE, _FORGE_TPS_RE, _NEOFORGE_TPS_RE, _VANILLA_MSPT_RE))
+
+
+def _is_last_sample_line(record: LogRecord) -> bool:
+    """計測コマンドの出力の最後の行かどうか"""
+    return _is_value_line(_COLOR_RE.sub('', record.message))
+
+
+class TpsSampler:
+    """
+    定期的にTPS/MSPTの計測コマンドを送信し、その応答を読み取って時系列データに保存する
+    """
+
+    def __init__(self, events: LogEventBus, send_and_wait: Callable[..., CommandResult],
+                 is_running: Callable[[], bool], interval: float = 5.0,
+                 show_line: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            events: 購読するサーバーログのイベントバス (起動完了の検出に使う)
+            send_and_wait: コマンドを送信して応答を返す関数 (CommandCorrelator.send_and_wait)
+            is_running: サーバーが起動中かどうかを返す関数
+            interval: 計測間隔 (秒)。0以下の場合は計測しない
+            show_line: コンソールに行を表示する関数 (filter_console で計測コマンドの応答を除いて呼ぶ)
+        """
+        self._send_and_wait = send_and_wait
+        self._is_running = is_running
+        self._show_line = show_line
+        self.interval = interval
+        self.software = SOFTWARE_UNKNOWN
+        self.series: Dict[str, TimeSeries] = {"tps": TimeSeries(), "mspt": TimeSeries()}
+        self._ready = False
+        self._empty_samples = 0
+        self.disabled = False
+        # 計測コマンドの応答を待っている間 (この時刻まで) は、応答の行をコンソールに表示しない
+        self._in_flight_until = 0.0
+        self._command: Optional[str] = None
+        # 計測コマンドのエラーか、次の行を見るまで分からないエラーの行
+        self._held: Optional[str] = None
+        self._console_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        events.subscribe(self._handle_ready, events=(EVENT_SERVER_READY,))
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """計測スレッドを終了する"""
+        self._stopped.set()
+
+    def reset(self):
+        """サーバー停止時に呼ぶ。次に起動完了するまで計測を止める (値を読み取れずに止めた計測も再開する)"""
+        self._ready = False
+        self._empty_samples = 0
+        self.disabled = False
+
+    def _handle_ready(self, record: LogRecord):
+        self._ready = True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self._ready or self.disabled or not self._is_running():
+                continue
+            self.sample()
+
+    def filter_console(self, line: str):
+        """
+        計測コマンドの応答を除いて、サーバー出力の行を show_line に渡す
+        応答を待っている間だけ判定する。コマンドのエラーは、次の行が計測コマンドを示す場合だけ表示しない
+        (同じ時間に送られた利用者のコマンドのエラーは表示する)
+        """
+        with self._console_lock:
+            held, self._held = self._held, None
+            shown = [held] if held is not None else []
+            command = self._command if time.monotonic() <= self._in_flight_until else None
+            message = _COLOR_RE.sub('', parse_line(line).message)
+            if command is None:
+                shown.append(line)
+            elif _COMMAND_ERROR_RE.search(message):
+                self._held = line
+            elif _ERROR_HERE_RE.search(message):
+                if not self._names_command(message, command):
+                    shown.append(line)
+                elif held is not None:
+                    shown.pop()
+            elif not (_PAPER_MSPT_HEADER in message or _is_value_line(message)
+                      or any(pattern.search(message) for pattern in _SAMPLE_OUTPUT_RES)):
+                shown.append(line)
+        if self._show_line is not None:
+            for shown_line in shown:
+                self._show_line(shown_line)
+
+    @staticmethod
+    def _names_command(message: str, command: str) -> bool:
+        """"tps<--[HERE]" のようなエラーの行が、command の入力を示しているかどうか"""
+        match = _ERROR_HERE_RE.search(message)
+        truncated, typed = match.group(1), match.group(2).strip()
+        if not typed:
+            return False
+        return typed in command if truncated else command.startswith(typed)
+
+    def _flush_console(self):
+        """次の行を待っていたエラーの行を表示する"""
+        with self._console_lock:
+            held, self._held = self._held, None
+        if held is not None and self._show_line is not None:
+            self._show_line(held)
+
+    def sample(self) -> Dict[str, float]:
+        """計測コマンドを送信し、読み取った値を保存して返す"""
+        values: Dict[str, float] = {}
+        sent = False
+        for command in SAMPLE_COMMANDS.get(self.software, []):
+            self._command = command
+            self._in_flight_until = time.monotonic() + 4.0
+            try:
+                result = self._send_and_wait(command, timeout=3.0, until=_is_last_sample_line)
+            finally:
+                # 応答の最後の行より後に届く行 (Forge のディメンションごとの行など) のために少し待つ
+                self._in_flight_until = time.monotonic() + 0.5
+                self._flush_console()
+            if result.sent:
+                sent = True
+                values.update(parse_tps_output(result.lines))
+        if sent and not values:
+            self._empty_samples += 1
+            if self._empty_samples >= MAX_EMPTY_SAMPLES:
+                self.disabled = True
+                print(f"TPSの計測コマンド ({self.software}) の応答から値を読み取れないため、"
+                      f"次に起動するまで計測を止めます。")
+        elif values:
+            self._empty_samples = 0
+        now = time.time()
+        for name, value in values.items():
+            self.series[name].add(value, now)
+        return values
+
+    def query(self, tier: str = "1m", since: Optional[float] = None) -> Dict[str, List[List[float]]]:
+        return {name: series.query(tier, since) for name, series in self.series.items()}
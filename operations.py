@@ -0,0 +1,141 @@
+"""
+時間のかかるサーバー操作 (停止・再起動など) をバックグラウンドで実行する
+リクエストはすぐに操作IDを返し、進行状況 (フェーズ) はイベントでWebUIに通知する
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# 保持する完了済みの操作の件数
+OPERATION_HISTORY_SIZE = 100
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class OperationException(Exception):
+    """操作を開始できない場合の例外 (同じインスタンスで別の操作が実行中など)"""
+
+    def __init__(self, message: str, operation: Optional['Operation'] = None):
+        super().__init__(message)
+        self.operation = operation
+
+
+class Operation:
+    """実行中または完了した1つの操作"""
+
+    def __init__(self, kind: str, instance_id: str, on_update: Callable[['Operation'], None]):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.instance_id = instance_id
+        self.status = STATUS_RUNNING
+        self.phase: Optional[str] = None
+        self.phases: List[Dict] = []
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self._on_update = on_update
+
+    def set_phase(self, phase: str, message: Optional[str] = None):
+        """フェーズを進め、WebUIに通知する"""
+        self.phase = phase
+        self.phases.append({'phase': phase, 'at': time.time(), 'message': message})
+        self._notify()
+
+    def _finish(self, status: str, result=None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self._notify()
+
+    def _notify(self):
+        try:
+            self._on_update(self)
+        except Exception as e:
+            print(f"操作の進行状況の通知中にエラーが発生しました: {e}")
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'instance': self.instance_id,
+            'status': self.status,
+            'phase': self.phase,
+            'phases': list(self.phases),
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+            'duration': round((self.finished or time.time()) - self.created, 3),
+        }
+
+
+class OperationManager:
+    """操作を1つずつスレッドで実行し、状態を保持する"""
+
+    def __init__(self, on_update: Optional[Callable[[Operation], None]] = None):
+        """
+        Args:
+            on_update: 操作のフェーズや状態が変わったときに呼ばれる関数
+        """
+        self._on_update = on_update or (lambda op: None)
+        self._lock = threading.Lock()
+        self._operations: "OrderedDict[str, Operation]" = OrderedDict()
+        self._active: Dict[str, Operation] = {}  # インスタンスID -> 実行中の操作
+
+    def submit(self, kind: str, instance_id: str, target: Callable[[Operation], object]) -> Operation:
+        """
+        操作をバックグラウンドで開始する
+
+        Args:
+            kind: 操作の種類 ("stop", "restart" など)
+            instance_id: 対象のインスタンスID (同じインスタンスでは同時に1つしか実行しない)
+            target: 操作の本体。Operation を受け取り、戻り値が result になる (例外は失敗として記録する)
+
+        Raises:
+            OperationException: 同じインスタンスで別の操作が実行中の場合
+        """
+        with self._lock:
+            active = self._active.get(instance_id)
+            if active is not None:
+                raise OperationException(
+                    f"インスタンス '{instance_id}' では別の操作 ({active.kind}) が実行中です。", active)
+            op = Operation(kind, instance_id, self._on_update)
+            self._active[instance_id] = op
+            self._operations[op.id] = op
+            while len(self._operations) > OPERATION_HISTORY_SIZE:
+                oldest_id, oldest = next(iter(self._operations.items()))
+                if oldest.status == STATUS_RUNNING:
+                    break
+                del self._operations[oldest_id]
+        threading.Thread(target=self._run, args=(op, target), daemon=True).start()
+        return op
+
+    def _run(self, op: Operation, target: Callable[[Operation], object]):
+        try:
+            result = target(op)
+        except Exception as e:
+            op._finish(STATUS_FAILED, error=str(e))
+        else:
+            op._finish(STATUS_DONE, result=result)
+        finally:
+            with self._lock:
+                if self._active.get(op.instance_id) is op:
+                    del self._active[op.instance_id]
+
+    def get(self, op_id: str) -> Optional[Operation]:
+        return self._operations.get(op_id)
+
+    def active(self, instance_id: str) -> Optional[Operation]:
+        return self._active.get(instance_id)
+
+    def list(self, instance_id: Optional[str] = None) -> List[Operation]:
+        """新しい順に操作を返す"""
+        with self._lock:
+            ops = list(self._operations.values())
+        return [op for op in ops[::-1] if instance_id is None or op.instance_id == instance_id]
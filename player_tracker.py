@@ -0,0 +1,88 @@
+"""
+ログストリームから参加・退出を追跡し、オンラインのプレイヤーとセッション履歴を保持する
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from log_parser import EVENT_PLAYER_JOIN, EVENT_PLAYER_LEAVE, LogEventBus, LogRecord
+
+
+class PlayerTracker:
+    """オンラインのプレイヤー一覧とセッション履歴"""
+
+    def __init__(self, events: LogEventBus, on_change: Optional[Callable[[Dict], None]] = None,
+                 history_size: int = 1000):
+        """
+        Args:
+            events: 購読するサーバーログのイベントバス
+            on_change: オンラインのプレイヤーが変わったときに呼ばれる関数 (snapshot() の結果を受け取る)
+            history_size: 保持するセッション履歴の件数
+        """
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._online: Dict[str, float] = {}  # プレイヤー名 -> 参加時刻
+        self._history = deque(maxlen=history_size)
+        events.subscribe(self._handle, events=(EVENT_PLAYER_JOIN, EVENT_PLAYER_LEAVE))
+
+    def _handle(self, record: LogRecord):
+        name = record.data[0]
+        now = time.time()
+        with self._lock:
+            if record.event == EVENT_PLAYER_JOIN:
+                if name in self._online:
+                    return
+                self._online[name] = now
+            else:
+                joined = self._online.pop(name, None)
+                if joined is None:
+                    return
+                self._close_session(name, joined, now, "left")
+        self._notify()
+
+    def _close_session(self, name: str, joined: float, left: float, reason: str):
+        """セッション履歴に追加する (ロック取得済みで呼ぶこと)"""
+        self._history.append({
+            'name': name,
+            'joined': joined,
+            'left': left,
+            'duration': round(left - joined, 1),
+            'reason': reason,
+        })
+
+    def reset(self, reason: str = "server_stopped"):
+        """サーバー停止時に、オンラインのプレイヤーのセッションをすべて閉じる"""
+        now = time.time()
+        with self._lock:
+            if not self._online:
+                return
+            for name, joined in self._online.items():
+                self._close_session(name, joined, now, reason)
+            self._online.clear()
+        self._notify()
+
+    def is_online(self, name: str) -> bool:
+        return name in self._online
+
+    def count(self) -> int:
+        return len(self._online)
+
+    def snapshot(self) -> Dict:
+        """オンラインのプレイヤー一覧を返す"""
+        with self._lock:
+            players = [{'name': name, 'since': joined} for name, joined in self._online.items()]
+        return {'count': len(players), 'players': players}
+
+    def history(self, limit: int = 100) -> List[Dict]:
+        """新しい順にセッション履歴を返す"""
+        with self._lock:
+            items = list(self._history)
+        return items[::-1][:limit]
+
+    def _notify(self):
+        if self._on_change:
+            try:
+                self._on_change(self.snapshot())
+            except Exception as e:
+                print(f"プレイヤー一覧の通知中にエラーが発生しました: {e}")
@@ -0,0 +1,189 @@
+"""
+子プロセスの出力を1つのスレッドでまとめて読み取る多重化リーダー
+プロセスごとに読み取りスレッドを立てる代わりに、登録されたすべてのプロセスの標準出力を
+1つのスレッドでノンブロッキングに読み取り、行に分割して購読者に渡す
+"""
+import codecs
+import os
+import selectors
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+READ_BUFFER_SIZE = 64 * 1024
+# Windows ではパイプを select できないため、この間隔でパイプに溜まったデータを確認する
+WINDOWS_POLL_INTERVAL = 0.02
+
+_HAS_READV = hasattr(os, 'readv')
+
+if os.name == 'nt':
+    import msvcrt
+    import _winapi
+
+
+class _Stream:
+    """登録されたプロセス1つ分の読み取り状態"""
+
+    def __init__(self, process, on_line: Callable[[str], None], on_exit: Optional[Callable[[], None]]):
+        self.process = process
+        self.fd = process.stdout.fileno()
+        self.on_line = on_line
+        self.on_exit = on_exit
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ''
+        self.handle = msvcrt.get_osfhandle(self.fd) if os.name == 'nt' else None
+
+    def feed(self, data):
+        """読み取ったデータを行に分割して購読者に渡す"""
+        text = self.partial + self.decoder.decode(data)
+        lines = text.split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._dispatch(line)
+
+    def finish(self):
+        """
+        EOF時に残りのデータを渡し、終了を通知する
+        on_exit はプロセスの終了を待つことがあるため、読み取りスレッドを止めないよう別のスレッドで呼ぶ
+        """
+        rest = self.partial + self.decoder.decode(b'', final=True)
+        self.partial = ''
+        if rest:
+            self._dispatch(rest)
+        try:
+            self.process.stdout.close()
+        except Exception:
+            pass
+        if self.on_exit:
+            threading.Thread(target=self._notify_exit, daemon=True).start()
+
+    def _notify_exit(self):
+        try:
+            self.on_exit()
+        except Exception as e:
+            print(f"プロセス終了時の処理中にエラーが発生しました: {e}")
+
+    def _dispatch(self, line: str):
+        try:
+            self.on_line(line.rstrip('\r'))
+        except Exception as e:
+            print(f"ログ処理中にエラーが発生しました: {e}")
+
+
+class OutputMultiplexer:
+    """複数の子プロセスの標準出力を1つのスレッドで読み取る"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[int, _Stream] = {}
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._thread: Optional[threading.Thread] = None
+        if os.name != 'nt':
+            self._selector = selectors.DefaultSelector()
+            # 登録・解除時に select を起こすためのソケット
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def register(self, process, on_line: Callable[[str], None],
+                 on_exit: Optional[Callable[[], None]] = None):
+        """
+        プロセスの標準出力の読み取りを開始する
+
+        Args:
+            process: stdout=subprocess.PIPE で起動した subprocess.Popen
+            on_line: 1行ごとに呼ばれる関数 (改行は含まない)
+            on_exit: 出力が終わった (プロセスが終了した) ときに、別のスレッドで呼ばれる関数
+                     (その時点でプロセスがまだ終了していない場合がある)
+        """
+        stream = _Stream(process, on_line, on_exit)
+        with self._lock:
+            self._streams[stream.fd] = stream
+            if os.name != 'nt':
+                os.set_blocking(stream.fd, False)
+                self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake()
+
+    def active_count(self) -> int:
+        """読み取り中のプロセス数"""
+        with self._lock:
+            return len(self._streams)
+
+    def _wake(self):
+        if os.name != 'nt':
+            try:
+                self._wake_w.send(b'\0')
+            except OSError:
+                pass
+
+    def _unregister(self, stream: _Stream):
+        with self._lock:
+            self._streams.pop(stream.fd, None)
+            if os.name != 'nt':
+                try:
+                    self._selector.unregister(stream.fd)
+                except (KeyError, ValueError):
+                    pass
+        stream.finish()
+
+    def _read(self, stream: _Stream, size: int = READ_BUFFER_SIZE) -> bool:
+        """読み取れた分を処理する。EOFの場合は False を返す"""
+        try:
+            if _HAS_READV:
+                # 毎回バッファを確保しないよう、同じバッファに読み込む
+                n = os.readv(stream.fd, [self._view[:size]])
+                data = self._view[:n]
+            else:
+                data = os.read(stream.fd, size)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if not data:
+            return False
+        stream.feed(data)
+        return True
+
+    def _run(self):
+        if os.name == 'nt':
+            self._run_windows()
+        else:
+            self._run_selector()
+
+    def _run_selector(self):
+        while True:
+            for key, _ in self._selector.select():
+                stream = key.data
+                if stream is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                if not self._read(stream):
+                    self._unregister(stream)
+
+    def _run_windows(self):
+        while True:
+            with self._lock:
+                streams = list(self._streams.values())
+            busy = False
+            for stream in streams:
+                try:
+                    avail, _ = _winapi.PeekNamedPipe(stream.handle, 0)
+                except OSError:
+                    # プロセスが終了してパイプが閉じられた
+                    self._unregister(stream)
+                    continue
+                if avail:
+                    busy = True
+                    if not self._read(stream, min(avail, READ_BUFFER_SIZE)):
+                        self._unregister(stream)
+            if not busy:
+                time.sleep(WINDOWS_POLL_INTERVAL)
@@ -0,0 +1,310 @@
+"""
+RCON (Source RCON Protocol) クライアント
+標準入力の代わりにTCPでサーバーにコマンドを送り、その応答を直接受け取る
+ヘルパーが起動していないサーバーや、標準入力のパイプが閉じたサーバーにもコマンドを送れる
+"""
+import re
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# パケットの種類
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+# 応答の終わりを知るために送る、サーバーが知らない種類のパケット
+# (Minecraftは "Unknown request" を同じIDで返すため、それまでの応答を1つのコマンドの出力とみなせる)
+_SENTINEL_TYPE = 100
+
+# Minecraftが受け付けるパケットの最大サイズ
+MAX_REQUEST_SIZE = 1460
+MAX_PACKET_SIZE = 4096 + 10
+DEFAULT_TIMEOUT = 5.0
+# 接続に失敗した後、再接続を試みるまでの待ち時間 (失敗が続くたびに2倍にする)
+RECONNECT_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+_FORMATTING_RE = re.compile('§[0-9a-fk-or]', re.IGNORECASE)
+
+
+class RconException(Exception):
+    """RCONの接続・通信に関する例外"""
+    pass
+
+
+class RconAuthException(RconException):
+    """RCONのパスワードが正しくない場合の例外"""
+    pass
+
+
+class RconReplyLostException(RconException):
+    """
+    コマンドを送信した後に応答を受け取れなかった場合の例外
+    サーバーでは実行された可能性があるため、再送してはいけない
+    """
+    pass
+
+
+def strip_formatting(text: str) -> str:
+    """応答に含まれる色・書式のコード (§a など) を取り除く"""
+    return _FORMATTING_RE.sub('', text)
+
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    """パケットをバイト列にする (長さ, ID, 種類, 本文, 終端の2バイト)"""
+    payload = struct.pack('<ii', request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+    return struct.pack('<i', len(payload)) + payload
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise RconException("RCONの接続が閉じられました。")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _peer_closed(sock: socket.socket) -> bool:
+    """相手が接続を閉じていれば True (閉じた接続にコマンドを書き込まないよう、送信前に確認する)"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except OSError:
+        return True
+
+
+def read_packet(sock: socket.socket) -> Tuple[int, int, str]:
+    """パケットを1つ読み取り、(ID, 種類, 本文) を返す"""
+    length, = struct.unpack('<i', _recv_exact(sock, 4))
+    if length < 10 or length > MAX_PACKET_SIZE:
+        raise RconException(f"RCONのパケットの長さが正しくありません: {length}")
+    payload = _recv_exact(sock, length)
+    request_id, packet_type = struct.unpack('<ii', payload[:8])
+    body = payload[8:-2].decode('utf-8', errors='replace')
+    return request_id, packet_type, body
+
+
+class RconClient:
+    """1本のRCON接続"""
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._next_id = 1
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def _request_id(self) -> int:
+        request_id = self._next_id
+        self._next_id = self._next_id % 0x7FFFFFFF + 1
+        return request_id
+
+    def connect(self):
+        """
+        接続して認証する
+
+        Raises:
+            RconAuthException: パスワードが正しくない場合
+            RconException: 接続できない場合
+        """
+        self.close()
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise RconException(f"RCONに接続できません ({self.host}:{self.port}): {e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        try:
+            request_id = self._request_id()
+            sock.sendall(encode_packet(request_id, SERVERDATA_AUTH, self.password))
+            while True:
+                response_id, packet_type, _ = read_packet(sock)
+                # 実装によっては認証の応答の前に空の RESPONSE_VALUE を返すため読み飛ばす
+                if packet_type == SERVERDATA_AUTH_RESPONSE:
+                    break
+            if response_id == -1 or response_id != request_id:
+                raise RconAuthException("RCONの認証に失敗しました。rcon.password を確認してください。")
+        except (OSError, RconException) as e:
+            self.close()
+            if isinstance(e, RconException):
+                raise
+            raise RconException(f"RCONの認証中にエラーが発生しました: {e}")
+
+    def command(self, command: str, timeout: Optional[float] = None) -> str:
+        """
+        コマンドを実行して応答を返す (長い応答は複数のパケットに分かれて届くため、連結して返す)
+        timeout を指定した場合は、応答をその秒数まで待つ (save-all など時間のかかるコマンド用)
+
+        Raises:
+            RconReplyLostException: コマンドを送信した後に、応答を受け取れなかった場合
+            RconException: 接続していない場合や、コマンドを送信できなかった場合
+        """
+        if self._sock is None:
+            raise RconException("RCONに接続していません。")
+        if _peer_closed(self._sock):
+            self.close()
+            raise RconException("RCONの接続が閉じられています。")
+        request = encode_packet(self._request_id(), SERVERDATA_EXECCOMMAND, command)
+        if len(request) > MAX_REQUEST_SIZE:
+            raise RconException("コマンドが長すぎるため、RCONで送信できません。")
+        request_id = struct.unpack('<i', request[4:8])[0]
+        sentinel_id = self._request_id()
+        try:
+            self._sock.sendall(request + encode_packet(sentinel_id, _SENTINEL_TYPE, ""))
+        except OSError as e:
+            self.close()
+            raise RconException(f"RCONでコマンドを送信できませんでした: {e}")
+        try:
+            if timeout is not None:
+                self._sock.settimeout(timeout)
+            parts = []
+            while True:
+                response_id, _, body = read_packet(self._sock)
+                if response_id == sentinel_id:
+                    break
+                if response_id == request_id:
+                    parts.append(body)
+            return ''.join(parts)
+        except (OSError, RconException) as e:
+            self.close()
+            raise RconReplyLostException(f"RCONでコマンドを送信しましたが、応答を受け取れませんでした: {e}")
+        finally:
+            if timeout is not None and self._sock is not None:
+                self._sock.settimeout(self.timeout)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+
+class RconConnection:
+    """
+    再接続するRCON接続
+    最初のコマンドの送信時に接続し、切断された場合は次の送信時に1回だけ再接続を試みる
+    (コマンドを送信した後に失敗した場合は、二重に実行しないよう再送しない)
+    接続できない間は待ち時間を延ばしながら再接続を控え、その間は available() が False を返す
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = DEFAULT_TIMEOUT,
+                 on_response: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            host / port / password: 接続先 (server.properties の rcon.port / rcon.password)
+            timeout: 接続・応答の待ち時間 (秒)
+            on_response: echo() で応答を表示するときに呼ばれる関数 (コマンド, 応答)
+        """
+        self._client = RconClient(host, port, password, timeout)
+        self._on_response = on_response
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._delay = RECONNECT_DELAY
+        self.last_error: Optional[str] = None
+        self.commands = 0
+        self.reconnects = 0
+
+    @property
+    def address(self) -> str:
+        return f"{self._client.host}:{self._client.port}"
+
+    def matches(self, host: str, port: int, password: str) -> bool:
+        client = self._client
+        return (client.host, client.port, client.password) == (host, port, password)
+
+    def available(self) -> bool:
+        """再接続を控えている間は False"""
+        return self._client.connected or time.monotonic() >= self._retry_at
+
+    def command(self, command: str, timeout: Optional[float] = None) -> str:
+        """
+        コマンドを実行して応答を返す
+        timeout を指定した場合は、応答をその秒数まで待つ (指定しない場合は接続の待ち時間)
+
+        Raises:
+            RconReplyLostException: コマンドを送信した後に、応答を受け取れなかった場合 (再送しない)
+            RconException: 接続・送信できなかった場合
+        """
+        with self._lock:
+            if not self._client.connected and time.monotonic() < self._retry_at:
+                raise RconException(f"RCONに接続できません: {self.last_error}")
+            had_connection = self._client.connected
+            try:
+                return self._execute(command, timeout)
+            except RconAuthException as e:
+                self._backoff(str(e), RECONNECT_MAX_DELAY)
+                raise
+            except RconReplyLostException as e:
+                self.last_error = str(e)
+                raise
+            except RconException as e:
+                if not had_connection:
+                    self._backoff(str(e), self._delay)
+                    raise
+            # 既存の接続が切れていた場合 (サーバーの再起動など) は、すぐに1回だけ再接続する
+            self.reconnects += 1
+            try:
+                return self._execute(command, timeout)
+            except RconAuthException as e:
+                self._backoff(str(e), RECONNECT_MAX_DELAY)
+                raise
+            except RconReplyLostException as e:
+                self.last_error = str(e)
+                raise
+            except RconException as e:
+                self._backoff(str(e), self._delay)
+                raise
+
+    def _execute(self, command: str, timeout: Optional[float]) -> str:
+        if not self._client.connected:
+            self._client.connect()
+        response = self._client.command(command, timeout)
+        self.commands += 1
+        self._delay = RECONNECT_DELAY
+        self.last_error = None
+        return response
+
+    def _backoff(self, error: str, delay: float):
+        self._client.close()
+        self.last_error = error
+        self._retry_at = time.monotonic() + delay
+        self._delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def echo(self, command: str, response: str):
+        """コマンドの応答を表示する (on_response に渡す)"""
+        if self._on_response:
+            self._on_response(command, response)
+
+    def reset_backoff(self):
+        """サーバーの起動完了時などに、すぐに再接続できるようにする"""
+        with self._lock:
+            self._retry_at = 0.0
+            self._delay = RECONNECT_DELAY
+            self.last_error = None
+
+    def close(self):
+        with self._lock:
+            self._client.close()
+
+    def stats(self) -> Dict:
+        return {
+            'address': self.address,
+            'connected': self._client.connected,
+            'available': self.available(),
+            'commands': self.commands,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+        }
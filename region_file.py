@@ -0,0 +1,115 @@
+"""
+Anvil のリージョンファイル (.mca) の読み書き
+先頭 8KiB のヘッダーに、1024 個のチャンクの位置 (4KiB セクタ単位のオフセットとセクタ数) と最終更新時刻がある
+各チャンクのデータは [長さ (4バイト), 圧縮形式 (1バイト), 圧縮されたデータ] の形で保存されている
+"""
+import struct
+from typing import BinaryIO, Dict, Iterable, Iterator, Tuple
+
+SECTOR_SIZE = 4096
+CHUNK_COUNT = 1024
+HEADER_SIZE = SECTOR_SIZE * 2
+REGION_SUFFIX = ".mca"
+
+
+class RegionFileException(Exception):
+    """リージョンファイルの形式が正しくない場合の例外"""
+    pass
+
+
+def is_region_file(path: str) -> bool:
+    return path.endswith(REGION_SUFFIX)
+
+
+def read_header(f: BinaryIO, file_size: int) -> Dict[int, Tuple[int, int, int]]:
+    """
+    ヘッダーを読み込む
+
+    Returns:
+        チャンクの番号 (0-1023) -> (オフセット (バイト), 長さ (バイト, セクタ単位), 最終更新時刻)
+        (生成されていないチャンクは含まない)
+
+    Raises:
+        RegionFileException: ヘッダーが正しくない場合
+    """
+    if file_size < HEADER_SIZE:
+        raise RegionFileException("ヘッダーより小さいファイルです。")
+    f.seek(0)
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise RegionFileException("ヘッダーを読み込めません。")
+    locations = struct.unpack(f'>{CHUNK_COUNT}I', header[:SECTOR_SIZE])
+    timestamps = struct.unpack(f'>{CHUNK_COUNT}I', header[SECTOR_SIZE:])
+    chunks = {}
+    for index, location in enumerate(locations):
+        if not location:
+            continue
+        offset = (location >> 8) * SECTOR_SIZE
+        length = (location & 0xFF) * SECTOR_SIZE
+        if offset < HEADER_SIZE or length == 0 or offset + length > file_size:
+            raise RegionFileException(f"チャンク {index} の位置が正しくありません。")
+        chunks[index] = (offset, length, timestamps[index])
+    return chunks
+
+
+def read_chunk(f: BinaryIO, offset: int, length: int) -> bytes:
+    """
+    チャンクのデータ (長さ・圧縮形式を含む、セクタの余りを除いた部分) を読み込む
+
+    Raises:
+        RegionFileException: データの長さが正しくない場合
+    """
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) < 5:
+        raise RegionFileException("チャンクのデータが短すぎます。")
+    size, = struct.unpack('>I', data[:4])
+    if size == 0 or size + 4 > len(data):
+        raise RegionFileException("チャンクのデータの長さが正しくありません。")
+    return data[:size + 4]
+
+
+def read_chunk_length(f: BinaryIO, offset: int) -> int:
+    """
+    チャンクのデータの長さ (read_chunk() が返すバイト数) を、先頭の長さだけを読み込んで返す
+
+    Raises:
+        RegionFileException: 長さを読み込めない場合
+    """
+    f.seek(offset)
+    prefix = f.read(4)
+    if len(prefix) < 4:
+        raise RegionFileException("チャンクのデータが短すぎます。")
+    size, = struct.unpack('>I', prefix)
+    return size + 4
+
+
+def build(chunks: Iterable[Tuple[int, int, bytes]]) -> Iterator[bytes]:
+    """
+    チャンクからリージョンファイルを組み立てる (空きセクタを詰めて並べ直すため、元のファイルとは配置が異なる)
+
+    Args:
+        chunks: (チャンクの番号, 最終更新時刻, read_chunk() で読み込んだデータ) をチャンクの番号順に返すもの
+
+    Returns:
+        ファイルの内容を先頭から順に返すイテレータ (ヘッダーは最初にまとめて返す)
+    """
+    chunks = list(chunks)
+    locations = [0] * CHUNK_COUNT
+    timestamps = [0] * CHUNK_COUNT
+    sector = HEADER_SIZE // SECTOR_SIZE
+    for index, timestamp, data in chunks:
+        sectors = -(-len(data) // SECTOR_SIZE)
+        if sectors > 0xFF:
+            raise RegionFileException(f"チャンク {index} が大きすぎます。")
+        locations[index] = sector << 8 | sectors
+        timestamps[index] = timestamp
+        sector += sectors
+    yield struct.pack(f'>{CHUNK_COUNT}I', *locations) + struct.pack(f'>{CHUNK_COUNT}I', *timestamps)
+    for _, _, data in chunks:
+        yield data + b'\x00' * (-len(data) % SECTOR_SIZE)
+
+
+def built_size(lengths: Iterable[int]) -> int:
+    """build() で組み立てたファイルのサイズ"""
+    return HEADER_SIZE + sum(-(-length // SECTOR_SIZE) * SECTOR_SIZE for length in lengths)
@@ -0,0 +1,494 @@
+"""
+サーバープロセスのリソース制御
+インスタンスごとにCPUアフィニティ・優先度 (nice/ionice)・cgroup v2 のメモリとCPUの上限を設定し、
+実際に適用された値と使用量を返す (ionice・cgroup は Linux のみ。Windows では優先度クラスとアフィニティを設定する)
+"""
+import ctypes
+import os
+import platform
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from jvm_profiles import JvmProfileException, parse_size
+
+IS_LINUX = platform.system() == 'Linux'
+IS_WINDOWS = platform.system() == 'Windows'
+
+CGROUP_MOUNT = "/sys/fs/cgroup"
+# インスタンスごとの cgroup を作る親 (委譲された、または root で書き込める cgroup v2 のパス)
+DEFAULT_CGROUP_ROOT = os.path.join(CGROUP_MOUNT, "mcserverhelper")
+CPU_PERIOD_US = 100000
+
+# ioprio_set/ioprio_get のシステムコール番号 (アーキテクチャごとに異なる)
+_IOPRIO_SYSCALLS = {
+    'x86_64': (251, 252), 'amd64': (251, 252),
+    'aarch64': (30, 31), 'arm64': (30, 31),
+    'i386': (289, 290), 'i686': (289, 290),
+    'armv7l': (314, 315),
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+# Windows では nice の値を優先度クラスに対応付ける
+_WINDOWS_PRIORITY = [
+    (-10, 0x00000080),  # HIGH_PRIORITY_CLASS
+    (-1, 0x00008000),   # ABOVE_NORMAL_PRIORITY_CLASS
+    (0, 0x00000020),    # NORMAL_PRIORITY_CLASS
+    (9, 0x00004000),    # BELOW_NORMAL_PRIORITY_CLASS
+    (19, 0x00000040),   # IDLE_PRIORITY_CLASS
+]
+PROCESS_SET_INFORMATION = 0x0200
+PROCESS_QUERY_INFORMATION = 0x0400
+
+_libc = None
+if IS_LINUX:
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        _libc = None
+
+_kernel32 = None
+if IS_WINDOWS:
+    try:
+        _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        # 64ビットのハンドル・マスクが切り詰められないよう、引数の型を指定する
+        _kernel32.OpenProcess.restype = ctypes.c_void_p
+        _kernel32.OpenProcess.argtypes = (ctypes.c_uint32, ctypes.c_int, ctypes.c_uint32)
+        _kernel32.SetPriorityClass.argtypes = (ctypes.c_void_p, ctypes.c_uint32)
+        _kernel32.SetProcessAffinityMask.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        _kernel32.CloseHandle.argtypes = (ctypes.c_void_p,)
+    except (OSError, AttributeError):
+        _kernel32 = None
+
+
+class ResourceLimitException(Exception):
+    """リソース制御の設定が正しくない場合や、適用できない場合の例外"""
+    pass
+
+
+def parse_cpu_list(value) -> List[int]:
+    """[0, 1] や "0-3,6" のようなCPUの指定をCPU番号のリストに変換する"""
+    if isinstance(value, list):
+        cpus = value
+    else:
+        cpus = []
+        for part in str(value).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                if '-' in part:
+                    first, last = (int(x) for x in part.split('-', 1))
+                    cpus.extend(range(first, last + 1))
+                else:
+                    cpus.append(int(part))
+            except ValueError:
+                raise ResourceLimitException(f"CPUの指定が正しくありません: {value}")
+    if not cpus or not all(isinstance(cpu, int) and not isinstance(cpu, bool) and cpu >= 0 for cpu in cpus):
+        raise ResourceLimitException(f"CPUの指定が正しくありません: {value}")
+    return sorted(set(cpus))
+
+
+def _is_int(value) -> bool:
+    # True / False は int のサブクラスのため除く
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate(resources: Dict) -> Dict:
+    """
+    リソース制御の設定を検証し、正規化した設定を返す
+
+    設定のキー:
+        cpu_affinity: 使用するCPU ([0, 1] または "0-3")
+        nice: 優先度 (-20〜19、大きいほど低い)
+        ionice_class / ionice_level: ディスクI/Oの優先度 ("best-effort" / 0〜7 など)
+        cgroup_memory_max: メモリの上限 ("6G" など)
+        cgroup_cpu_max: 使用できるCPUのコア数 (1.5 なら 1.5 コア分)
+        cgroup_root: インスタンスごとの cgroup を作る親のパス
+
+    Raises:
+        ResourceLimitException: 設定が正しくない場合
+    """
+    result = {}
+    if resources.get('cpu_affinity') not in (None, "", []):
+        cpus = parse_cpu_list(resources['cpu_affinity'])
+        if hasattr(os, 'sched_getaffinity'):
+            # ヘルパー自身が使えるCPUだけを指定できる (存在しないCPUを指定すると起動できない)
+            allowed = os.sched_getaffinity(0)
+            unknown = [cpu for cpu in cpus if cpu not in allowed]
+            if unknown:
+                raise ResourceLimitException(
+                    f"使用できないCPUが指定されています: {unknown} (使用可能: {sorted(allowed)})")
+        result['cpu_affinity'] = cpus
+    if resources.get('nice') is not None:
+        nice = resources['nice']
+        if not _is_int(nice) or not -20 <= nice <= 19:
+            raise ResourceLimitException("nice は -20〜19 の整数で指定してください。")
+        result['nice'] = nice
+    if resources.get('ionice_class'):
+        if resources['ionice_class'] not in IONICE_CLASSES:
+            raise ResourceLimitException(f"不明な ionice のクラスです: {resources['ionice_class']}")
+        level = resources.get('ionice_level', 4)
+        if not _is_int(level) or not 0 <= level <= 7:
+            raise ResourceLimitException("ionice_level は 0〜7 の整数で指定してください。")
+        result['ionice_class'] = resources['ionice_class']
+        result['ionice_level'] = level
+    if resources.get('cgroup_memory_max'):
+        try:
+            parse_size(resources['cgroup_memory_max'])
+        except JvmProfileException as e:
+            raise ResourceLimitException(str(e))
+        result['cgroup_memory_max'] = resources['cgroup_memory_max']
+    if resources.get('cgroup_cpu_max'):
+        cores = resources['cgroup_cpu_max']
+        if not isinstance(cores, (int, float)) or isinstance(cores, bool) or cores <= 0:
+            raise ResourceLimitException("cgroup_cpu_max はコア数 (正の数) で指定してください。")
+        result['cgroup_cpu_max'] = cores
+    if resources.get('cgroup_root'):
+        result['cgroup_root'] = resources['cgroup_root']
+    return result
+
+
+def memory_limit(resources: Optional[Dict]) -> Optional[int]:
+    """cgroup のメモリの上限 (バイト) を返す。設定がない場合は None"""
+    if resources and resources.get('cgroup_memory_max'):
+        return parse_size(resources['cgroup_memory_max'])
+    return None
+
+
+# --- 優先度・アフィニティ ---
+def _ioprio_value(resources: Dict) -> Optional[int]:
+    if not resources.get('ionice_class'):
+        return None
+    return (IONICE_CLASSES[resources['ionice_class']] << IOPRIO_CLASS_SHIFT) | resources.get('ionice_level', 4)
+
+
+def _ioprio_syscall(get: bool, tid: int, value: int = 0) -> int:
+    numbers = _IOPRIO_SYSCALLS.get(platform.machine().lower())
+    if _libc is None or numbers is None:
+        raise OSError("ioprio is not supported on this platform")
+    if get:
+        result = _libc.syscall(numbers[1], IOPRIO_WHO_PROCESS, tid)
+    else:
+        result = _libc.syscall(numbers[0], IOPRIO_WHO_PROCESS, tid, value)
+    if result < 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    return result
+
+
+def _apply_to_task(tid: int, resources: Dict):
+    """1つのスレッドに優先度とアフィニティを設定する"""
+    if resources.get('cpu_affinity') and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(tid, resources['cpu_affinity'])
+    if resources.get('nice') is not None and hasattr(os, 'setpriority'):
+        os.setpriority(os.PRIO_PROCESS, tid, resources['nice'])
+    ioprio = _ioprio_value(resources)
+    if ioprio is not None and IS_LINUX:
+        _ioprio_syscall(False, tid, ioprio)
+
+
+def _windows_priority_class(nice: int) -> int:
+    return next(flag for limit, flag in _WINDOWS_PRIORITY if nice <= limit)
+
+
+def popen_options(resources: Optional[Dict]) -> Dict:
+    """subprocess.Popen に渡す追加の引数を返す (Windows の優先度クラス)"""
+    if not resources or not IS_WINDOWS:
+        return {}
+    nice = resources.get('nice')
+    if nice is None:
+        return {}
+    return {'creationflags': _windows_priority_class(nice)}
+
+
+def command_prefix(resources: Optional[Dict]) -> Tuple[List[str], Dict]:
+    """
+    起動コマンドの前に付ける taskset / nice / ionice を返す (Linux のみ)
+    JVMは起動直後に多数のスレッドを作るため、exec の前に設定してすべてのスレッドに引き継がせる
+    (preexec_fn はスレッドを使うプログラムでは安全ではないため使わない)
+    nice / ionice は設定できなくても警告を出してそのまま起動する
+
+    Returns:
+        (コマンドの前に付ける引数, コマンドが見つからず起動後に apply_live で設定する項目)
+        (Windows では優先度クラスを popen_options で指定し、アフィニティは起動後に設定する)
+    """
+    if not resources:
+        return [], {}
+    if IS_WINDOWS:
+        return [], ({'cpu_affinity': resources['cpu_affinity']} if resources.get('cpu_affinity') else {})
+    prefix: List[str] = []
+    remaining: Dict = {}
+    if resources.get('cpu_affinity'):
+        if shutil.which('taskset'):
+            prefix += ['taskset', '-c', ','.join(str(cpu) for cpu in resources['cpu_affinity'])]
+        else:
+            remaining['cpu_affinity'] = resources['cpu_affinity']
+    if resources.get('nice') is not None:
+        if shutil.which('nice'):
+            prefix += ['nice', '-n', str(resources['nice'])]
+        else:
+            remaining['nice'] = resources['nice']
+    if resources.get('ionice_class'):
+        if IS_LINUX and shutil.which('ionice'):
+            # -t: 設定できなくてもコマンドを実行する
+            prefix += ['ionice', '-t', '-c', str(IONICE_CLASSES[resources['ionice_class']])]
+            if resources['ionice_class'] != "idle":
+                prefix += ['-n', str(resources.get('ionice_level', 4))]
+        else:
+            remaining['ionice_class'] = resources['ionice_class']
+            remaining['ionice_level'] = resources.get('ionice_level', 4)
+    return prefix, remaining
+
+
+def _apply_windows(pid: int, resources: Dict) -> List[str]:
+    """起動中のプロセスに優先度クラスとアフィニティを設定する (Windows)"""
+    if _kernel32 is None:
+        return ["優先度・アフィニティは次の起動から適用されます (kernel32 を読み込めませんでした)。"]
+    errors = []
+    handle = _kernel32.OpenProcess(PROCESS_SET_INFORMATION | PROCESS_QUERY_INFORMATION, False, pid)
+    if not handle:
+        return [f"プロセスを開けませんでした: {ctypes.WinError(ctypes.get_last_error())}"]
+    try:
+        if resources.get('nice') is not None:
+            if not _kernel32.SetPriorityClass(handle, _windows_priority_class(resources['nice'])):
+                errors.append(f"優先度クラスを設定できませんでした: {ctypes.WinError(ctypes.get_last_error())}")
+        cpus = resources.get('cpu_affinity')
+        if cpus:
+            # 1つのプロセッサグループ (最大64個) の中のCPUだけを指定できる
+            if max(cpus) >= ctypes.sizeof(ctypes.c_size_t) * 8:
+                errors.append(f"CPU {max(cpus)} はアフィニティのマスクで指定できません。")
+            elif not _kernel32.SetProcessAffinityMask(handle, sum(1 << cpu for cpu in cpus)):
+                errors.append(f"アフィニティを設定できませんでした: {ctypes.WinError(ctypes.get_last_error())}")
+    finally:
+        _kernel32.CloseHandle(handle)
+    if resources.get('ionice_class'):
+        errors.append("ionice は Windows では使用できません。")
+    return errors
+
+
+def apply_live(pid: int, resources: Dict) -> List[str]:
+    """
+    起動中のプロセスのすべてのスレッドに優先度とアフィニティを設定する
+    (Linux はスレッドごとに設定し、Windows はプロセスの優先度クラスとアフィニティを設定する)
+
+    Returns:
+        適用できなかった内容のメッセージのリスト
+    """
+    if IS_WINDOWS:
+        return _apply_windows(pid, resources)
+    if not IS_LINUX:
+        return ["このOSでは起動中のプロセスに設定できないため、優先度・アフィニティは次の起動から適用されます。"]
+    errors = []
+    task_dir = f"/proc/{pid}/task"
+    try:
+        tids = [int(tid) for tid in os.listdir(task_dir)]
+    except OSError as e:
+        return [f"スレッドの一覧を取得できませんでした: {e}"]
+    for tid in tids:
+        try:
+            _apply_to_task(tid, resources)
+        except OSError as e:
+            errors.append(f"スレッド {tid}: {e}")
+    return errors
+
+
+# --- cgroup v2 ---
+def cgroup_requested(resources: Optional[Dict]) -> bool:
+    return bool(resources) and bool(resources.get('cgroup_memory_max') or resources.get('cgroup_cpu_max'))
+
+
+def cgroup_path(resources: Dict, instance_id: str) -> str:
+    return os.path.join(resources.get('cgroup_root', DEFAULT_CGROUP_ROOT), f"instance-{instance_id}")
+
+
+def _write(path: str, value: str):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def setup_cgroup(resources: Dict, instance_id: str) -> str:
+    """
+    インスタンスの cgroup を作成し、メモリとCPUの上限を書き込む
+
+    Returns:
+        cgroup のパス
+
+    Raises:
+        ResourceLimitException: cgroup v2 が使えない場合や、書き込む権限がない場合
+    """
+    if not IS_LINUX or not os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")):
+        raise ResourceLimitException("cgroup v2 が利用できません。")
+    root = resources.get('cgroup_root', DEFAULT_CGROUP_ROOT)
+    path = cgroup_path(resources, instance_id)
+    try:
+        os.makedirs(path, exist_ok=True)
+        # 親で memory と cpu のコントローラーを子に委譲する (既に有効なら何もしない)
+        enabled = (_read(os.path.join(root, "cgroup.subtree_control")) or "").split()
+        wanted = [c for c in ("memory", "cpu") if c not in enabled]
+        if wanted:
+            _write(os.path.join(root, "cgroup.subtree_control"), " ".join(f"+{c}" for c in wanted))
+        memory = memory_limit(resources)
+        _write(os.path.join(path, "memory.max"), str(memory) if memory else "max")
+        cores = resources.get('cgroup_cpu_max')
+        quota = str(int(cores * CPU_PERIOD_US)) if cores else "max"
+        _write(os.path.join(path, "cpu.max"), f"{quota} {CPU_PERIOD_US}")
+    except OSError as e:
+        raise ResourceLimitException(f"cgroup を設定できませんでした ({path}): {e}")
+    return path
+
+
+def attach_cgroup(path: str, pid: int):
+    """プロセス (すべてのスレッド) を cgroup に移す"""
+    try:
+        _write(os.path.join(path, "cgroup.procs"), str(pid))
+    except OSError as e:
+        raise ResourceLimitException(f"プロセスを cgroup に移せませんでした ({path}): {e}")
+
+
+def apply_on_start(proc, resources: Optional[Dict], instance_id: str) -> Optional[str]:
+    """
+    起動直後のプロセスに cgroup の上限を適用する (mc.start_server から呼ばれる)
+    適用できなかった場合は警告を出してそのまま続ける
+
+    Returns:
+        プロセスを移した cgroup のパス
+    """
+    if not cgroup_requested(resources):
+        return None
+    try:
+        path = setup_cgroup(resources, instance_id)
+        attach_cgroup(path, proc.pid)
+        print(f"cgroup の上限を適用しました: {path}")
+        return path
+    except ResourceLimitException as e:
+        print(f"警告: {e}")
+        return None
+
+
+# --- 適用された値と使用量 ---
+def _proc_cgroup(pid: int) -> Optional[str]:
+    """プロセスが属している cgroup v2 のパス"""
+    if not os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")):
+        return None
+    text = _read(f"/proc/{pid}/cgroup")
+    for line in (text or "").splitlines():
+        if line.startswith("0::"):
+            return os.path.join(CGROUP_MOUNT, line[3:].lstrip('/'))
+    return None
+
+
+def _read_keyed(path: str) -> Dict[str, int]:
+    values = {}
+    for line in (_read(path) or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def effective(pid: int) -> Dict:
+    """プロセスに実際に適用されている優先度・アフィニティ・cgroup の上限を返す"""
+    result: Dict = {'pid': pid}
+    if hasattr(os, 'sched_getaffinity'):
+        try:
+            result['cpu_affinity'] = sorted(os.sched_getaffinity(pid))
+        except OSError:
+            pass
+    if hasattr(os, 'getpriority'):
+        try:
+            result['nice'] = os.getpriority(os.PRIO_PROCESS, pid)
+        except OSError:
+            pass
+    if IS_LINUX:
+        try:
+            ioprio = _ioprio_syscall(True, pid)
+            classes = {value: name for name, value in IONICE_CLASSES.items()}
+            result['ionice_class'] = classes.get(ioprio >> IOPRIO_CLASS_SHIFT, "none")
+            result['ionice_level'] = ioprio & ((1 << IOPRIO_CLASS_SHIFT) - 1)
+        except OSError:
+            pass
+        cgroup = _proc_cgroup(pid)
+        if cgroup:
+            cpu_max = (_read(os.path.join(cgroup, "cpu.max")) or "").split()
+            result['cgroup'] = {
+                'path': cgroup,
+                'memory_max': _read(os.path.join(cgroup, "memory.max")),
+                'cpu_max': (int(cpu_max[0]) / int(cpu_max[1])
+                            if len(cpu_max) == 2 and cpu_max[0] != "max" else None),
+            }
+    return result
+
+
+class UsageSampler:
+    """プロセスのCPU・メモリ使用量を取得する (CPU使用率は前回の取得からの差分で計算する)"""
+
+    def __init__(self):
+        self._last: Optional[tuple] = None   # (pid, 時刻, CPU時間)
+
+    def sample(self, pid: int) -> Dict:
+        result: Dict = {}
+        now = time.monotonic()
+        cpu_seconds = None
+        stat = _read(f"/proc/{pid}/stat")
+        if stat:
+            # comm にスペースが含まれる場合があるため、')' の後から数える
+            fields = stat.rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+            result['cpu_seconds'] = round(cpu_seconds, 2)
+        status = _read(f"/proc/{pid}/status")
+        for line in (status or "").splitlines():
+            if line.startswith("VmRSS:"):
+                result['rss_bytes'] = int(line.split()[1]) * 1024
+            elif line.startswith("Threads:"):
+                result['threads'] = int(line.split()[1])
+        if cpu_seconds is not None:
+            if self._last and self._last[0] == pid and now > self._last[1]:
+                result['cpu_percent'] = round((cpu_seconds - self._last[2]) / (now - self._last[1]) * 100, 1)
+            self._last = (pid, now, cpu_seconds)
+
+        cgroup = _proc_cgroup(pid) if IS_LINUX else None
+        if cgroup:
+            current = _read(os.path.join(cgroup, "memory.current"))
+            peak = _read(os.path.join(cgroup, "memory.peak"))
+            cpu_stat = _read_keyed(os.path.join(cgroup, "cpu.stat"))
+            events = _read_keyed(os.path.join(cgroup, "memory.events"))
+            result['cgroup'] = {
+                'memory_current': int(current) if current and current.isdigit() else None,
+                'memory_peak': int(peak) if peak and peak.isdigit() else None,
+                'cpu_usage_usec': cpu_stat.get('usage_usec'),
+                'nr_throttled': cpu_stat.get('nr_throttled'),
+                'throttled_usec': cpu_stat.get('throttled_usec'),
+                'oom_kill': events.get('oom_kill'),
+            }
+        return result
+
+
+def remove_cgroup(resources: Optional[Dict], instance_id: str):
+    """停止後にインスタンスの cgroup を削除する (プロセスが残っている場合は削除されない)"""
+    if not cgroup_requested(resources) or not IS_LINUX:
+        return
+    try:
+        os.rmdir(cgroup_path(resources, instance_id))
+    except OSError:
+        pass
+
+
+def supported() -> Dict:
+    """このホストで使えるリソース制御"""
+    return {
+        'cpu_affinity': hasattr(os, 'sched_setaffinity') or IS_WINDOWS,
+        'nice': hasattr(os, 'setpriority') or IS_WINDOWS,
+        'ionice': IS_LINUX and platform.machine().lower() in _IOPRIO_SYSCALLS and _libc is not None,
+        'cgroup_v2': IS_LINUX and os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")),
+    }
@@ -0,0 +1,359 @@
+"""
+定期的なサーバーの再起動
+インスタンスごとに決めた時刻に、プレイヤーへの予告 (say)・save-all・バックアップをしてから再起動する
+オンラインのプレイヤーが多い場合は再起動を遅らせるか、その回を見送る
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import mcserverhelper as mc
+from operations import OperationException
+
+# インスタンスのデータフォルダに保存する定期再起動の履歴
+RESTART_HISTORY_FILE = "restart_history.json"
+RESTART_HISTORY_SIZE = 200
+# スケジュールを確認する間隔 (秒)
+CHECK_INTERVAL = 15
+# 別の操作 (バックアップ・復元・休止など) の実行中で開始できない場合に、予定の時刻から開始を試み続ける時間 (分)
+BUSY_RETRY_MINUTES = 30
+
+# 既定値は mcserverhelper.DEFAULT_CONFIG の restart_schedule (1か所で管理する)
+DEFAULT_SCHEDULE = mc.DEFAULT_CONFIG['restart_schedule']
+_TIME_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
+class RestartCancelled(Exception):
+    """予告中に定期再起動が取り消された"""
+    pass
+
+
+def get_schedule(cfg: Dict) -> Dict:
+    """インスタンスの設定から定期再起動の設定を返す (足りない項目は既定値で補う)"""
+    return {**DEFAULT_SCHEDULE, **(cfg.get('restart_schedule') or {})}
+
+
+def _is_int(value) -> bool:
+    # True / False は int のサブクラスのため除く
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_schedule(schedule: Dict) -> Dict:
+    """
+    定期再起動の設定を検証する (保存した後に check() で失敗しないよう、すべての項目を確認する)
+
+    Raises:
+        ValueError: 不明な項目がある場合や、値が正しくない場合
+    """
+    unknown = set(schedule) - set(DEFAULT_SCHEDULE)
+    if unknown:
+        raise ValueError(f"Unknown keys: {', '.join(sorted(unknown))}")
+    for key in ("enabled", "backup"):
+        if not isinstance(schedule[key], bool):
+            raise ValueError(f"{key} must be true or false.")
+    times = schedule['times']
+    if not isinstance(times, list) or not all(isinstance(t, str) for t in times):
+        raise ValueError("times must be a list of 'HH:MM'.")
+    for value in times:
+        match = _TIME_RE.match(value)
+        if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+            raise ValueError(f"times must be a list of 'HH:MM' (00:00-23:59): {value}")
+    warnings = schedule['warnings']
+    if not isinstance(warnings, list) or not all(_is_int(w) and 0 <= w <= 86400 for w in warnings):
+        raise ValueError("warnings must be a list of seconds (0-86400).")
+    if schedule['max_players'] is not None and not (_is_int(schedule['max_players']) and schedule['max_players'] >= 0):
+        raise ValueError("max_players must be null or a non-negative integer.")
+    if schedule['when_busy'] not in ("delay", "skip"):
+        raise ValueError("when_busy must be 'delay' or 'skip'.")
+    delay = schedule['delay_minutes']
+    if not isinstance(delay, (int, float)) or isinstance(delay, bool) or not 0 < delay <= 1440:
+        raise ValueError("delay_minutes must be a number of minutes (greater than 0, up to 1440).")
+    if not _is_int(schedule['max_delays']) or schedule['max_delays'] < 0:
+        raise ValueError("max_delays must be a non-negative integer.")
+    return schedule
+
+
+def next_window(times: List[str], now: datetime) -> Optional[datetime]:
+    """'HH:MM' 形式の時刻のうち、now より後で最も近い日時を返す"""
+    candidates = []
+    for value in times:
+        try:
+            hour, minute = (int(part) for part in value.split(':'))
+            at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        except ValueError:
+            print(f"定期再起動の時刻の形式が正しくありません: {value}")
+            continue
+        candidates.append(at if at > now else at + timedelta(days=1))
+    return min(candidates) if candidates else None
+
+
+def format_remaining(seconds: int) -> str:
+    if seconds >= 60 and seconds % 60 == 0:
+        return f"{seconds // 60}分"
+    return f"{seconds}秒"
+
+
+def load_restart_history(path: str) -> List[Dict]:
+    """定期再起動の履歴を読み込む (古い順)"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return []
+
+
+def record_restart(path: str, entry: Dict):
+    history = load_restart_history(path)
+    history.append(entry)
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(history[-RESTART_HISTORY_SIZE:], f, ensure_ascii=False, indent=2)
+    except IOError as e:
+        print(f"定期再起動の履歴を保存できませんでした: {e}")
+
+
+def graceful_restart(inst, op, schedule: Dict, restart_at: float, cancelled: threading.Event,
+                     restart: Callable[[object, object], None]) -> Dict:
+    """
+    予告・save-all・バックアップをしてからサーバーを再起動する (OperationManager のスレッドで実行する)
+
+    Args:
+        inst: 対象の ServerInstance
+        op: 進行状況を通知する Operation
+        schedule: 定期再起動の設定
+        restart_at: 再起動する時刻 (time.time())
+        cancelled: セットされたら予告中に取り消す
+        restart: 再起動を行う関数 (inst, op を受け取る)
+
+    Returns:
+        履歴に記録した内容
+
+    Raises:
+        RestartCancelled: 予告中に取り消された場合やサーバーが停止した場合
+    """
+    began = time.time()
+    entry = {
+        'scheduled': restart_at,
+        'started': began,
+        'players': inst.player_tracker.count(),
+        'backup': None,
+    }
+    history_path = inst.path(RESTART_HISTORY_FILE)
+
+    op.set_phase("warning")
+    for warning in sorted(schedule['warnings'], reverse=True):
+        wait = restart_at - warning - time.time()
+        if wait < -1:
+            continue
+        if cancelled.wait(max(wait, 0)) or not inst.is_running():
+            inst.send_command("say サーバーの再起動は中止されました。", quiet=True)
+            raise RestartCancelled("定期再起動は取り消されました。")
+        inst.send_command(f"say {format_remaining(warning)}後にサーバーを再起動します。", quiet=True)
+    if cancelled.wait(max(restart_at - time.time(), 0)) or not inst.is_running():
+        raise RestartCancelled("定期再起動は取り消されました。")
+
+    op.set_phase("saving")
+    inst.send_command("say サーバーを再起動します。", quiet=True)
+    inst.send_command_and_wait("save-all", timeout=30, until=lambda record: "Saved the game" in record.message,
+                               quiet=True)
+    if schedule['backup']:
+        op.set_phase("backup")
+        result = inst.backup_world(quiet=True)
+        entry['backup'] = os.path.basename(result) if result else None
+
+    down = time.time()
+    try:
+        restart(inst, op)
+        entry['result'] = "success"
+    except Exception as e:
+        entry['result'] = "failed"
+        entry['error'] = str(e)
+        raise
+    finally:
+        finished = time.time()
+        entry['finished'] = finished
+        # 予告を含む全体の時間と、停止から起動までの時間
+        entry['duration'] = round(finished - began, 3)
+        entry['downtime'] = round(finished - down, 3)
+        record_restart(history_path, entry)
+    return entry
+
+
+class RestartScheduler:
+    """各インスタンスの定期再起動の時刻を監視し、時刻になったら再起動の操作を開始する"""
+
+    def __init__(self, list_instances: Callable[[], List], submit: Callable[..., object],
+                 restart: Callable[[object, object], None]):
+        """
+        Args:
+            list_instances: インスタンスの一覧を返す関数
+            submit: OperationManager.submit と同じ引数で操作を開始する関数
+            restart: 再起動を行う関数 (inst, op を受け取る)
+        """
+        self._list_instances = list_instances
+        self._submit = submit
+        self._restart = restart
+        self._lock = threading.Lock()
+        self._next: Dict[str, datetime] = {}        # インスタンスID -> 次の再起動の時刻
+        self._delays: Dict[str, int] = {}           # インスタンスID -> 遅らせた回数
+        self._busy: Dict[str, datetime] = {}        # インスタンスID -> 別の操作の終了を待っている再起動の時刻
+        self._cancel: Dict[str, threading.Event] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(CHECK_INTERVAL):
+            for inst in self._list_instances():
+                try:
+                    self.check(inst)
+                except Exception as e:
+                    print(f"定期再起動の確認中にエラーが発生しました ({inst.id}): {e}")
+
+    def next_run(self, inst) -> Optional[datetime]:
+        """次に再起動する時刻を返す (無効な場合は None)"""
+        schedule = get_schedule(inst.cfg)
+        if not schedule['enabled']:
+            with self._lock:
+                self._next.pop(inst.id, None)
+                self._delays.pop(inst.id, None)
+                self._busy.pop(inst.id, None)
+            return None
+        with self._lock:
+            if inst.id not in self._next:
+                self._next[inst.id] = next_window(schedule['times'], datetime.now())
+            return self._next[inst.id]
+
+    def reschedule(self, inst):
+        """設定の変更後に、次の再起動の時刻を計算し直す"""
+        with self._lock:
+            self._next.pop(inst.id, None)
+            self._delays.pop(inst.id, None)
+            self._busy.pop(inst.id, None)
+
+    def _advance(self, inst, schedule: Dict, due: datetime):
+        """次の時刻に進める (予告中に同じ時刻で再度開始しないよう、due より後の時刻にする)"""
+        with self._lock:
+            self._next[inst.id] = next_window(schedule['times'], max(due, datetime.now()))
+            self._delays.pop(inst.id, None)
+            self._busy.pop(inst.id, None)
+
+    def check(self, inst, now: Optional[datetime] = None):
+        """予告を始める時刻になっていれば、再起動の操作を開始する"""
+        now = now or datetime.now()
+        due = self.next_run(inst)
+        if due is None:
+            return
+        schedule = get_schedule(inst.cfg)
+        lead = timedelta(seconds=max(schedule['warnings'], default=0))
+        if now < due - lead:
+            return
+        if not inst.is_running():
+            # 停止中のインスタンスは再起動しない
+            self._advance(inst, schedule, due)
+            return
+
+        players = inst.player_tracker.count()
+        max_players = schedule['max_players']
+        if max_players is not None and players > max_players:
+            delays = self._delays.get(inst.id, 0)
+            if schedule['when_busy'] == "delay" and delays < schedule['max_delays']:
+                with self._lock:
+                    self._next[inst.id] = due + timedelta(minutes=schedule['delay_minutes'])
+                    self._delays[inst.id] = delays + 1
+                inst.emit('console_output', {
+                    'log': f"オンラインのプレイヤーが {players} 人のため、定期再起動を "
+                           f"{schedule['delay_minutes']} 分遅らせます。"
+                })
+            else:
+                self._advance(inst, schedule, due)
+                inst.emit('console_output', {
+                    'log': f"オンラインのプレイヤーが {players} 人のため、今回の定期再起動を見送ります。"
+                })
+                record_restart(inst.path(RESTART_HISTORY_FILE), {
+                    'scheduled': due.timestamp(), 'started': time.time(), 'players': players,
+                    'result': "skipped",
+                })
+            return
+
+        try:
+            self.run_now(inst, schedule, restart_at=max(due.timestamp(), time.time()))
+        except OperationException as e:
+            # 別の操作が終わるまで、BUSY_RETRY_MINUTES の間は次の確認で開始し直す
+            if now < due + timedelta(minutes=BUSY_RETRY_MINUTES):
+                with self._lock:
+                    notify = self._busy.get(inst.id) != due
+                    self._busy[inst.id] = due
+                if notify:
+                    inst.emit('console_output', {'log': f"別の操作が実行中のため、定期再起動はその終了を待ちます: {e}"})
+                return
+            self._advance(inst, schedule, due)
+            inst.emit('console_output', {'log': f"別の操作が終わらなかったため、今回の定期再起動を見送ります: {e}"})
+            record_restart(inst.path(RESTART_HISTORY_FILE), {
+                'scheduled': due.timestamp(), 'started': time.time(), 'players': players,
+                'result': "skipped_busy", 'error': str(e),
+            })
+            return
+        self._advance(inst, schedule, due)
+
+    def run_now(self, inst, schedule: Optional[Dict] = None, restart_at: Optional[float] = None):
+        """
+        定期再起動の手順 (予告・save-all・バックアップ・再起動) をすぐに開始する
+
+        Args:
+            restart_at: 再起動する時刻 (省略時は最も長い予告の時間の後)
+
+        Returns:
+            開始した Operation
+
+        Raises:
+            OperationException: 同じインスタンスで別の操作が実行中の場合
+        """
+        schedule = schedule or get_schedule(inst.cfg)
+        if restart_at is None:
+            restart_at = time.time() + max(schedule['warnings'], default=0)
+        cancelled = threading.Event()
+
+        def run(op):
+            try:
+                return graceful_restart(inst, op, schedule, restart_at, cancelled, self._restart)
+            finally:
+                with self._lock:
+                    if self._cancel.get(inst.id) is cancelled:
+                        del self._cancel[inst.id]
+
+        with self._lock:
+            self._cancel.setdefault(inst.id, cancelled)
+        try:
+            return self._submit('scheduled_restart', inst.id, run)
+        except Exception:
+            with self._lock:
+                if self._cancel.get(inst.id) is cancelled:
+                    del self._cancel[inst.id]
+            raise
+
+    def cancel(self, instance_id: str) -> bool:
+        """予告中の定期再起動を取り消す"""
+        with self._lock:
+            cancelled = self._cancel.get(instance_id)
+        if cancelled is None:
+            return False
+        cancelled.set()
+        return True
+
+    def history(self, inst, limit: int = 50) -> List[Dict]:
+        """新しい順に定期再起動の履歴を返す"""
+        return load_restart_history(inst.path(RESTART_HISTORY_FILE))[::-1][:limit]
@@ -0,0 +1,288 @@
+"""
+Server List Ping (マルチプレイ画面のサーバー一覧と同じ問い合わせ)
+ゲームポートに接続してハンドシェイクとステータスの要求を送り、MOTD・オンライン人数・応答時間を取得する
+プロセスの有無ではなく、実際にプレイヤーを受け入れられる状態かどうかを確認できる
+"""
+import json
+import re
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_PORT = 25565
+DEFAULT_TIMEOUT = 3.0
+# ステータスの問い合わせではどのバージョンでも応答が返るため、-1 を送る
+STATUS_PROTOCOL_VERSION = -1
+# ハンドシェイクの次の状態
+NEXT_STATE_STATUS = 1
+NEXT_STATE_LOGIN = 2
+MAX_RESPONSE_SIZE = 1024 * 1024
+
+# 起動中のサーバーの状態
+STATE_STOPPED = "stopped"            # プロセスがなく、応答もない
+STATE_STARTING = "starting"          # プロセスは起動しているが、まだ起動完了していない
+STATE_READY = "ready"                # ステータスの問い合わせに応答している
+STATE_UNRESPONSIVE = "unresponsive"  # 起動完了後に応答しなくなった (ハングの可能性)
+STATE_EXTERNAL = "external"          # ヘルパーが起動していないサーバーが応答している
+STATE_SLEEPING = "sleeping"          # 休止中 (hibernation のリスナーが応答している)
+
+_FORMATTING_RE = re.compile('§[0-9a-fk-or]', re.IGNORECASE)
+
+
+class ServerPingException(Exception):
+    """サーバーに接続できない場合や、応答が正しくない場合の例外"""
+    pass
+
+
+# --- パケットの読み書き ---
+def encode_varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data: bytes, offset: int = 0) -> Tuple[int, int]:
+    """data の offset から VarInt を読み、(値, 次の位置) を返す"""
+    result = 0
+    for i in range(5):
+        if offset >= len(data):
+            raise ServerPingException("VarIntの途中でデータが終わりました。")
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            if result & 0x80000000:
+                result -= 1 << 32
+            return result, offset
+    raise ServerPingException("VarIntが長すぎます。")
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return encode_varint(len(data)) + data
+
+
+def make_packet(packet_id: int, payload: bytes) -> bytes:
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+def handshake_packet(host: str, port: int, next_state: int,
+                     protocol: int = STATUS_PROTOCOL_VERSION) -> bytes:
+    return make_packet(0x00, encode_varint(protocol) + encode_string(host)
+                       + struct.pack('>H', port) + encode_varint(next_state))
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ServerPingException("サーバーが接続を閉じました。")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def read_varint(sock: socket.socket) -> int:
+    data = bytearray()
+    for _ in range(5):
+        data.extend(_recv_exact(sock, 1))
+        if not data[-1] & 0x80:
+            return decode_varint(bytes(data))[0]
+    raise ServerPingException("VarIntが長すぎます。")
+
+
+def read_packet(sock: socket.socket) -> Tuple[int, bytes]:
+    """パケットを1つ読み取り、(パケットID, 本文) を返す"""
+    length = read_varint(sock)
+    if length <= 0 or length > MAX_RESPONSE_SIZE:
+        raise ServerPingException(f"パケットの長さが正しくありません: {length}")
+    data = _recv_exact(sock, length)
+    packet_id, offset = decode_varint(data)
+    return packet_id, data[offset:]
+
+
+def description_text(description) -> str:
+    """MOTD (文字列またはチャットコンポーネント) を書式のない文字列にする"""
+    if isinstance(description, str):
+        return _FORMATTING_RE.sub('', description)
+    if isinstance(description, list):
+        return ''.join(description_text(part) for part in description)
+    if isinstance(description, dict):
+        text = description_text(description.get('text', ''))
+        return text + ''.join(description_text(part) for part in description.get('extra', []))
+    return ''
+
+
+# --- 問い合わせ ---
+def ping(host: str, port: int = DEFAULT_PORT, timeout: float = DEFAULT_TIMEOUT) -> Dict:
+    """
+    ステータスを問い合わせる
+
+    Returns:
+        latency_ms (Ping/Pongの往復時間), status_ms (ステータスの応答時間), version, protocol,
+        motd, players_online, players_max, players_sample を含む辞書
+
+    Raises:
+        ServerPingException: 接続できない場合や、応答が正しくない場合
+    """
+    started = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connected = time.perf_counter()
+            sock.sendall(handshake_packet(host, port, NEXT_STATE_STATUS) + make_packet(0x00, b''))
+            packet_id, payload = read_packet(sock)
+            if packet_id != 0x00:
+                raise ServerPingException(f"予期しないパケットです: {packet_id:#x}")
+            length, offset = decode_varint(payload)
+            status = json.loads(payload[offset:offset + length].decode('utf-8'))
+            status_done = time.perf_counter()
+
+            # Ping/Pong で往復時間を測る (応答しないサーバーもあるため、失敗しても結果は返す)
+            latency_ms = None
+            try:
+                token = int(time.time() * 1000)
+                sent = time.perf_counter()
+                sock.sendall(make_packet(0x01, struct.pack('>q', token)))
+                packet_id, payload = read_packet(sock)
+                if packet_id == 0x01 and struct.unpack('>q', payload[:8])[0] == token:
+                    latency_ms = round((time.perf_counter() - sent) * 1000, 2)
+            except (OSError, ServerPingException, struct.error):
+                pass
+    except OSError as e:
+        raise ServerPingException(f"{host}:{port} に接続できません: {e}")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ServerPingException(f"ステータスの応答が正しくありません: {e}")
+
+    players = status.get('players') or {}
+    version = status.get('version') or {}
+    return {
+        'host': host,
+        'port': port,
+        'latency_ms': latency_ms,
+        'connect_ms': round((connected - started) * 1000, 2),
+        'status_ms': round((status_done - connected) * 1000, 2),
+        'version': version.get('name'),
+        'protocol': version.get('protocol'),
+        'motd': description_text(status.get('description', '')),
+        'players_online': players.get('online'),
+        'players_max': players.get('max'),
+        'players_sample': [p.get('name') for p in players.get('sample') or [] if isinstance(p, dict)],
+    }
+
+
+def try_ping(host: str, port: int, timeout: float = DEFAULT_TIMEOUT) -> Dict:
+    """ping() と同じだが、失敗した場合は例外ではなく online=False と error を返す"""
+    try:
+        return {'online': True, 'checked': time.time(), **ping(host, port, timeout)}
+    except ServerPingException as e:
+        return {'online': False, 'checked': time.time(), 'host': host, 'port': port, 'error': str(e)}
+
+
+def classify(process_running: bool, ready_logged: bool, result: Dict, failures: int,
+             unresponsive_after: int) -> str:
+    """
+    プロセスの有無・起動完了のログ・問い合わせの結果から、サーバーの状態を決める
+
+    Args:
+        process_running: ヘルパーが起動したプロセスが動いているか
+        ready_logged: 起動完了 ("Done") のログが出たか
+        result: try_ping() の結果
+        failures: 連続して問い合わせに失敗した回数
+        unresponsive_after: 起動完了後にこの回数だけ連続して失敗したら応答なしとみなす
+    """
+    if result.get('online'):
+        return STATE_READY if process_running else STATE_EXTERNAL
+    if not process_running:
+        return STATE_STOPPED
+    if ready_logged:
+        # 一時的な失敗では状態を変えない
+        return STATE_UNRESPONSIVE if failures >= unresponsive_after else STATE_READY
+    return STATE_STARTING
+
+
+class ServerPinger:
+    """インスタンスのゲームポート (と ownserver の公開アドレス) に定期的にステータスを問い合わせる"""
+
+    def __init__(self, list_instances: Callable[[], List], interval: float = 5.0,
+                 public_endpoints: Optional[Callable[[], Dict[str, Tuple[str, int]]]] = None):
+        """
+        Args:
+            list_instances: インスタンスの一覧を返す関数
+            interval: 問い合わせる間隔 (秒)
+            public_endpoints: インスタンスID -> 公開アドレス (host, port) を返す関数 (ownserver など)
+        """
+        self._list_instances = list_instances
+        self.interval = interval
+        self._public_endpoints = public_endpoints or (lambda: {})
+        self._lock = threading.Lock()
+        self._results: Dict[str, Dict] = {}
+        self._failures: Dict[str, int] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for inst in self._list_instances():
+                try:
+                    self.probe(inst)
+                except Exception as e:
+                    print(f"サーバーへのステータスの問い合わせ中にエラーが発生しました ({inst.id}): {e}")
+
+    def probe(self, inst) -> Dict:
+        """インスタンスに問い合わせて結果を保存し、変化をWebUIに通知する"""
+        cfg = inst.cfg
+        host, port = inst.game_address()
+        timeout = cfg.get('ping_timeout', DEFAULT_TIMEOUT)
+        local = try_ping(host, port, timeout)
+        with self._lock:
+            failures = 0 if local['online'] else self._failures.get(inst.id, 0) + 1
+            self._failures[inst.id] = failures
+        state = classify(inst.is_running(), inst.ready, local, failures,
+                         cfg.get('ping_unresponsive_after', 3))
+        if inst.sleep_listener is not None and not inst.is_running():
+            state = STATE_SLEEPING
+        result = {
+            'state': state,
+            'local': local,
+            'public': None,
+        }
+        endpoint = self._public_endpoints().get(inst.id)
+        if endpoint:
+            result['public'] = try_ping(endpoint[0], endpoint[1], timeout)
+        with self._lock:
+            previous = self._results.get(inst.id)
+            self._results[inst.id] = result
+        if result['state'] == STATE_UNRESPONSIVE and (previous is None or previous['state'] != STATE_UNRESPONSIVE):
+            inst.emit('console_output', {
+                'log': f"警告: サーバーがステータスの問い合わせに応答しません ({host}:{port})。ハングしている可能性があります。"
+            })
+        inst.emit('ping_update', result)
+        return result
+
+    def result(self, instance_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._results.get(instance_id)
+
+    def forget(self, instance_id: str):
+        with self._lock:
+            self._results.pop(instance_id, None)
+            self._failures.pop(instance_id, None)
@@ -0,0 +1,222 @@
+"""
+サーバーの起動時間の記録
+起動ごとに、ログの "Done (12.345s)!" の値とプロセスの起動からの実測時間を、
+JAR・JVMのフラグ・mods/pluginsフォルダのハッシュと一緒に保存し、構成の変更による起動時間の悪化を検出する
+"""
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from log_parser import EVENT_SERVER_READY, LogEventBus, LogRecord
+
+# インスタンスのデータフォルダに保存する起動時間の履歴
+STARTUP_HISTORY_FILE = "startup_history.json"
+STARTUP_HISTORY_SIZE = 500
+# 前の構成と比べて起動時間がこの割合以上長くなった場合に悪化とみなす
+REGRESSION_THRESHOLD = 0.15
+
+
+class _FileHashCache:
+    """ファイルのハッシュ (サイズと更新日時が変わらない限り再計算しない)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: Dict[str, tuple] = {}
+
+    def digest(self, path: str) -> str:
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._cache[path] = (key, digest)
+        return digest
+
+
+_file_hashes = _FileHashCache()
+
+
+def content_hash(dirs: List[str]) -> Optional[str]:
+    """
+    フォルダ内の .jar ファイルの名前と内容から、Mod/プラグインの構成を表すハッシュを返す
+    どのフォルダにも .jar ファイルがない場合は None
+    """
+    h = hashlib.sha256()
+    found = False
+    for directory in dirs:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not name.endswith('.jar') or not os.path.isfile(path):
+                continue
+            try:
+                digest = _file_hashes.digest(path)
+            except OSError:
+                continue
+            h.update(f"{os.path.basename(directory)}/{name}:{digest}\n".encode('utf-8'))
+            found = True
+    return h.hexdigest()[:16] if found else None
+
+
+def load_history(path: str) -> List[Dict]:
+    """起動時間の履歴を読み込む (古い順)"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return []
+
+
+def _config_key(entry: Dict) -> tuple:
+    return (entry.get('jar'), entry.get('mods_hash'), entry.get('profile'), tuple(entry.get('flags') or ()))
+
+
+def _describe_change(before: Dict, after: Dict) -> List[str]:
+    changes = []
+    if before.get('jar') != after.get('jar'):
+        changes.append('jar')
+    if before.get('mods_hash') != after.get('mods_hash'):
+        changes.append('mods')
+    if before.get('profile') != after.get('profile') or before.get('flags') != after.get('flags'):
+        changes.append('jvm')
+    return changes
+
+
+def find_regressions(history: List[Dict], threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """
+    構成 (JAR, Mod/プラグイン, JVMのフラグ) が変わった時点ごとに、変更前後の起動時間の中央値を比べる
+
+    Args:
+        history: 起動時間の履歴 (古い順)
+        threshold: この割合以上長くなった場合に regression を True にする
+
+    Returns:
+        構成の変更ごとの比較結果 (新しい順)
+    """
+    # 同じ構成が続く区間に分ける
+    segments: List[List[Dict]] = []
+    for entry in history:
+        if segments and _config_key(segments[-1][-1]) == _config_key(entry):
+            segments[-1].append(entry)
+        else:
+            segments.append([entry])
+
+    results = []
+    for before, after in zip(segments, segments[1:]):
+        result = {
+            'changed_at': after[0].get('started'),
+            'changes': _describe_change(before[-1], after[0]),
+            'before': {'jar': before[-1].get('jar'), 'mods_hash': before[-1].get('mods_hash'),
+                       'profile': before[-1].get('profile'), 'runs': len(before)},
+            'after': {'jar': after[0].get('jar'), 'mods_hash': after[0].get('mods_hash'),
+                      'profile': after[0].get('profile'), 'runs': len(after)},
+            'regression': False,
+        }
+        for field in ('done_seconds', 'wall_seconds'):
+            old = [e[field] for e in before if e.get(field) is not None]
+            new = [e[field] for e in after if e.get(field) is not None]
+            if not old or not new:
+                continue
+            old_median = statistics.median(old)
+            new_median = statistics.median(new)
+            change = (new_median - old_median) / old_median if old_median > 0 else 0.0
+            result[field] = {'before': round(old_median, 3), 'after': round(new_median, 3),
+                             'change': round(change, 3)}
+            if change >= threshold:
+                result['regression'] = True
+        results.append(result)
+    return results[::-1]
+
+
+class StartupTelemetry:
+    """サーバーの起動から "Done" のログが出るまでの時間を記録する"""
+
+    def __init__(self, events: LogEventBus, history_path: Callable[[], str],
+                 on_record: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            events: 購読するサーバーログのイベントバス
+            history_path: 履歴を保存するファイルのパスを返す関数
+            on_record: 起動時間を記録したときに呼ばれる関数 (記録した内容を受け取る)
+        """
+        self._history_path = history_path
+        self._on_record = on_record
+        self._lock = threading.Lock()
+        self._pending: Optional[Dict] = None
+        self._spawned: Optional[float] = None
+        events.subscribe(self._handle_ready, events=(EVENT_SERVER_READY,))
+
+    def begin(self, spawned: float, jar: str, profile: Optional[str], flags: List[str],
+              content_dirs: List[str]):
+        """
+        サーバーのプロセスを起動したときに呼ぶ
+
+        Args:
+            spawned: プロセスを起動した時刻 (time.monotonic())
+            jar: サーバーのJARファイル名
+            profile: JVMのプロファイル
+            flags: -Xmx/-Xms 以外のJVMのフラグ
+            content_dirs: ハッシュを取るフォルダ (mods, plugins)
+        """
+        entry = {
+            'started': time.time() - (time.monotonic() - spawned),
+            'jar': jar,
+            'profile': profile,
+            'flags': list(flags),
+            'mods_hash': content_hash(content_dirs),
+        }
+        with self._lock:
+            self._pending = entry
+            self._spawned = spawned
+
+    def abort(self):
+        """起動完了前にプロセスが終了した場合に呼ぶ"""
+        with self._lock:
+            self._pending = None
+            self._spawned = None
+
+    def _handle_ready(self, record: LogRecord):
+        now = time.monotonic()
+        with self._lock:
+            entry, spawned = self._pending, self._spawned
+            self._pending = None
+            self._spawned = None
+        if entry is None:
+            return
+        entry['done_seconds'] = float(record.data[0])
+        entry['wall_seconds'] = round(now - spawned, 3)
+
+        path = self._history_path()
+        history = load_history(path)
+        history.append(entry)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(history[-STARTUP_HISTORY_SIZE:], f, ensure_ascii=False, indent=2)
+        except IOError as e:
+            print(f"起動時間の履歴を保存できませんでした: {e}")
+        if self._on_record:
+            try:
+                self._on_record(entry)
+            except Exception as e:
+                print(f"起動時間の通知中にエラーが発生しました: {e}")
+
+    def history(self, limit: int = 100) -> List[Dict]:
+        """新しい順に起動時間の履歴を返す"""
+        return load_history(self._history_path())[::-1][:limit]
+
+    def regressions(self, threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+        return find_regressions(load_history(self._history_path()), threshold)
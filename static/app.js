@@ -1,16 +1,32 @@
 document.addEventListener('DOMContentLoaded', () => {
-    const socket = io();
+    // 再接続時は最後に受け取ったコンソール出力の連番を送り、取りこぼした行のみ再送してもらう
+    let consoleEpoch = null;
+    let consoleLastSeq = null;
+    // ?console_transport=binary (または localStorage の consoleTransport) で圧縮したバイナリ形式を使う
+    const consoleTransport = (new URLSearchParams(location.search).get('console_transport')
+        || localStorage.getItem('consoleTransport')) === 'binary'
+        && typeof DecompressionStream !== 'undefined' ? 'binary' : 'json';
+    // ?instance=<インスタンスID> で操作するサーバーインスタンスを選ぶ (省略時は既定のインスタンス)
+    const instanceId = new URLSearchParams(location.search).get('instance');
+    const apiBase = instanceId ? `/api/instances/${encodeURIComponent(instanceId)}` : '/api';
+    const socket = io({
+        auth: (cb) => cb({ instance: instanceId, epoch: consoleEpoch, last_seq: consoleLastSeq, transport: consoleTransport })
+    });
 
     // --- DOM Elements ---
     const statusEl = document.getElementById('server-status');
+    const onlinePlayersEl = document.getElementById('online-players');
+    const serverPingEl = document.getElementById('server-ping');
     const startBtn = document.getElementById('start-server-btn');
     const stopBtn = document.getElementById('stop-server-btn');
+    const restartBtn = document.getElementById('restart-server-btn');
     const consoleOutput = document.getElementById('console-output');
     const commandForm = document.getElementById('command-form');
     const commandInput = document.getElementById('command-input');
     const maxMemoryInput = document.getElementById('max-memory');
     const minMemoryInput = document.getElementById('min-memory');
     const worldTypeSelect = document.getElementById('world-type');
+    const jvmProfileSelect = document.getElementById('jvm-profile');
 
     // Ownserver MC
     const ownserverMcStatusEl = document.getElementById('ownserver-mc-status');
@@ -28,6 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const createBackupBtn = document.getElementById('create-backup-btn');
     const backupList = document.getElementById('backup-list');
     const restoreBackupBtn = document.getElementById('restore-backup-btn');
+    const deleteBackupBtn = document.getElementById('delete-backup-btn');
 
     // Config
     const configForm = document.getElementById('config-form');
@@ -52,11 +69,14 @@ document.addEventListener('DOMContentLoaded', () => {
             statusEl.className = 'status-running';
             startBtn.disabled = true;
             stopBtn.disabled = false;
+            restartBtn.disabled = false;
             commandInput.disabled = false;
         } else {
             statusEl.className = 'status-stopped';
             startBtn.disabled = false;
-            stopBtn.disabled = true;
+            // 休止中は停止ボタンで休止を解除できる
+            stopBtn.disabled = status !== 'Sleeping';
+            restartBtn.disabled = true;
             commandInput.disabled = true;
         }
     };
@@ -88,6 +108,13 @@ document.addEventListener('DOMContentLoaded', () => {
         element.parentElement.scrollTop = element.parentElement.scrollHeight;
     };
 
+    // 複数行をまとめて1回のDOM更新で追加する
+    const addLogLines = (element, lines) => {
+        if (!lines || lines.length === 0) return;
+        element.append(lines.join('\n') + '\n');
+        element.parentElement.scrollTop = element.parentElement.scrollHeight;
+    };
+
     // --- Socket.IO Event Handlers ---
     socket.on('connect', () => {
         console.log('Connected to server');
@@ -105,10 +132,129 @@ document.addEventListener('DOMContentLoaded', () => {
         updateStatus(data.status);
     });
 
+    socket.on('players_update', (data) => {
+        const names = data.players.map(p => p.name).join(', ');
+        onlinePlayersEl.textContent = names ? `${data.count} (${names})` : `${data.count}`;
+    });
+
+    // 停止・再起動の進行状況
+    const operationPhaseLabels = {
+        saving: 'saving world',
+        terminating: 'not responding, terminating',
+        stopped: 'stopped',
+        killed: 'killed',
+        starting: 'starting',
+        started: 'started',
+        extracting: 'extracting',
+        verifying: 'verifying',
+        swapping: 'replacing world'
+    };
+    socket.on('operation_update', (op) => {
+        if (op.status === 'running') {
+            stopBtn.disabled = true;
+            restartBtn.disabled = true;
+            if (op.phase) {
+                addLog(consoleOutput, `--- ${op.kind}: ${operationPhaseLabels[op.phase] || op.phase} ---`);
+            }
+        } else if (op.status === 'failed') {
+            addLog(consoleOutput, `--- ${op.kind} failed: ${op.error} ---`);
+        } else {
+            addLog(consoleOutput, `--- ${op.kind} finished in ${op.duration}s ---`);
+        }
+    });
+
+    // 復元の進行状況 (バイト単位、一定間隔で届く)。10% ごとにログに表示する
+    let lastRestorePercent = -1;
+    socket.on('restore_progress', (data) => {
+        if (data.phase !== 'extracting' || !data.total) {
+            return;
+        }
+        const percent = Math.floor(data.done * 100 / data.total / 10) * 10;
+        if (percent !== lastRestorePercent) {
+            lastRestorePercent = percent;
+            const files = data.total_files ? ` (${data.files}/${data.total_files} files)` : '';
+            addLog(consoleOutput, `--- Restoring ${data.filename}: ${percent}%${files} ---`);
+        }
+    });
+
+    // ゲームポートへのステータスの問い合わせ結果
+    socket.on('ping_update', (data) => {
+        const local = data.local || {};
+        let text = data.state;
+        if (local.online) {
+            const latency = local.latency_ms !== null ? `${local.latency_ms} ms` : '-';
+            text += ` / ${latency} / ${local.players_online}/${local.players_max} / ${local.motd}`;
+        }
+        if (data.public) {
+            text += data.public.online ? ` (公開: ${data.public.latency_ms} ms)` : ' (公開: 応答なし)';
+        }
+        serverPingEl.textContent = text;
+    });
+
     socket.on('console_output', (data) => {
         addLog(consoleOutput, data.log.trim());
     });
 
+    // 連番を見て重複を除き、コンソールに追加する
+    const applyConsoleFrame = (data) => {
+        if (data.epoch !== consoleEpoch) {
+            consoleEpoch = data.epoch;
+            consoleLastSeq = null;
+        }
+        let lines = data.lines;
+        if (consoleLastSeq !== null && data.seq <= consoleLastSeq) {
+            lines = lines.slice(consoleLastSeq - data.seq + 1);
+        }
+        addLogLines(consoleOutput, lines);
+        if (data.lines.length > 0) {
+            const lastSeq = data.seq + data.lines.length - 1;
+            consoleLastSeq = consoleLastSeq === null ? lastSeq : Math.max(consoleLastSeq, lastSeq);
+        }
+    };
+
+    // バイナリ形式のフレーム: [フラグ 1バイト][本文 (長さ + UTF-8 の行の繰り返し、フラグが1なら deflate 圧縮)]
+    const textDecoder = new TextDecoder();
+    const decodeConsoleLines = async (buffer) => {
+        const bytes = new Uint8Array(buffer);
+        let body = bytes.subarray(1);
+        if (bytes[0] & 0x01) {
+            const stream = new Blob([body]).stream().pipeThrough(new DecompressionStream('deflate'));
+            body = new Uint8Array(await new Response(stream).arrayBuffer());
+        }
+        const lines = [];
+        let pos = 0;
+        while (pos < body.length) {
+            let length = 0;
+            let shift = 0;
+            let b;
+            do {
+                b = body[pos++];
+                length |= (b & 0x7f) << shift;
+                shift += 7;
+            } while (b & 0x80);
+            lines.push(textDecoder.decode(body.subarray(pos, pos + length)));
+            pos += length;
+        }
+        return lines;
+    };
+
+    // 展開は非同期なので、届いた順に1つずつ処理する
+    let consoleFrameQueue = Promise.resolve();
+
+    // 描画後にACKを返す (ACKが返るまでサーバーは次のフレームを控える)
+    socket.on('console_batch', (data, ack) => {
+        consoleFrameQueue = consoleFrameQueue.then(async () => {
+            if (data.data) {
+                data.lines = await decodeConsoleLines(data.data);
+            }
+            if (data.skipped > 0) {
+                addLog(consoleOutput, `--- ${data.skipped} lines skipped ---`);
+            }
+            applyConsoleFrame(data);
+        }).catch(err => console.error('Error decoding console frame:', err))
+            .finally(() => { if (ack) ack(); });
+    });
+
     socket.on('ownserver_status_update', (data) => {
         updateOwnserverStatus(data.type, data.status);
     });
@@ -122,18 +268,20 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Server Control
     startBtn.addEventListener('click', () => {
-        const maxMem = maxMemoryInput.value || '2';
-        const minMem = minMemoryInput.value || '1';
+        // 空欄の場合はサーバー側でホストのメモリ量から決める
+        const maxMem = maxMemoryInput.value;
+        const minMem = minMemoryInput.value;
         const worldType = worldTypeSelect.value;
 
         addLog(consoleOutput, '--- Starting server... ---');
-        fetch('/api/start', {
+        fetch(apiBase + '/start', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                xmx: `${maxMem}G`,
-                xms: `${minMem}G`,
-                world_type: worldType
+                xmx: maxMem ? `${maxMem}G` : null,
+                xms: minMem ? `${minMem}G` : null,
+                world_type: worldType,
+                jvm_profile: jvmProfileSelect.value || null
             })
         })
             .then(response => response.json())
@@ -148,17 +296,31 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     });
 
-    stopBtn.addEventListener('click', () => {
-        addLog(consoleOutput, '--- Stopping server... ---');
-        fetch('/api/stop', { method: 'POST' })
-            .catch(err => console.error('Error stopping server:', err));
-    });
+    // 停止・再起動はすぐに操作IDが返り、進行状況は 'operation_update' で届く
+    const postOperation = (path, label) => {
+        addLog(consoleOutput, `--- ${label}... ---`);
+        stopBtn.disabled = true;
+        restartBtn.disabled = true;
+        fetch(apiBase + path, { method: 'POST' })
+            .then(response => response.json())
+            .then(data => {
+                if (!data.operation_id) {
+                    addLog(consoleOutput, `--- ${label} failed: ${data.message || data.status} ---`);
+                } else if (data.status === 'Busy') {
+                    addLog(consoleOutput, `--- ${data.message} ---`);
+                }
+            })
+            .catch(err => console.error(`Error (${path}):`, err));
+    };
+
+    stopBtn.addEventListener('click', () => postOperation('/stop', 'Stopping server'));
+    restartBtn.addEventListener('click', () => postOperation('/restart', 'Restarting server'));
 
     commandForm.addEventListener('submit', (e) => {
         e.preventDefault();
         const command = commandInput.value;
         if (command) {
-            fetch('/api/command', {
+            fetch(apiBase + '/command', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ command: command })
@@ -171,26 +333,26 @@ document.addEventListener('DOMContentLoaded', () => {
     // Ownserver MC
     startOwnserverMcBtn.addEventListener('click', () => {
         addLog(ownserverMcLog, '--- Starting Ownserver for MC... ---');
-        fetch('/api/ownserver/mc/start', { method: 'POST' });
+        fetch(apiBase + '/ownserver/mc/start', { method: 'POST' });
     });
     stopOwnserverMcBtn.addEventListener('click', () => {
         addLog(ownserverMcLog, '--- Stopping Ownserver for MC... ---');
-        fetch('/api/ownserver/mc/stop', { method: 'POST' });
+        fetch(apiBase + '/ownserver/mc/stop', { method: 'POST' });
     });
 
     // Ownserver Web
     startOwnserverWebBtn.addEventListener('click', () => {
         addLog(ownserverWebLog, '--- Starting Ownserver for WebUI... ---');
-        fetch('/api/ownserver/web/start', { method: 'POST' });
+        fetch(apiBase + '/ownserver/web/start', { method: 'POST' });
     });
     stopOwnserverWebBtn.addEventListener('click', () => {
         addLog(ownserverWebLog, '--- Stopping Ownserver for WebUI... ---');
-        fetch('/api/ownserver/web/stop', { method: 'POST' });
+        fetch(apiBase + '/ownserver/web/stop', { method: 'POST' });
     });
 
     // Backups
     const refreshBackupList = () => {
-        fetch('/api/backups')
+        fetch(apiBase + '/backups')
             .then(res => res.json())
             .then(data => {
                 backupList.innerHTML = '';
@@ -202,11 +364,13 @@ document.addEventListener('DOMContentLoaded', () => {
                         backupList.appendChild(option);
                     });
                     restoreBackupBtn.disabled = false;
+                    deleteBackupBtn.disabled = false;
                 } else {
                     const option = document.createElement('option');
                     option.textContent = 'バックアップはありません';
                     backupList.appendChild(option);
                     restoreBackupBtn.disabled = true;
+                    deleteBackupBtn.disabled = true;
                 }
             });
     };
@@ -214,7 +378,7 @@ document.addEventListener('DOMContentLoaded', () => {
     createBackupBtn.addEventListener('click', () => {
         addLog(consoleOutput, '--- Creating backup... ---');
         createBackupBtn.disabled = true;
-        fetch('/api/backups/create', { method: 'POST' })
+        fetch(apiBase + '/backups/create', { method: 'POST' })
             .then(res => res.json())
             .then(data => {
                 if (data.status === 'Success') {
@@ -231,18 +395,39 @@ document.addEventListener('DOMContentLoaded', () => {
 
     restoreBackupBtn.addEventListener('click', () => {
         const filename = backupList.value;
-        if (!filename || !confirm(`本当に '${filename}' を復元しますか？\n現在のワールドは削除されます！`)) {
+        if (!filename || !confirm(`本当に '${filename}' を復元しますか？\n復元が完了すると、現在のワールドは置き換えられます！`)) {
             return;
         }
         addLog(consoleOutput, `--- Restoring backup: ${filename} ---`);
-        fetch('/api/backups/restore', {
+        lastRestorePercent = -1;
+        // すぐに操作IDが返り、進行状況は 'restore_progress'、完了は 'operation_update' で届く
+        fetch(apiBase + '/backups/restore', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ filename: filename })
         })
             .then(res => res.json())
             .then(data => {
-                addLog(consoleOutput, `--- ${data.message} ---`);
+                if (!data.operation_id || data.status === 'Busy') {
+                    addLog(consoleOutput, `--- ${data.message} ---`);
+                }
+            });
+    });
+
+    deleteBackupBtn.addEventListener('click', () => {
+        const filename = backupList.value;
+        if (!filename || !confirm(`本当に '${filename}' を削除しますか？`)) {
+            return;
+        }
+        fetch(apiBase + '/backups/delete', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: filename })
+        })
+            .then(res => res.json())
+            .then(data => {
+                addLog(consoleOutput, `--- ${filename}: ${data.message} ---`);
+                refreshBackupList();
             });
     });
 
@@ -250,7 +435,7 @@ document.addEventListener('DOMContentLoaded', () => {
     configForm.addEventListener('submit', (e) => {
         e.preventDefault();
         const newJarPath = jarPathInput.value;
-        fetch('/api/config', {
+        fetch(apiBase + '/config', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ jar_path: newJarPath })
@@ -263,7 +448,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (selectJarBtn) {
         selectJarBtn.addEventListener('click', () => {
-            fetch('/api/select_file_dialog')
+            fetch(apiBase + '/select_file_dialog')
                 .then(res => res.json())
                 .then(data => {
                     if (data.status === 'Success') {
@@ -300,7 +485,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            fetch('/api/quick_command', {
+            fetch(apiBase + '/quick_command', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -319,7 +504,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Fetch definitions and current values in parallel
             const [propsRes, currentPropsRes] = await Promise.all([
                 fetch('/static/server_properties_jp.json'),
-                fetch('/api/properties')
+                fetch(apiBase + '/properties')
             ]);
 
             if (!propsRes.ok || !currentPropsRes.ok) {
@@ -402,7 +587,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
             }
 
-            fetch('/api/properties', {
+            fetch(apiBase + '/properties', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(data)
@@ -451,7 +636,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const initSoftwareDownloader = async () => {
         try {
-            const response = await fetch('/api/server_software/types');
+            const response = await fetch(apiBase + '/server_software/types');
             const types = await response.json();
             softwareTypeSelect.innerHTML = '';
             types.forEach(type => {
@@ -474,7 +659,7 @@ document.addEventListener('DOMContentLoaded', () => {
         downloadSoftwareBtn.disabled = true;
         softwareMcVersionSelect.innerHTML = '<option>Loading...</option>';
         try {
-            const response = await fetch(`/api/server_software/versions?project=${project}`);
+            const response = await fetch(`${apiBase}/server_software/versions?project=${project}`);
             const versions = await response.json();
             softwareMcVersionSelect.innerHTML = '';
             versions.forEach(version => {
@@ -504,7 +689,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         softwareBuildSelect.innerHTML = '<option>Loading...</option>';
         try {
-            const response = await fetch(`/api/server_software/builds?project=${project}&version=${version}`);
+            const response = await fetch(`${apiBase}/server_software/builds?project=${project}&version=${version}`);
             const builds = await response.json();
             softwareBuildSelect.innerHTML = '';
             builds.forEach(build => {
@@ -533,7 +718,7 @@ document.addEventListener('DOMContentLoaded', () => {
         downloadSoftwareBtn.textContent = 'ダウンロード中...';
 
         try {
-            const response = await fetch('/api/server_software/install', {
+            const response = await fetch(apiBase + '/server_software/install', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ project, version, build })
@@ -559,14 +744,98 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
 
+    // --- TPS / MSPT ---
+    const tpsTierSelect = document.getElementById('tps-tier');
+    const tpsLatestEl = document.getElementById('tps-latest');
+    const tpsChart = document.getElementById('tps-chart');
+
+    const drawSeries = (ctx, points, t0, t1, maxValue, color) => {
+        if (points.length === 0) return;
+        const { width, height } = ctx.canvas;
+        const span = Math.max(t1 - t0, 1);
+        ctx.strokeStyle = color;
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        points.forEach(([ts, avg], i) => {
+            const x = ((ts - t0) / span) * width;
+            const y = height - (Math.min(avg, maxValue) / maxValue) * height;
+            if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+        });
+        ctx.stroke();
+    };
+
+    // TPSは0〜20、MSPTは0〜50ms (超えた場合は最大値) を縦軸にして重ねて描画する
+    const drawTpsChart = (series) => {
+        const ctx = tpsChart.getContext('2d');
+        ctx.clearRect(0, 0, tpsChart.width, tpsChart.height);
+        const all = [...series.tps, ...series.mspt].map(p => p[0]);
+        if (all.length === 0) {
+            tpsLatestEl.textContent = 'データがありません';
+            return;
+        }
+        const t0 = Math.min(...all);
+        const t1 = Math.max(...all);
+        const msptMax = Math.max(50, ...series.mspt.map(p => p[1]));
+        drawSeries(ctx, series.tps, t0, t1, 20, '#10b981');
+        drawSeries(ctx, series.mspt, t0, t1, msptMax, '#f59e0b');
+
+        const lastTps = series.tps.length ? series.tps[series.tps.length - 1][1] : null;
+        const lastMspt = series.mspt.length ? series.mspt[series.mspt.length - 1][1] : null;
+        tpsLatestEl.textContent = `TPS: ${lastTps ?? '-'} / MSPT: ${lastMspt ?? '-'} ms`;
+    };
+
+    const refreshTpsChart = () => {
+        fetch(`${apiBase}/metrics/tps?tier=${tpsTierSelect.value}`)
+            .then(res => res.json())
+            .then(data => drawTpsChart(data.series))
+            .catch(err => console.error('Error fetching TPS metrics:', err));
+    };
+
+    tpsTierSelect.addEventListener('change', refreshTpsChart);
+    setInterval(() => {
+        if (!document.hidden) refreshTpsChart();
+    }, 5000);
+
+    // --- Instances ---
+    const instanceSelect = document.getElementById('instance-select');
+    fetch('/api/instances').then(res => res.json()).then(data => {
+        instanceSelect.innerHTML = '';
+        data.instances.forEach(inst => {
+            const option = document.createElement('option');
+            option.value = inst.id;
+            option.textContent = `${inst.id} (${inst.status})`;
+            option.selected = inst.id === (instanceId || 'default');
+            instanceSelect.appendChild(option);
+        });
+    });
+    instanceSelect.addEventListener('change', () => {
+        const params = new URLSearchParams(location.search);
+        params.set('instance', instanceSelect.value);
+        location.search = params.toString();
+    });
+
+    // --- JVM Profiles ---
+    fetch(apiBase + '/jvm/profiles').then(res => res.json()).then(data => {
+        jvmProfileSelect.innerHTML = '';
+        data.profiles.forEach(profile => {
+            const option = document.createElement('option');
+            option.value = profile.id;
+            option.textContent = profile.recommended_xmx
+                ? `${profile.label} (推奨 ${profile.recommended_xmx})` : profile.label;
+            option.selected = profile.id === data.current;
+            jvmProfileSelect.appendChild(option);
+        });
+    });
+
     // --- Initial State ---
-    fetch('/api/status').then(res => res.json()).then(data => updateStatus(data.status));
-    fetch('/api/ownserver/status').then(res => res.json()).then(data => {
+    fetch(apiBase + '/status').then(res => res.json()).then(data => updateStatus(data.status));
+    fetch(apiBase + '/ownserver/status').then(res => res.json()).then(data => {
         updateOwnserverStatus('mc', data.mc);
         updateOwnserverStatus('web', data.web);
     });
-    fetch('/api/config').then(res => res.json()).then(data => jarPathInput.value = data.jar_path);
+    fetch(apiBase + '/config').then(res => res.json()).then(data => jarPathInput.value = data.jar_path);
     refreshBackupList();
+    refreshTpsChart();
     buildPropertiesForm();
     initSoftwareDownloader();
 
@@ -579,7 +848,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Disable all buttons to prevent further actions
                 document.querySelectorAll('button').forEach(btn => btn.disabled = true);
 
-                fetch('/api/stop_all', { method: 'POST' })
+                fetch(apiBase + '/stop_all', { method: 'POST' })
                     .then(response => response.json())
                     .then(data => {
                         addLog(consoleOutput, `--- ${data.status} ---`);
@@ -628,7 +897,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!modList && !pluginList) return;
 
         try {
-            const response = await fetch('/api/installed_projects');
+            const response = await fetch(apiBase + '/installed_projects');
             const projects = await response.json();
 
             if (modList) modList.innerHTML = '';
@@ -698,7 +967,7 @@ document.addEventListener('DOMContentLoaded', () => {
             statusItem.className = 'status-item';
             statusItem.textContent = `${file.name} - Uploading...`;
             statusContainer.appendChild(statusItem);
-            return fetch(`/api/upload_${type}`, { method: 'POST', body: formData })
+            return fetch(`${apiBase}/upload_${type}`, { method: 'POST', body: formData })
                 .then(response => response.json())
                 .then(data => {
                     if (data.status === 'Success') {
@@ -735,7 +1004,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const filename = button.dataset.filename;
                 const type = button.dataset.type;
                 if (confirm(`本当に'${filename}'を削除しますか？`)) {
-                    fetch(`/api/delete_${type}/${filename}`, { method: 'DELETE' })
+                    fetch(`${apiBase}/delete_${type}/${filename}`, { method: 'DELETE' })
                         .then(res => res.json())
                         .then(data => data.status === 'Success' ? refreshInstalledList() : alert(`Error: ${data.message}`))
                         .catch(err => { console.error(`Error deleting ${type}:`, err); alert('ファイルの削除中にエラーが発生しました。'); });
@@ -757,7 +1026,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const originalText = button.textContent;
         button.textContent = '処理中...';
         try {
-            const response = await fetch('/api/modrinth/install', {
+            const response = await fetch(apiBase + '/modrinth/install', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ project_id: projectId, version_id: versionId, project_type: projectType })
@@ -824,7 +1093,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
             console.log('[DEBUG] Fetching versions with loaders:', loaders.length > 0 ? loaders : modrinthLoader.value || 'none');
 
-            const response = await fetch(`/api/modrinth/project/${projectId}/versions?${params.toString()}`);
+            const response = await fetch(`${apiBase}/modrinth/project/${projectId}/versions?${params.toString()}`);
             const versions = await response.json();
             selectElement.innerHTML = '';
             if (versions && versions.length > 0) {
@@ -931,7 +1200,7 @@ document.addEventListener('DOMContentLoaded', () => {
         modrinthSearchBtn.textContent = '検索中...';
         modrinthResultsContainer.innerHTML = '<p>Modrinthから検索しています...</p>';
         try {
-            const response = await fetch(`/api/modrinth/search?${params.toString()}`);
+            const response = await fetch(`${apiBase}/modrinth/search?${params.toString()}`);
             const results = await response.json();
             renderModrinthResults(results, searchProjectType); // 検索条件のproject_typeを渡す
         } catch (error) {
@@ -973,7 +1242,7 @@ document.addEventListener('DOMContentLoaded', () => {
             checkUpdatesBtn.disabled = true;
             checkUpdatesBtn.textContent = 'チェック中...';
             try {
-                const response = await fetch('/api/modrinth/check_updates', { method: 'POST' });
+                const response = await fetch(apiBase + '/modrinth/check_updates', { method: 'POST' });
                 const updates = await response.json();
                 // Update the list first
                 await refreshInstalledList(updates);
@@ -999,7 +1268,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const openFolderBtn = document.getElementById('open-folder-btn');
     if (openFolderBtn) {
         openFolderBtn.addEventListener('click', () => {
-            fetch('/api/open_folder', { method: 'POST' })
+            fetch(apiBase + '/open_folder', { method: 'POST' })
                 .then(res => res.json())
                 .then(data => {
                     if (data.status !== 'Success') {
@@ -0,0 +1,247 @@
+"""
+サーバーのクラッシュの検出と自動再起動
+停止を要求していないのにプロセスが終了した場合をクラッシュとみなし、
+クラッシュレポートと直前のコンソール出力を記録してから、間隔を延ばしながら再起動する
+短時間にクラッシュを繰り返す場合 (壊れたModなど) は自動再起動をやめる
+"""
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# インスタンスのデータフォルダに保存するクラッシュの履歴
+CRASH_HISTORY_FILE = "crash_history.json"
+CRASH_HISTORY_SIZE = 100
+CRASH_REPORTS_DIR = "crash-reports"
+# 記録するクラッシュレポートの最大文字数
+CRASH_REPORT_MAX_CHARS = 20000
+
+STATE_IDLE = "idle"            # 停止中、または正常に稼働中
+STATE_WAITING = "waiting"      # 再起動の待機中
+STATE_TRIPPED = "tripped"      # クラッシュを繰り返したため自動再起動を停止した
+
+
+def find_crash_report(data_dir: str, since: float) -> Optional[str]:
+    """since (time.time()) 以降に作られた最新のクラッシュレポートのパスを返す"""
+    reports = []
+    for path in glob.glob(os.path.join(data_dir, CRASH_REPORTS_DIR, "*.txt")):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if mtime >= since:
+            reports.append((mtime, path))
+    return max(reports)[1] if reports else None
+
+
+def read_crash_report(path: str) -> Dict:
+    """クラッシュレポートを読み込み、ファイル名・概要 (Description 行)・本文を返す"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read(CRASH_REPORT_MAX_CHARS)
+    except OSError as e:
+        return {'file': os.path.basename(path), 'description': None, 'error': str(e)}
+    description = None
+    for line in text.splitlines():
+        if line.startswith("Description:"):
+            description = line[len("Description:"):].strip()
+            break
+    return {'file': os.path.basename(path), 'description': description, 'text': text}
+
+
+def load_crashes(path: str) -> List[Dict]:
+    """クラッシュの履歴を読み込む (古い順)"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return []
+
+
+class CrashSupervisor:
+    """1つのインスタンスのプロセスの終了を監視し、クラッシュした場合に再起動する"""
+
+    def __init__(self, get_config: Callable[[], Dict], data_dir: Callable[[], str],
+                 console_tail: Callable[[int], List[str]], restart: Callable[[], bool],
+                 on_event: Callable[[str, Dict], None]):
+        """
+        Args:
+            get_config: インスタンスの設定を返す関数 (crash_* の設定を読む)
+            data_dir: インスタンスのデータフォルダを返す関数
+            console_tail: 最後の n 行のコンソール出力を返す関数
+            restart: サーバーを前回と同じ設定で起動する関数 (成功したら True)
+            on_event: WebUIにイベントを送信する関数 (イベント名, データ)
+        """
+        self._get_config = get_config
+        self._data_dir = data_dir
+        self._console_tail = console_tail
+        self._restart = restart
+        self._on_event = on_event
+        self._lock = threading.Lock()
+        self._state = STATE_IDLE
+        self._stop_requested = False
+        self._started_at: Optional[float] = None
+        self._crash_times: List[float] = []     # 直近のクラッシュの時刻 (time.monotonic())
+        self._timer: Optional[threading.Timer] = None
+        self._restart_at: Optional[float] = None
+        self._auto_restarting = False
+
+    def started(self):
+        """サーバーを起動したときに呼ぶ (手動で起動した場合はクラッシュの記録をリセットする)"""
+        with self._lock:
+            if not self._auto_restarting:
+                self._crash_times.clear()
+                self._cancel_timer()
+            self._state = STATE_IDLE
+            self._stop_requested = False
+            self._started_at = time.time()
+
+    def stop_requested(self):
+        """停止を要求したときに呼ぶ (この後の終了はクラッシュとみなさない)"""
+        with self._lock:
+            self._stop_requested = True
+            self._cancel_timer()
+            if self._state == STATE_WAITING:
+                self._state = STATE_IDLE
+
+    def process_exited(self, exit_code: Optional[int]):
+        """
+        プロセスが終了したときに呼ぶ
+
+        Args:
+            exit_code: 終了コード (分からない場合は None)
+        """
+        with self._lock:
+            requested = self._stop_requested
+            started_at = self._started_at
+            self._started_at = None
+        if requested or started_at is None:
+            return
+
+        cfg = self._get_config()
+        report_path = find_crash_report(self._data_dir(), started_at)
+        # コンソールから 'stop' を入力した場合など、正常に終了した場合はクラッシュとみなさない
+        if exit_code == 0 and report_path is None:
+            self._on_event('status_update', {'status': 'Stopped'})
+            return
+
+        now = time.monotonic()
+        window = cfg.get('crash_loop_window', 600)
+        with self._lock:
+            self._crash_times = [t for t in self._crash_times if now - t < window] + [now]
+            crash_count = len(self._crash_times)
+
+        entry = {
+            'time': time.time(),
+            'exit_code': exit_code,
+            'uptime': round(time.time() - started_at, 1),
+            'crash_report': read_crash_report(report_path) if report_path else None,
+            'console_tail': self._console_tail(cfg.get('crash_console_lines', 100)),
+            'recent_crashes': crash_count,
+        }
+
+        restart_in = None
+        if not cfg.get('crash_auto_restart', True):
+            action = "disabled"
+        elif crash_count > cfg.get('crash_loop_limit', 3):
+            action = "tripped"
+        else:
+            action = "restart"
+            base = cfg.get('crash_restart_delay', 10)
+            restart_in = min(base * 2 ** (crash_count - 1), cfg.get('crash_restart_max_delay', 300))
+        entry['action'] = action
+        entry['restart_in'] = restart_in
+        self._record(entry)
+
+        description = (entry['crash_report'] or {}).get('description')
+        summary = f"サーバーがクラッシュしました (終了コード: {exit_code}"
+        summary += f", {description})" if description else ")"
+        self._on_event('status_update', {'status': 'Stopped'})
+        self._on_event('console_output', {'log': summary})
+        if action == "restart":
+            self._on_event('console_output', {'log': f"{restart_in} 秒後にサーバーを自動で再起動します..."})
+        elif action == "tripped":
+            self._on_event('console_output', {
+                'log': f"{window} 秒間に {crash_count} 回クラッシュしたため、自動再起動を停止しました。"
+                       f"原因を確認してから手動で起動してください。"
+            })
+        self._on_event('server_crashed', {
+            key: value for key, value in entry.items() if key != 'console_tail'
+        })
+
+        with self._lock:
+            if action == "restart":
+                self._state = STATE_WAITING
+                self._restart_at = time.time() + restart_in
+                self._timer = threading.Timer(restart_in, self._fire)
+                self._timer.daemon = True
+                self._timer.start()
+            else:
+                self._state = STATE_TRIPPED if action == "tripped" else STATE_IDLE
+
+    def _fire(self):
+        with self._lock:
+            if self._state != STATE_WAITING:
+                return
+            self._timer = None
+            self._restart_at = None
+            self._auto_restarting = True
+        try:
+            ok = self._restart()
+        except Exception as e:
+            print(f"サーバーの自動再起動中にエラーが発生しました: {e}")
+            ok = False
+        finally:
+            with self._lock:
+                self._auto_restarting = False
+        if not ok:
+            with self._lock:
+                self._state = STATE_IDLE
+            self._on_event('console_output', {'log': "ERROR: サーバーの自動再起動に失敗しました。"})
+
+    def _cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = None
+        self._restart_at = None
+
+    def _history_path(self) -> str:
+        return os.path.join(self._data_dir(), CRASH_HISTORY_FILE)
+
+    def _record(self, entry: Dict):
+        path = self._history_path()
+        crashes = load_crashes(path)
+        crashes.append(entry)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(crashes[-CRASH_HISTORY_SIZE:], f, ensure_ascii=False, indent=2)
+        except IOError as e:
+            print(f"クラッシュの履歴を保存できませんでした: {e}")
+
+    def history(self, limit: int = 20) -> List[Dict]:
+        """新しい順にクラッシュの履歴を返す"""
+        return load_crashes(self._history_path())[::-1][:limit]
+
+    def state(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._state,
+                'restart_at': self._restart_at,
+                'recent_crashes': len(self._crash_times),
+            }
+
+    def reset(self):
+        """自動再起動の待機・停止状態を解除する"""
+        with self._lock:
+            self._cancel_timer()
+            self._crash_times.clear()
+            self._state = STATE_IDLE
+
+    def close(self):
+        with self._lock:
+            self._cancel_timer()
+            self._state = STATE_IDLE
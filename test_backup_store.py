@@ -0,0 +1,82 @@
+"""
+backup_store.py のテスト
+小さなワールド (conftest.py の world) のスナップショットを作り、内容・変更の検出・チャンクの削除を確認する
+"""
+import os
+
+import backup_store
+from conftest import CHUNK_TIME, FILE_TIME, read_world, region_chunk, write_file, write_region
+
+
+def _restore_files(backup_dir, manifest):
+    return {rel: b''.join(backup_store.read_file(backup_dir, manifest, rel)) for rel in manifest['files']}
+
+
+def test_snapshot_contents(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    files, empty_dirs = read_world(world)
+    assert _restore_files(backup_dir, manifest) == {rel: data for rel, (data, _) in files.items()}
+    assert {rel: entry['mtime_ns'] for rel, entry in manifest['files'].items()} == \
+        {rel: mtime for rel, (_, mtime) in files.items()}
+    assert manifest['dirs'] == empty_dirs == ["poi"]
+    # リージョンファイルはチャンクごとに保存する
+    assert manifest['files']['region/r.0.0.mca'].get('region')
+    assert manifest['stats']['region_chunks'] == 2
+
+
+def test_second_snapshot_reuses_unchanged_files(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    first = backup_store.create_snapshot(world, backup_dir)
+    second = backup_store.create_snapshot(world, backup_dir)
+    assert second['parent'] == os.path.basename(first['path'])
+    stats = second['stats']
+    assert stats['unchanged_files'] == stats['files'] == len(first['files'])
+    assert stats['read_bytes'] == 0
+    assert stats['new_chunks'] == 0
+
+
+def test_region_chunks_reread_only_when_changed(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    region = os.path.join(world, "region", "r.0.0.mca")
+    backup_store.create_snapshot(world, backup_dir)
+    # チャンク 1 だけを書き換える
+    write_region(region, [(0, CHUNK_TIME, region_chunk(b"a" * 5000)),
+                          (1, CHUNK_TIME + 200, region_chunk(b"c" * 6000))], mtime=FILE_TIME + 200)
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    assert manifest['stats']['region_chunks_unchanged'] == 1
+    with open(region, 'rb') as f:
+        assert b''.join(backup_store.read_file(backup_dir, manifest, "region/r.0.0.mca")) == f.read()
+
+
+def test_region_chunk_with_same_timestamp_but_new_data_is_reread(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    region = os.path.join(world, "region", "r.0.0.mca")
+    backup_store.create_snapshot(world, backup_dir)
+    # 最終更新時刻は秒単位のため、同じ秒のうちに書き直されたチャンクは時刻が変わらない
+    write_region(region, [(0, CHUNK_TIME, region_chunk(b"a" * 5000)),
+                          (1, CHUNK_TIME, region_chunk(b"b" * 4000 + os.urandom(500)))], mtime=FILE_TIME + 1)
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    assert manifest['stats']['region_chunks_unchanged'] == 1
+    with open(region, 'rb') as f:
+        assert b''.join(backup_store.read_file(backup_dir, manifest, "region/r.0.0.mca")) == f.read()
+
+
+def test_delete_snapshot_leaves_no_orphan_chunks(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    first = backup_store.create_snapshot(world, backup_dir)
+    write_file(os.path.join(world, "data", "raids.dat"), os.urandom(3000), mtime=FILE_TIME + 1)
+    second = backup_store.create_snapshot(world, backup_dir)
+    store = backup_store.chunk_store(backup_dir)
+
+    result = backup_store.delete_snapshot(backup_dir, os.path.basename(first['path']))
+    assert result['removed_chunks'] == 1
+    referenced = {digest for entry in second['files'].values() for digest in backup_store.entry_digests(store, entry)}
+    assert set(store.digests()) == referenced
+    # 残ったスナップショットはそのまま読み込める
+    backup_store.check_snapshot(backup_dir, second)
+    files, _ = read_world(world)
+    assert _restore_files(backup_dir, second) == {rel: data for rel, (data, _) in files.items()}
+
+    backup_store.delete_snapshot(backup_dir, os.path.basename(second['path']))
+    assert list(store.digests()) == []
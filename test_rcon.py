@@ -0,0 +1,218 @@
+"""
+rcon.py のテスト
+ローカルで起動したRCONサーバーのふり (FakeRconServer) に接続して確認する
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+from command_channel import CommandCorrelator
+from log_parser import LogEventBus, parse_line
+from rcon import (SERVERDATA_AUTH, SERVERDATA_AUTH_RESPONSE, SERVERDATA_EXECCOMMAND,
+                  SERVERDATA_RESPONSE_VALUE, RconAuthException, RconClient, RconConnection,
+                  RconException, RconReplyLostException, encode_packet, read_packet, strip_formatting)
+
+PASSWORD = "secret"
+LONG_RESPONSE = "x" * 10000
+
+
+class FakeRconServer:
+    """Minecraftと同じように応答するRCONサーバー (4096バイトごとに分割し、不明な種類には Unknown request を返す)"""
+
+    def __init__(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen()
+        self.port = self._listener.getsockname()[1]
+        self.commands = []
+        self.connections = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(conn)
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _send(self, conn, request_id, packet_type, body):
+        conn.sendall(encode_packet(request_id, packet_type, body))
+
+    def _serve(self, conn):
+        authed = False
+        try:
+            while True:
+                request_id, packet_type, body = read_packet(conn)
+                if packet_type == SERVERDATA_AUTH:
+                    authed = body == PASSWORD
+                    self._send(conn, request_id if authed else -1, SERVERDATA_AUTH_RESPONSE, "")
+                elif not authed:
+                    return
+                elif packet_type == SERVERDATA_EXECCOMMAND:
+                    self.commands.append(body)
+                    if body == "slow":
+                        time.sleep(1)
+                    response = LONG_RESPONSE if body == "long" else f"§aRan: {body}"
+                    for i in range(0, len(response), 4096):
+                        self._send(conn, request_id, SERVERDATA_RESPONSE_VALUE, response[i:i + 4096])
+                else:
+                    self._send(conn, request_id, SERVERDATA_RESPONSE_VALUE, f"Unknown request {packet_type:x}")
+        except (OSError, RconException):
+            pass
+        finally:
+            conn.close()
+
+    def drop_clients(self):
+        """接続中のクライアントをすべて切断する (サーバーの再起動を想定)"""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for conn in clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def close(self):
+        self._listener.close()
+        self.drop_clients()
+
+
+@pytest.fixture
+def server():
+    fake = FakeRconServer()
+    yield fake
+    fake.close()
+
+
+def test_packet_roundtrip():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(encode_packet(7, SERVERDATA_EXECCOMMAND, "say こんにちは"))
+        assert read_packet(b) == (7, SERVERDATA_EXECCOMMAND, "say こんにちは")
+    finally:
+        a.close()
+        b.close()
+
+
+def test_command_response(server):
+    client = RconClient("127.0.0.1", server.port, PASSWORD, timeout=2)
+    client.connect()
+    try:
+        assert client.command("list") == "§aRan: list"
+        assert strip_formatting(client.command("tps")) == "Ran: tps"
+        # 4096バイトを超える応答は連結して返す
+        assert client.command("long") == LONG_RESPONSE
+    finally:
+        client.close()
+    assert server.commands == ["list", "tps", "long"]
+
+
+def test_wrong_password(server):
+    client = RconClient("127.0.0.1", server.port, "wrong", timeout=2)
+    with pytest.raises(RconAuthException):
+        client.connect()
+    assert not client.connected
+
+
+def test_connection_reconnects(server):
+    connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=2)
+    try:
+        assert connection.command("first") == "§aRan: first"
+        server.drop_clients()
+        # 切断された接続は次の送信時に1回だけ再接続する
+        assert connection.command("second") == "§aRan: second"
+        assert connection.reconnects == 1
+        assert server.connections == 2
+    finally:
+        connection.close()
+
+
+def test_connection_does_not_resend_after_reply_lost(server):
+    connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=0.3)
+    try:
+        # 送信した後に応答が届かなかったコマンドは、サーバーで実行された可能性があるため再送しない
+        with pytest.raises(RconReplyLostException):
+            connection.command("slow")
+        assert server.commands == ["slow"]
+        assert connection.reconnects == 0
+    finally:
+        connection.close()
+
+
+def test_connection_backoff_when_unreachable():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    connection = RconConnection("127.0.0.1", port, PASSWORD, timeout=1)
+    with pytest.raises(RconException):
+        connection.command("list")
+    # 接続に失敗した後はしばらく再接続を控える
+    assert not connection.available()
+    connection.reset_backoff()
+    assert connection.available()
+
+
+def test_correlator_uses_direct_response(server):
+    connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=2)
+    sent = []
+    correlator = CommandCorrelator(
+        LogEventBus(),
+        send_command=lambda cmd: sent.append(cmd) or True,
+        execute=lambda cmd, timeout: strip_formatting(connection.command(cmd, timeout))
+    )
+    try:
+        result = correlator.send_and_wait("save-all", until=lambda record: "save-all" in record.message)
+    finally:
+        connection.close()
+    assert result.sent and result.complete
+    assert [record.message for record in result.lines] == ["Ran: save-all"]
+    # 応答を直接受け取れた場合は標準入力には送らない
+    assert sent == []
+
+
+def test_correlator_waits_for_slow_reply(server):
+    # 接続の待ち時間より時間のかかるコマンドでも、呼び出し元の timeout まで応答を待つ
+    connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=0.3)
+    correlator = CommandCorrelator(
+        LogEventBus(),
+        send_command=lambda cmd: True,
+        execute=lambda cmd, timeout: strip_formatting(connection.command(cmd, timeout))
+    )
+    try:
+        result = correlator.send_and_wait("slow", timeout=3, until=lambda record: "slow" in record.message)
+    finally:
+        connection.close()
+    assert result.complete
+    assert [record.message for record in result.lines] == ["Ran: slow"]
+
+
+def test_correlator_falls_back_to_console_after_reply_lost(server):
+    connection = RconConnection("127.0.0.1", server.port, PASSWORD, timeout=2)
+    events = LogEventBus()
+    sent = []
+    correlator = CommandCorrelator(
+        events,
+        send_command=lambda cmd: sent.append(cmd) or True,
+        execute=lambda cmd, timeout: strip_formatting(connection.command(cmd, timeout))
+    )
+    # RCONの応答が届く前に、コンソールに完了の行が出力される
+    threading.Timer(0.2, lambda: events.publish(
+        parse_line("[12:00:00] [Server thread/INFO]: [Rcon: Saved the game]"))).start()
+    try:
+        result = correlator.send_and_wait("slow", timeout=0.5, until=lambda record: "Saved the game" in record.message)
+    finally:
+        connection.close()
+    assert result.sent and result.complete
+    assert "Saved the game" in result.lines[-1].message
+    # 応答を受け取れなかったコマンドは、RCONでも標準入力でも送り直さない
+    assert server.commands == ["slow"]
+    assert sent == []
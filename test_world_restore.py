@@ -0,0 +1,84 @@
+"""
+world_restore.py のテスト
+小さなワールド (conftest.py の world) をバックアップしてから書き換え、復元した内容と失敗したときの状態を確認する
+"""
+import glob
+import os
+
+import pytest
+
+import archive_writer
+import backup_store
+import world_restore
+from backup_store import BackupStoreException
+from conftest import FILE_TIME, read_world, write_file
+from world_restore import RestoreException
+
+
+def _change_world(world):
+    write_file(os.path.join(world, "level.dat"), b"changed", mtime=FILE_TIME + 1)
+    write_file(os.path.join(world, "new.dat"), b"new", mtime=FILE_TIME + 1)
+
+
+def test_restore_snapshot(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    expected = read_world(world)
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    _change_world(world)
+    reports = []
+    stats = world_restore.restore_world(backup_dir, os.path.basename(manifest['path']), world,
+                                        workers=2, on_progress=reports.append)
+    # 内容・更新時刻・空のフォルダが一致する
+    assert read_world(world) == expected
+    assert stats['files'] == len(expected[0])
+    assert reports[-1]['phase'] == world_restore.PHASE_DONE
+    # 入れ替えた後は、元のワールドも作業フォルダも残さない
+    assert not glob.glob(world + world_restore.OLD_SUFFIX + "-*")
+    assert not os.path.exists(world + world_restore.STAGING_SUFFIX)
+
+
+@pytest.mark.parametrize("fmt", archive_writer.available_formats())
+def test_restore_archive(world, tmp_path, fmt):
+    backup_dir = str(tmp_path / "backups")
+    os.makedirs(backup_dir)
+    name = "world_backup" + archive_writer.SUFFIXES[fmt]
+    expected_files, expected_dirs = read_world(world)
+    archive_writer.write_archive(world, os.path.join(backup_dir, name), fmt, workers=2)
+    _change_world(world)
+    world_restore.restore_world(backup_dir, name, world, workers=2)
+    files, dirs = read_world(world)
+    assert {rel: data for rel, (data, _) in files.items()} == {rel: data for rel, (data, _) in expected_files.items()}
+    assert dirs == expected_dirs == ["poi"]
+
+
+def _assert_unchanged(world, before):
+    assert read_world(world) == before
+    assert not os.path.exists(world + world_restore.STAGING_SUFFIX)
+    assert not glob.glob(world + world_restore.OLD_SUFFIX + "-*")
+
+
+def test_failed_restore_keeps_world(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    _change_world(world)
+    before = read_world(world)
+    # 展開の途中で壊れたチャンクを読み込む
+    store = backup_store.chunk_store(backup_dir)
+    digest = manifest['files']['data/raids.dat']['chunks'][0]
+    with open(store.path(digest), 'r+b') as f:
+        f.seek(10)
+        f.write(b"broken")
+    with pytest.raises(BackupStoreException):
+        world_restore.restore_world(backup_dir, os.path.basename(manifest['path']), world, workers=2)
+    _assert_unchanged(world, before)
+
+
+def test_restore_aborts_when_server_started(world, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    manifest = backup_store.create_snapshot(world, backup_dir)
+    _change_world(world)
+    before = read_world(world)
+    with pytest.raises(RestoreException):
+        world_restore.restore_world(backup_dir, os.path.basename(manifest['path']), world,
+                                    is_running=lambda: True)
+    _assert_unchanged(world, before)
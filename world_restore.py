@@ -0,0 +1,326 @@
+"""
+バックアップからのワールドの復元
+現在のワールドフォルダを残したまま、隣の作業フォルダにバックアップを展開して内容を確認し、
+最後にフォルダの名前を変えて入れ替える (途中で失敗しても元のワールドはそのまま残る)
+
+- スナップショット / zip: ファイルごとにスレッドプールで並列に展開する (大きいファイルから順に始める)
+- tar.zst / tar.lz4: 1つの圧縮ストリームのため、先頭から順に展開する
+展開中は、展開したバイト数 (tar の場合は読み込んだアーカイブのバイト数) を一定間隔で通知する
+"""
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import archive_writer
+import backup_store
+
+STAGING_SUFFIX = ".restore-tmp"
+OLD_SUFFIX = ".old"
+# 進行状況を通知する間隔 (秒)
+PROGRESS_INTERVAL = 0.25
+# ファイルを読み書きする単位
+COPY_SIZE = 1024 * 1024
+
+PHASE_EXTRACTING = "extracting"
+PHASE_VERIFYING = "verifying"
+PHASE_SWAPPING = "swapping"
+PHASE_DONE = "done"
+
+
+class RestoreException(Exception):
+    """バックアップを復元できない場合の例外 (元のワールドはそのまま残る)"""
+    pass
+
+
+class _Progress:
+    """
+    展開したバイト数・ファイル数を集計し、一定間隔で on_progress に通知する
+    by_archive の場合は、書き込んだバイト数ではなく読み込んだアーカイブのバイト数 (add_read) で進行状況を表す
+    """
+
+    def __init__(self, total: int, total_files: Optional[int], on_progress: Optional[Callable[[Dict], None]],
+                 by_archive: bool = False):
+        self._on_progress = on_progress
+        self._by_archive = by_archive
+        self._lock = threading.Lock()
+        self._last = 0.0
+        self.phase = PHASE_EXTRACTING
+        self.total = total
+        self.total_files = total_files
+        self.done = 0
+        self.files = 0
+        self.bytes = 0
+
+    def snapshot(self) -> Dict:
+        return {'phase': self.phase, 'done': self.done, 'total': self.total,
+                'files': self.files, 'total_files': self.total_files}
+
+    def add_written(self, count: int, files: int = 0):
+        """ファイルに書き込んだバイト数と、書き込みを終えたファイルの数を加える"""
+        self._add(0 if self._by_archive else count, count, files)
+
+    def add_read(self, count: int):
+        """読み込んだアーカイブのバイト数を加える"""
+        if self._by_archive:
+            self._add(count, 0, 0)
+
+    def _add(self, done: int, written: int, files: int):
+        with self._lock:
+            self.done += done
+            self.bytes += written
+            self.files += files
+            now = time.monotonic()
+            if now - self._last < PROGRESS_INTERVAL:
+                return
+            self._last = now
+            report = self.snapshot()
+        self._notify(report)
+
+    def set_phase(self, phase: str):
+        """フェーズを進め、すぐに通知する"""
+        with self._lock:
+            self.phase = phase
+            report = self.snapshot()
+        self._notify(report)
+
+    def _notify(self, report: Dict):
+        if self._on_progress is None:
+            return
+        try:
+            self._on_progress(report)
+        except Exception as e:
+            print(f"復元の進行状況の通知中にエラーが発生しました: {e}")
+
+
+# (ワールドフォルダからの相対パス, 展開後のサイズ, 更新時刻 (ns), 内容を先頭から順に返す関数)
+_Entry = Tuple[str, int, int, Callable[[], Iterator[bytes]]]
+
+
+def _target(root: str, rel: str) -> str:
+    """展開先のパス (root の外を指す場合は例外)"""
+    dest = os.path.abspath(os.path.join(root, *rel.split('/')))
+    if not dest.startswith(root + os.sep):
+        raise RestoreException(f"不正なパスが含まれています: {rel}")
+    return dest
+
+
+def _write_file(staging: str, entry: _Entry, progress: _Progress):
+    rel, _, mtime_ns, contents = entry
+    dest = _target(staging, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(dest, 'wb') as f:
+        for data in contents():
+            f.write(data)
+            progress.add_written(len(data))
+    os.utime(dest, ns=(mtime_ns, mtime_ns))
+    progress.add_written(0, files=1)
+
+
+def _extract_parallel(staging: str, entries: List[_Entry], workers: int, progress: _Progress):
+    """ファイルをスレッドプールで並列に書き込む (1つでも失敗した場合は、まだ始まっていないものを取り消す)"""
+    # 大きいファイル (リージョンファイルなど) を先に始め、最後に1つだけ残る時間を短くする
+    entries = sorted(entries, key=lambda entry: entry[1], reverse=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_write_file, staging, entry, progress) for entry in entries]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            future.result()
+
+
+def _snapshot_entries(backup_dir: str, name: str) -> Tuple[List[_Entry], List[str]]:
+    manifest = backup_store.load_manifest(backup_dir, name)
+    # 展開を始める前に、必要なチャンクがすべてあることを確認する
+    backup_store.check_snapshot(backup_dir, manifest)
+    store = backup_store.chunk_store(backup_dir)
+    entries = [(rel, backup_store.restored_size(store, entry), entry['mtime_ns'],
+                # チャンクは読み込むときに SHA-256 を確認する
+                lambda rel=rel: backup_store.read_file(backup_dir, manifest, rel))
+               for rel, entry in manifest['files'].items()]
+    return entries, list(manifest.get('dirs', []))
+
+
+class _ZipReaders:
+    """スレッドごとに ZipFile を開く (1つの ZipFile を複数のスレッドから同時に読み込まない)"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: List[zipfile.ZipFile] = []
+
+    def contents(self, info: zipfile.ZipInfo) -> Iterator[bytes]:
+        z = getattr(self._local, 'zip', None)
+        if z is None:
+            z = self._local.zip = zipfile.ZipFile(self._path, 'r')
+            with self._lock:
+                self._opened.append(z)
+        # 最後まで読み込んだときに CRC-32 を確認し、一致しない場合は BadZipFile になる
+        with z.open(info) as f:
+            while True:
+                data = f.read(COPY_SIZE)
+                if not data:
+                    return
+                yield data
+
+    def close(self):
+        with self._lock:
+            for z in self._opened:
+                z.close()
+            self._opened.clear()
+
+
+def _zip_entries(z: zipfile.ZipFile, readers: _ZipReaders) -> Tuple[List[_Entry], List[str]]:
+    entries, dirs = [], []
+    for info in z.infolist():
+        if info.is_dir():
+            dirs.append(info.filename.rstrip('/'))
+            continue
+        mtime_ns = int(time.mktime(info.date_time + (0, 0, -1)) * 1e9)
+        entries.append((info.filename, info.file_size, mtime_ns, lambda info=info: readers.contents(info)))
+    return entries, dirs
+
+
+def _extract_tar(path: str, staging: str, progress: _Progress) -> Dict[str, int]:
+    """tar を先頭から順に展開し、展開したファイルとサイズを返す (通常のファイルとフォルダ以外は展開しない)"""
+    sizes = {}
+    with archive_writer.open_tar(path, on_read=progress.add_read) as tar:
+        for member in tar:
+            rel = member.name[2:] if member.name.startswith('./') else member.name
+            if member.isdir():
+                os.makedirs(_target(staging, rel), exist_ok=True)
+                continue
+            if not member.isfile():
+                print(f"通常のファイルではないため、展開しません: {member.name}")
+                continue
+            f = tar.extractfile(member)
+            contents = lambda: iter(lambda: f.read(COPY_SIZE), b'')
+            _write_file(staging, (rel, member.size, int(member.mtime * 1e9), contents), progress)
+            sizes[rel] = member.size
+    return sizes
+
+
+def _verify(staging: str, sizes: Dict[str, int]):
+    """展開したファイルがすべてあり、サイズが一致することを確認する"""
+    for rel, size in sizes.items():
+        path = _target(staging, rel)
+        try:
+            actual = os.path.getsize(path)
+        except OSError:
+            raise RestoreException(f"展開したファイルが見つかりません: {rel}")
+        if actual != size:
+            raise RestoreException(f"展開したファイルのサイズが一致しません: {rel} ({actual} / {size} バイト)")
+
+
+def _swap(world: str, staging: str) -> Optional[str]:
+    """
+    作業フォルダをワールドフォルダに入れ替える
+    元のワールドは名前を変えて残し、作業フォルダの名前の変更に失敗した場合は元に戻す
+
+    Returns:
+        名前を変えた元のワールドフォルダ (元のワールドがなかった場合は None)
+    """
+    old = None
+    if os.path.exists(world):
+        old = f"{world}{OLD_SUFFIX}-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.replace(world, old)
+    try:
+        os.replace(staging, world)
+    except OSError:
+        if old is not None:
+            os.replace(old, world)
+        raise
+    return old
+
+
+def restore_world(backup_dir: str, name: str, world: str, workers: Optional[int] = None,
+                  on_progress: Optional[Callable[[Dict], None]] = None,
+                  is_running: Optional[Callable[[], bool]] = None) -> Dict:
+    """
+    バックアップ (スナップショットまたはアーカイブ) の内容でワールドフォルダを置き換える
+    展開中はワールドフォルダと同じ場所に <world>.restore-tmp を作るため、ワールドと同じだけの空き容量が必要
+
+    Args:
+        backup_dir: バックアップフォルダ
+        name: スナップショットのマニフェスト、またはアーカイブのファイル名
+        world: ワールドフォルダ
+        workers: 並列に展開するスレッドの数 (省略時は CPU のコア数)
+        on_progress: phase, done, total (バイト数), files, total_files を含む辞書を受け取る関数
+        is_running: サーバーが起動中なら True を返す関数 (入れ替えの直前に確認し、起動中なら中止する)
+
+    Returns:
+        format, files, bytes (展開したサイズ), duration (秒), mb_per_s, workers を含む辞書
+
+    Raises:
+        RestoreException: 展開したファイルが正しくない場合や、入れ替えの前にサーバーが起動した場合
+        BackupStoreException / ArchiveException: バックアップを読み込めない場合
+        (どの場合も元のワールドはそのまま残る)
+    """
+    if os.path.basename(name) != name:
+        raise RestoreException(f"バックアップファイル名が正しくありません: {name}")
+    path = os.path.join(backup_dir, name)
+    fmt = 'snapshot' if backup_store.is_snapshot_name(name) else archive_writer.archive_format(name)
+    if fmt is None:
+        raise RestoreException(f"バックアップの形式ではありません: {name}")
+    workers = workers or archive_writer.default_workers()
+    world = os.path.abspath(world)
+    staging = world + STAGING_SUFFIX
+    started = time.perf_counter()
+    # 前回中断した復元の作業フォルダが残っていれば削除する
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    readers = None
+    try:
+        if fmt == 'snapshot' or fmt == archive_writer.FORMAT_ZIP:
+            if fmt == 'snapshot':
+                entries, dirs = _snapshot_entries(backup_dir, name)
+            else:
+                readers = _ZipReaders(path)
+                with zipfile.ZipFile(path, 'r') as z:
+                    entries, dirs = _zip_entries(z, readers)
+            progress = _Progress(sum(entry[1] for entry in entries), len(entries), on_progress)
+            progress.set_phase(PHASE_EXTRACTING)
+            for rel in dirs:
+                os.makedirs(_target(staging, rel), exist_ok=True)
+            _extract_parallel(staging, entries, workers, progress)
+            sizes = {entry[0]: entry[1] for entry in entries}
+        else:
+            workers = 1
+            progress = _Progress(os.path.getsize(path), None, on_progress, by_archive=True)
+            progress.set_phase(PHASE_EXTRACTING)
+            sizes = _extract_tar(path, staging, progress)
+        progress.set_phase(PHASE_VERIFYING)
+        _verify(staging, sizes)
+        # 起動中のサーバーのワールドを入れ替えると、サーバーの書き込みが失われる
+        if is_running is not None and is_running():
+            raise RestoreException("展開中にサーバーが起動したため、復元を中止しました。")
+        progress.set_phase(PHASE_SWAPPING)
+        old = _swap(world, staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    finally:
+        if readers is not None:
+            readers.close()
+    if old is not None:
+        try:
+            shutil.rmtree(old)
+        except OSError as e:
+            print(f"元のワールドフォルダ '{old}' を削除できませんでした: {e}")
+    progress.set_phase(PHASE_DONE)
+    duration = time.perf_counter() - started
+    return {
+        'format': fmt,
+        'files': progress.files,
+        'bytes': progress.bytes,
+        'duration': round(duration, 3),
+        'mb_per_s': round(progress.bytes / 1024 / 1024 / duration, 1) if duration > 0 else None,
+        'workers': workers,
+    }